@@ -4,11 +4,11 @@
 This module configures logging and starts the executor's driver thread.
 """
 
-import faulthandler
+import asyncio
 import logging
 import signal
 import sys
-from threading import Event, Timer
+from threading import Event
 
 import os
 
@@ -19,7 +19,9 @@ import encodings.idna
 
 import cook.config as cc
 import cook.executor as ce
+import cook.instrumentation as cins
 import cook.io_helper as cio
+import cook.loop as cl
 import cook.util as cu
 import pymesos as pm
 
@@ -46,14 +48,24 @@ def main(args=None):
 
     config = cc.initialize_config(environment)
 
-    def print_memory_usage_task():
-        cu.print_memory_usage()
-        timer = Timer(config.memory_usage_interval_secs, print_memory_usage_task)
-        timer.daemon = True
-        timer.start()
-    print_memory_usage_task()
+    async def print_memory_usage_task():
+        while True:
+            cu.print_memory_usage()
+            await asyncio.sleep(config.memory_usage_interval_secs)
+    cl.get_executor_loop().submit(print_memory_usage_task())
+
+    instrumentation_file = config.sandbox_file(cins.INSTRUMENTATION_FILE_NAME)
+
+    async def write_instrumentation_task():
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(config.instrumentation_interval_secs)
+            await loop.run_in_executor(None, cins.write_snapshot, instrumentation_file)
+    if config.instrumentation_interval_secs:
+        cins.set_timers_enabled(True)
+        cl.get_executor_loop().submit(write_instrumentation_task())
 
-    stop_signal = Event()
+    stop_signal = cl.LoopEvent()
     non_zero_exit_signal = Event()
 
     def handle_interrupt(interrupt_code, _):
@@ -68,10 +80,22 @@ def main(args=None):
     signal.signal(signal.SIGTERM, handle_interrupt)
 
     def dump_traceback(signal, frame):
+        import faulthandler
         faulthandler.dump_traceback()
+        cl.get_executor_loop().loop.call_soon_threadsafe(cins.write_snapshot, instrumentation_file)
 
     signal.signal(signal.SIGUSR1, dump_traceback)
 
+    def toggle_profiling():
+        # runs on the executor loop, whose thread is profiled along with the threads calling cins.profile_thread
+        cins.toggle_profiling(config.sandbox_directory or '.')
+        cins.profile_thread('loop')
+
+    def handle_profiling_toggle(signal, frame):
+        cl.get_executor_loop().loop.call_soon_threadsafe(toggle_profiling)
+
+    signal.signal(signal.SIGUSR2, handle_profiling_toggle)
+
     try:
         executor = ce.CookExecutor(stop_signal, config)
         driver = pm.MesosExecutorDriver(executor)
@@ -92,6 +116,8 @@ def main(args=None):
         non_zero_exit_signal.set()
 
     cu.print_memory_usage()
+    if config.instrumentation_interval_secs:
+        cins.write_snapshot(instrumentation_file)
     exit_code = 1 if non_zero_exit_signal.isSet() else 0
     logging.info('Executor exiting with code {}'.format(exit_code))
     sys.exit(exit_code)
@@ -0,0 +1,201 @@
+"""This module runs a task in a child cgroup v2 of the executor's cgroup.
+All the processes of the task are created inside the cgroup, so its process tree can be killed with a single write
+to cgroup.kill (Linux 5.14+), or frozen with cgroup.freeze (Linux 5.2+) while every member is signalled, without
+racing with the forks of the task."""
+
+import logging
+import os
+import re
+import signal
+import time
+
+import cook.instrumentation as cins
+
+CGROUP2_FILESYSTEM_TYPE = 'cgroup2'
+FREEZE_POLL_INTERVAL_SECS = 0.001
+FREEZE_TIMEOUT_SECS = 1
+
+
+def find_cgroup_directory():
+    """Returns the directory of the cgroup v2 the executor runs in.
+
+    Returns
+    -------
+    the directory, or None when no cgroup v2 hierarchy is mounted or the executor's cgroup is not visible in it.
+    """
+    mount_root, mount_point = None, None
+    try:
+        with open('/proc/self/mountinfo') as mountinfo_file:
+            for line in mountinfo_file:
+                # the optional fields end at ' - ', which is followed by the filesystem type
+                mount_fields, _, filesystem_fields = line.partition(' - ')
+                if filesystem_fields.split(' ', 1)[0] == CGROUP2_FILESYSTEM_TYPE:
+                    mount_root, mount_point = mount_fields.split()[3:5]
+                    break
+        if mount_point is None:
+            return None
+        with open('/proc/self/cgroup') as cgroup_file:
+            cgroup_paths = [line[3:].strip() for line in cgroup_file if line.startswith('0::')]
+    except OSError:
+        logging.exception('Unable to find the cgroup of the executor')
+        return None
+    if not cgroup_paths:
+        return None
+    relative_path = os.path.relpath(cgroup_paths[0], mount_root)
+    if relative_path.startswith('..'):
+        return None
+    return os.path.normpath(os.path.join(mount_point, relative_path))
+
+
+class TaskCgroup(object):
+    """A child cgroup v2 holding the processes of a task, see create."""
+
+    @staticmethod
+    def create(name, parent_directory=None):
+        """Creates the cgroup of a task under the executor's cgroup.
+
+        Parameters
+        ----------
+        name: string
+            The name of the task, e.g. its id.
+        parent_directory: string
+            The directory of the parent cgroup, defaults to the executor's cgroup, see find_cgroup_directory.
+
+        Returns
+        -------
+        the TaskCgroup, or None when cgroup v2 is not available or the parent cgroup is not delegated to the executor.
+        """
+        parent_directory = parent_directory or find_cgroup_directory()
+        if parent_directory is None:
+            logging.info('No cgroup v2 hierarchy is available to run the task in')
+            return None
+        path = os.path.join(parent_directory, 'cook-{}'.format(re.sub('[^A-Za-z0-9_.-]', '_', name)))
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError as error:
+            logging.info('Unable to create cgroup {}: {}'.format(path, error))
+            return None
+        logging.info('Task processes will run in cgroup {}'.format(path))
+        return TaskCgroup(path)
+
+    def __init__(self, path):
+        self.path = path
+
+    def __write(self, file_name, value):
+        fd = os.open(os.path.join(self.path, file_name), os.O_WRONLY)
+        try:
+            os.write(fd, value)
+        finally:
+            os.close(fd)
+
+    def __read_events(self):
+        with open(os.path.join(self.path, 'cgroup.events')) as events_file:
+            return dict(line.split() for line in events_file)
+
+    def add_current_process(self):
+        """Moves the calling process into the cgroup.
+        It is called by the task's process between fork and exec, so that all the task's descendants are created
+        inside the cgroup. It only uses system calls as it runs in the forked child."""
+        self.__write('cgroup.procs', b'0')
+
+    def process_ids(self):
+        """Returns the ids of the processes in the cgroup."""
+        try:
+            with open(os.path.join(self.path, 'cgroup.procs')) as procs_file:
+                return [int(line) for line in procs_file if line.strip()]
+        except OSError:
+            return []
+
+    def is_populated(self):
+        """Returns true if a process is running in the cgroup."""
+        try:
+            return self.__read_events().get('populated') == '1'
+        except OSError:
+            return False
+
+    def kill(self):
+        """Sends SIGKILL to every process of the cgroup at once.
+
+        Returns
+        -------
+        True if the kernel supports cgroup.kill and the processes were killed.
+        """
+        try:
+            self.__write('cgroup.kill', b'1')
+            return True
+        except FileNotFoundError:
+            return False
+        except OSError:
+            logging.exception('Error in killing cgroup {}'.format(self.path))
+            return False
+
+    def freeze(self, frozen, timeout_secs=FREEZE_TIMEOUT_SECS):
+        """Freezes or thaws the processes of the cgroup, freezing completes asynchronously in the kernel.
+
+        Returns
+        -------
+        True if the cgroup reached the requested state within timeout_secs.
+        """
+        try:
+            self.__write('cgroup.freeze', b'1' if frozen else b'0')
+            deadline = time.time() + timeout_secs
+            while self.__read_events().get('frozen') != ('1' if frozen else '0'):
+                if time.time() >= deadline:
+                    logging.info('Cgroup {} did not reach frozen={} in {} seconds'.format(
+                        self.path, frozen, timeout_secs))
+                    return False
+                time.sleep(FREEZE_POLL_INTERVAL_SECS)
+            return True
+        except FileNotFoundError:
+            return False
+        except OSError:
+            logging.exception('Error in setting frozen={} on cgroup {}'.format(frozen, self.path))
+            return False
+
+    @cins.timed('cgroup.signal')
+    def send_signal(self, signal_to_send):
+        """Sends signal_to_send to every process in the cgroup.
+        SIGKILL uses cgroup.kill, other signals are sent while the cgroup is frozen so that no process can fork.
+
+        Returns
+        -------
+        True if the signal was sent to the processes, False if the cgroup is empty or cannot be signalled.
+        """
+        signal_name = signal_to_send.name
+        if not self.is_populated():
+            return False
+        if signal_to_send == signal.SIGKILL and self.kill():
+            logging.info('Sent {} to cgroup {}'.format(signal_name, self.path))
+            return True
+        if not self.freeze(True):
+            self.freeze(False)
+            return False
+        try:
+            process_ids = self.process_ids()
+            num_processes_signalled = 0
+            for process_id in process_ids:
+                try:
+                    os.kill(process_id, signal_to_send)
+                    num_processes_signalled += 1
+                except ProcessLookupError:
+                    pass
+            logging.info('Sent {} to {} process(es) of frozen cgroup {}'.format(
+                signal_name, num_processes_signalled, self.path))
+            return num_processes_signalled > 0
+        finally:
+            # the pending signal is delivered once the processes are thawed
+            self.freeze(False)
+
+    def remove(self, timeout_secs=0):
+        """Removes the cgroup once its processes, waited for up to timeout_secs, have exited.
+        A cgroup still holding processes, e.g. daemons started by the task, is left in place."""
+        deadline = time.time() + timeout_secs
+        while self.is_populated() and time.time() < deadline:
+            time.sleep(FREEZE_POLL_INTERVAL_SECS * 10)
+        try:
+            os.rmdir(self.path)
+            logging.info('Removed cgroup {}'.format(self.path))
+        except FileNotFoundError:
+            pass
+        except OSError as error:
+            logging.info('Unable to remove cgroup {}: {}'.format(self.path, error))
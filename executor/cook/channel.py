@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+"""This module creates the progress location as a channel the task writes progress records to, instead of a file.
+A channel is either a named pipe (FIFO) or a unix datagram socket created at the progress location before the task is
+launched. The records are read without blocking and without touching the disk, see cook.progress.parse_progress_record.
+A channel mimics cook.io_helper.CapturedOutput so that the progress tracker reads it like the captured output.
+"""
+
+import logging
+import os
+import socket
+import stat
+
+CHANNEL_FIFO = 'fifo'
+CHANNEL_FILE = 'file'
+CHANNEL_SOCKET = 'socket'
+
+# Upper bound on the size of a single datagram, larger datagrams are truncated
+MAX_DATAGRAM_BYTES = 64 * 1024
+
+
+def location_is_live(path, mode):
+    """Returns true if the channel at path is still read, e.g. it is the channel of a task that is running."""
+    if stat.S_ISFIFO(mode):
+        try:
+            # opening a named pipe for writing without blocking fails with ENXIO when it has no reader
+            os.close(os.open(path, os.O_WRONLY | os.O_NONBLOCK))
+            return True
+        except OSError:
+            return False
+    if stat.S_ISSOCK(mode):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            # connecting to a datagram socket fails with ECONNREFUSED when it is no longer bound
+            probe.connect(path)
+            return True
+        except OSError:
+            return False
+        finally:
+            probe.close()
+    return False
+
+
+def remove_stale_location(path):
+    """Removes the channel or file left at path, e.g. by a previous task, so that the channel can be created.
+    A channel that is still read, e.g. by a task running concurrently, is not stale and is never removed."""
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if stat.S_ISDIR(mode):
+        raise IsADirectoryError('Unable to create a progress channel at {}, it is a directory'.format(path))
+    if location_is_live(path, mode):
+        raise FileExistsError('Unable to create a progress channel at {}, it is in use'.format(path))
+    logging.info('Removing the existing progress location {}'.format(path))
+    os.unlink(path)
+
+
+def unlink_channel(path, channel_stat):
+    """Removes the channel at path unless it has been replaced, e.g. by the channel of another task."""
+    try:
+        if os.path.samestat(os.lstat(path), channel_stat):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class FifoChannel(object):
+    """A named pipe the task writes progress records to, one record per line.
+    The executor keeps the pipe open for writing too, so that the records written by short lived writers, e.g.
+    `echo ... > $EXECUTOR_PROGRESS_OUTPUT_FILE`, never make the reads observe the end of the pipe."""
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path: string
+            The location the named pipe is created at.
+        """
+        remove_stale_location(path)
+        os.mkfifo(path, 0o600)
+        self.path = path
+        self.path_stat = os.lstat(path)
+        self.name = 'fifo'
+        self.bytes_read = 0
+        self.eof = False
+        self.read_fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        self.write_fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+
+    def fileno(self):
+        """Returns the file descriptor of the read end, it becomes readable when records are available."""
+        return self.read_fd
+
+    def read(self, size):
+        """Reads up to size bytes of the available records.
+
+        Returns
+        -------
+        the data read, None when no record is currently available.
+        """
+        try:
+            data = os.read(self.read_fd, size)
+        except BlockingIOError:
+            return None
+        if not data:
+            self.eof = True
+            return data
+        self.bytes_read += len(data)
+        return data
+
+    def close(self):
+        """Closes the pipe and removes it from the progress location unless it has been replaced, can be called more
+        than once."""
+        if self.read_fd is None:
+            return
+        os.close(self.write_fd)
+        os.close(self.read_fd)
+        self.read_fd, self.write_fd = None, None
+        unlink_channel(self.path, self.path_stat)
+
+
+class DatagramChannel(object):
+    """A unix datagram socket the task sends progress records to, one record per datagram.
+    Datagrams are never merged or split, every datagram is read as one line."""
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path: string
+            The location the socket is bound to, it must be shorter than the platform limit (108 bytes on linux).
+        """
+        remove_stale_location(path)
+        self.path = path
+        self.name = 'socket'
+        self.bytes_read = 0
+        self.eof = False
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self.socket.bind(path)
+            os.chmod(path, 0o600)
+            self.path_stat = os.lstat(path)
+        except OSError:
+            self.socket.close()
+            raise
+        self.socket.setblocking(False)
+
+    def fileno(self):
+        """Returns the file descriptor of the socket, it becomes readable when records are available."""
+        return self.socket.fileno()
+
+    def read(self, size):
+        """Reads the available datagrams, stopping once at least size bytes have been read.
+        A newline is appended to every datagram that does not end with one.
+
+        Returns
+        -------
+        the data read, None when no record is currently available.
+        """
+        datagrams = []
+        num_bytes = 0
+        while num_bytes < size:
+            try:
+                datagram = self.socket.recv(MAX_DATAGRAM_BYTES)
+            except BlockingIOError:
+                break
+            if not datagram.endswith(b'\n'):
+                datagram += b'\n'
+            datagrams.append(datagram)
+            num_bytes += len(datagram)
+        if not datagrams:
+            return None
+        self.bytes_read += num_bytes
+        return b''.join(datagrams)
+
+    def close(self):
+        """Closes the socket and removes it from the progress location unless it has been replaced, can be called more
+        than once."""
+        if self.socket.fileno() < 0:
+            return
+        self.socket.close()
+        unlink_channel(self.path, self.path_stat)
+
+
+def create_channel(channel_type, path):
+    """Creates the progress channel of the requested type at path.
+
+    Parameters
+    ----------
+    channel_type: string
+        Either CHANNEL_FIFO or CHANNEL_SOCKET.
+    path: string
+        The progress location.
+
+    Returns
+    -------
+    the FifoChannel or DatagramChannel, raises an OSError when it cannot be created.
+    """
+    if channel_type == CHANNEL_FIFO:
+        return FifoChannel(path)
+    elif channel_type == CHANNEL_SOCKET:
+        return DatagramChannel(path)
+    else:
+        raise ValueError('Unknown progress channel {}'.format(channel_type))
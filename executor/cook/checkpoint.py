@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+"""This module checkpoints the progress tracking state of a task to a small file in the sandbox.
+The checkpoint holds the sequence value, and for every progress file its offset, its identity (device and inode) and
+its last progress state. It is written atomically on a throttled schedule by the progress tracker thread, so that an
+executor that recovers the task resumes tailing from the checkpointed offsets instead of rescanning the files, and
+keeps sending increasing sequence values.
+"""
+
+import json
+import logging
+import os
+import time
+from threading import Lock
+
+# Minimum time between two checkpoint writes
+DEFAULT_INTERVAL_SECS = 10
+
+
+def checkpoint_file(config, task_id):
+    """Returns the path of the progress checkpoint of the task, in the sandbox."""
+    return config.sandbox_file('executor-progress-checkpoint.{}.json'.format(task_id))
+
+
+def file_identity(path):
+    """Returns the [device, inode] pair identifying the file at path, None when it does not exist."""
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    return [stat_result.st_dev, stat_result.st_ino]
+
+
+def encode_progress(progress):
+    """Returns a json serializable copy of the progress state, its message is bytes."""
+    if progress is None:
+        return None
+    encoded_progress = dict(progress)
+    encoded_progress['progress-message'] = progress['progress-message'].decode('latin-1')
+    return encoded_progress
+
+
+def decode_progress(encoded_progress):
+    """Returns the progress state encoded by encode_progress."""
+    if encoded_progress is None:
+        return None
+    progress = dict(encoded_progress)
+    progress['progress-message'] = encoded_progress['progress-message'].encode('latin-1')
+    return progress
+
+
+def load_checkpoint(path, task_id):
+    """Loads the progress checkpoint written for the task.
+
+    Parameters
+    ----------
+    path: string
+        The path of the checkpoint, see checkpoint_file.
+    task_id: string
+        The id of the task.
+
+    Returns
+    -------
+    the checkpoint dictionary, None when there is no valid checkpoint for the task.
+    """
+    try:
+        with open(path) as checkpoint_file_obj:
+            checkpoint = json.load(checkpoint_file_obj)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logging.exception('Ignoring the unreadable progress checkpoint {}'.format(path))
+        return None
+    if not isinstance(checkpoint, dict) or checkpoint.get('task-id') != task_id:
+        logging.info('Ignoring the progress checkpoint {} written for another task'.format(path))
+        return None
+    logging.info('Loaded the progress checkpoint {} at sequence {}'.format(path, checkpoint['progress-sequence']))
+    return checkpoint
+
+
+def resume_location(checkpoint, location, default_offset):
+    """Returns the (offset, progress) pair to resume tracking location from.
+    The checkpointed offset is only used while the file is the one that was checkpointed and it has not been truncated,
+    default_offset and no progress are returned otherwise."""
+    location_state = checkpoint['locations'].get(location) if checkpoint else None
+    if location_state is None:
+        return default_offset, None
+    if file_identity(location) != location_state['identity']:
+        logging.info('Progress location {} was replaced since it was checkpointed'.format(location))
+        return default_offset, None
+    try:
+        file_size = os.path.getsize(location)
+    except OSError:
+        return default_offset, None
+    if location_state['offset'] > file_size:
+        logging.info('Progress location {} was truncated since it was checkpointed'.format(location))
+        return default_offset, None
+    return location_state['offset'], decode_progress(location_state['progress'])
+
+
+class ProgressCheckpointer(object):
+    """Writes the progress checkpoint of a task, at most once every interval_secs and only when it has changed.
+    Writes and the removal are serialized, the checkpoint is never written again once it has been removed."""
+
+    def __init__(self, path, task_id, interval_secs=DEFAULT_INTERVAL_SECS):
+        """
+        Parameters
+        ----------
+        path: string
+            The path of the checkpoint, see checkpoint_file.
+        task_id: string
+            The id of the task.
+        interval_secs: float
+            The minimum time between two writes.
+        """
+        self.path = path
+        self.task_id = task_id
+        self.interval_secs = interval_secs
+        self.last_checkpoint = None
+        self.last_write_time = None
+        self.num_writes = 0
+        self.removed = False
+        self.lock = Lock()
+
+    def maybe_write(self, watchers, sequence_counter):
+        """Writes the checkpoint of watchers when it has changed and enough time has elapsed since the last write.
+        Only the watchers that tail a file, see cook.progress.ProgressWatcher.offset, are checkpointed.
+
+        Returns
+        -------
+        True if the checkpoint was written.
+        """
+        with self.lock:
+            return self.__write(watchers, sequence_counter)
+
+    def __write(self, watchers, sequence_counter):
+        current_time = time.monotonic()
+        if self.removed:
+            return False
+        if self.last_write_time is not None and current_time - self.last_write_time < self.interval_secs:
+            return False
+        locations = {}
+        for watcher in watchers:
+            if watcher.offset is not None:
+                locations[watcher.target_file] = {'identity': watcher.file_identity,
+                                                  'offset': watcher.offset,
+                                                  'progress': encode_progress(watcher.current_progress())}
+        checkpoint = {'locations': locations,
+                      'progress-sequence': sequence_counter.value,
+                      'task-id': self.task_id}
+        if checkpoint == self.last_checkpoint:
+            return False
+        temporary_path = '{}.tmp'.format(self.path)
+        with open(temporary_path, 'w') as checkpoint_file_obj:
+            json.dump(checkpoint, checkpoint_file_obj)
+        os.replace(temporary_path, self.path)
+        self.last_checkpoint = checkpoint
+        self.last_write_time = current_time
+        self.num_writes += 1
+        return True
+
+    def remove(self):
+        """Removes the checkpoint, e.g. once the task has completed, it is not written again."""
+        with self.lock:
+            self.removed = True
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+        logging.info('Removed the progress checkpoint {} after {} writes'.format(self.path, self.num_writes))
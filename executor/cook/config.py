@@ -1,13 +1,50 @@
 #!/usr/bin/env python3
 
+import json
 import logging
 import os
+import re
 
 from pymesos.utils import parse_duration
 
+import cook.channel as cch
+import cook.progress as cp
+import cook.rotation as cr
+import cook.telemetry as ct
+
 DEFAULT_PROGRESS_FILE_ENV_VARIABLE = 'EXECUTOR_PROGRESS_OUTPUT_FILE'
 
 
+def parse_metric_patterns(metric_patterns_string):
+    """Parses the metric patterns, a json object mapping each metric name to a regex whose first capture group is the
+    metric value, e.g. {"rows": "rows processed: ([0-9]+)"}. Invalid patterns are skipped.
+
+    Returns
+    -------
+    the map from the metric names to their regex string.
+    """
+    if not metric_patterns_string:
+        return {}
+    try:
+        metric_patterns = json.loads(metric_patterns_string)
+    except ValueError:
+        logging.exception('Unable to parse the metric patterns {}'.format(metric_patterns_string))
+        return {}
+    if not isinstance(metric_patterns, dict):
+        logging.info('Skipping the metric patterns {} as they are not a json object'.format(metric_patterns_string))
+        return {}
+    valid_metric_patterns = {}
+    for name, regex_string in metric_patterns.items():
+        try:
+            if re.compile(regex_string).groups >= 1:
+                valid_metric_patterns[name] = regex_string
+            else:
+                logging.info('Skipping the metric {} as its regex {} has no capture group'.format(name, regex_string))
+        except (TypeError, re.error):
+            logging.exception('Skipping the metric {} as its regex {} is invalid'.format(name, regex_string))
+    return valid_metric_patterns
+
+
 class ExecutorConfig(object):
     """This class is responsible for storing the executor config."""
 
@@ -32,32 +69,58 @@ class ExecutorConfig(object):
             return 1000
 
     def __init__(self,
+                 capture_output=False,
+                 cgroup_kill=False,
                  checkpoint=0,
+                 idle_timeout_secs=0,
+                 instrumentation_interval_secs=0,
                  max_bytes_read_per_line=1024,
                  max_message_length=512,
                  memory_usage_interval_secs=15,
                  mesos_directory='',
+                 metric_patterns={},
+                 output_compression=cr.COMPRESSION_GZIP,
+                 output_max_total_bytes=0,
+                 output_roll_bytes=0,
+                 progress_additional_files=[],
+                 progress_channel=cch.CHANNEL_FILE,
                  progress_output_env_variable=DEFAULT_PROGRESS_FILE_ENV_VARIABLE,
                  progress_output_name='stdout',
                  progress_regex_string='',
                  progress_sample_interval_ms=100,
+                 progress_start_mode=cp.START_MODE_OFFSET,
+                 progress_watch_mode=cp.WATCH_MODE_INOTIFY,
                  recovery_timeout='15mins',
                  reset_vars=[],
                  sandbox_directory='',
-                 shutdown_grace_period='1secs'):
+                 shutdown_grace_period='1secs',
+                 telemetry_interval_secs=0):
+        self.capture_output = capture_output
+        self.cgroup_kill = cgroup_kill
         self.checkpoint = checkpoint != 0
+        self.idle_timeout_secs = idle_timeout_secs
+        self.instrumentation_interval_secs = instrumentation_interval_secs
         self.max_bytes_read_per_line = max_bytes_read_per_line
         self.max_message_length = max_message_length
         self.memory_usage_interval_secs = memory_usage_interval_secs
         self.mesos_directory = mesos_directory
+        self.metric_patterns = metric_patterns
+        self.output_compression = output_compression
+        self.output_max_total_bytes = output_max_total_bytes
+        self.output_roll_bytes = output_roll_bytes
+        self.progress_additional_files = progress_additional_files
+        self.progress_channel = progress_channel
         self.progress_output_env_variable = progress_output_env_variable
         self.progress_output_name = progress_output_name
         self.progress_regex_string = progress_regex_string
         self.progress_sample_interval_ms = progress_sample_interval_ms
+        self.progress_start_mode = progress_start_mode
+        self.progress_watch_mode = progress_watch_mode
         self.recovery_timeout_ms = ExecutorConfig.parse_time_ms(recovery_timeout)
         self.reset_vars=reset_vars
         self.sandbox_directory = sandbox_directory
         self.shutdown_grace_period_ms = ExecutorConfig.parse_time_ms(shutdown_grace_period)
+        self.telemetry_interval_secs = telemetry_interval_secs
 
     def sandbox_file(self, file):
         return os.path.join(self.sandbox_directory, file)
@@ -73,6 +136,8 @@ def initialize_config(environment):
     """Initializes the config using the environment.
     Populates the default values for missing environment variables.
     """
+    capture_output = environment.get('EXECUTOR_CAPTURE_OUTPUT', 'false').lower() == 'true'
+    cgroup_kill = environment.get('EXECUTOR_CGROUP_KILL', 'false').lower() == 'true'
     checkpoint = int(environment.get('MESOS_CHECKPOINT', '0'))
     executor_id = environment.get('MESOS_EXECUTOR_ID', 'executor')
     sandbox_directory = environment.get('MESOS_SANDBOX', '')
@@ -90,40 +155,105 @@ def initialize_config(environment):
     if progress_output_env_variable not in environment:
         logging.info('No entry found for {} in the environment'.format(progress_output_env_variable))
 
+    idle_timeout_secs = max(int(environment.get('EXECUTOR_IDLE_TIMEOUT_SECS', 0)), 0)
+    instrumentation_interval_secs = max(int(environment.get('EXECUTOR_INSTRUMENTATION_INTERVAL_SECS', 0)), 0)
     max_bytes_read_per_line = max(int(environment.get('EXECUTOR_MAX_BYTES_READ_PER_LINE', 4 * 1024)), 128)
     max_message_length = max(int(environment.get('EXECUTOR_MAX_MESSAGE_LENGTH', 512)), 64)
     memory_usage_interval_secs = max(int(environment.get('EXECUTOR_MEMORY_USAGE_INTERVAL_SECS', 3600)), 30)
+    metric_patterns = parse_metric_patterns(environment.get('EXECUTOR_METRIC_PATTERNS', ''))
+    output_compression = environment.get('EXECUTOR_OUTPUT_COMPRESSION', cr.default_compression())
+    if output_compression not in [cr.COMPRESSION_GZIP, cr.COMPRESSION_NONE, cr.COMPRESSION_ZSTD]:
+        logging.info('Unknown output compression {}, defaulting to {}'.format(output_compression,
+                                                                              cr.default_compression()))
+        output_compression = cr.default_compression()
+    if output_compression == cr.COMPRESSION_ZSTD and cr.zstandard is None:
+        logging.info('The zstandard module is not available, defaulting output compression to gzip')
+        output_compression = cr.COMPRESSION_GZIP
+    output_max_total_bytes = max(int(environment.get('EXECUTOR_OUTPUT_MAX_TOTAL_BYTES', 0)), 0)
+    output_roll_bytes = max(int(environment.get('EXECUTOR_OUTPUT_ROLL_BYTES', 0)), 0)
+    if output_roll_bytes:
+        output_roll_bytes = max(output_roll_bytes, 64 * 1024)
+        if not capture_output:
+            logging.info('Rolling the outputs requires the executor to capture them, enabling output capture')
+            capture_output = True
+    if idle_timeout_secs and not capture_output:
+        logging.info('Concurrent tasks are told apart by capturing their outputs, enabling output capture')
+        capture_output = True
+    progress_additional_files = [f for f in environment.get('EXECUTOR_PROGRESS_ADDITIONAL_FILES', '').split(',')
+                                 if len(f) > 0]
+    progress_channel = environment.get('EXECUTOR_PROGRESS_CHANNEL', cch.CHANNEL_FILE)
+    if progress_channel not in [cch.CHANNEL_FIFO, cch.CHANNEL_FILE, cch.CHANNEL_SOCKET]:
+        logging.info('Unknown progress channel {}, defaulting to {}'.format(progress_channel, cch.CHANNEL_FILE))
+        progress_channel = cch.CHANNEL_FILE
     progress_output_name = environment.get(progress_output_env_variable, default_progress_output_file)
     progress_regex_string = environment.get('PROGRESS_REGEX_STRING', 'progress: ([0-9]*\.?[0-9]+), (.*)')
     progress_sample_interval_ms = max(int(environment.get('PROGRESS_SAMPLE_INTERVAL_MS', 1000)), 100)
+    progress_start_mode = environment.get('EXECUTOR_PROGRESS_START_MODE', cp.START_MODE_OFFSET)
+    if progress_start_mode not in [cp.START_MODE_LAST_MATCH, cp.START_MODE_OFFSET]:
+        logging.info('Unknown progress start mode {}, defaulting to {}'.format(progress_start_mode,
+                                                                               cp.START_MODE_OFFSET))
+        progress_start_mode = cp.START_MODE_OFFSET
+    progress_watch_mode = environment.get('EXECUTOR_PROGRESS_WATCH_MODE', cp.WATCH_MODE_INOTIFY)
+    if progress_watch_mode not in [cp.WATCH_MODE_INOTIFY, cp.WATCH_MODE_POLL]:
+        logging.info('Unknown progress watch mode {}, defaulting to {}'.format(progress_watch_mode,
+                                                                               cp.WATCH_MODE_INOTIFY))
+        progress_watch_mode = cp.WATCH_MODE_INOTIFY
     recovery_timeout = environment.get('MESOS_RECOVERY_TIMEOUT', '15mins')
     reset_vars = [v for v in environment.get('EXECUTOR_RESET_VARS', '').split(',')
                   if len(v) > 0]
     sandbox_directory = environment.get('MESOS_SANDBOX', '')
     shutdown_grace_period = environment.get('MESOS_EXECUTOR_SHUTDOWN_GRACE_PERIOD', '2secs')
+    telemetry_interval_secs = max(int(environment.get('EXECUTOR_TELEMETRY_INTERVAL_SECS', 0)), 0)
+    if telemetry_interval_secs:
+        telemetry_interval_secs = max(telemetry_interval_secs, ct.MIN_INTERVAL_SECS)
 
+    logging.info('Capture output: {}'.format(capture_output))
+    logging.info('Run the task in a cgroup: {}'.format(cgroup_kill))
     logging.info('Checkpoint: {} with recovery timeout {}'.format(checkpoint, recovery_timeout))
+    logging.info('Executor exits after being idle for {} secs (0 is once its task completes)'.format(
+        idle_timeout_secs))
+    logging.info('Instrumentation will be written every {} secs (0 is never)'.format(instrumentation_interval_secs))
     logging.info('Max bytes read per line is {}'.format(max_bytes_read_per_line))
     logging.info('Memory usage will be logged every {} secs'.format(memory_usage_interval_secs))
+    logging.info('Metric patterns are {}'.format(metric_patterns))
     logging.info('Progress message length is limited to {}'.format(max_message_length))
-    logging.info('Progress output file is {}'.format(progress_output_name))
+    logging.info('Outputs roll every {} bytes (0 is never), compressed with {}, capped at {} bytes (0 is uncapped)'
+                 .format(output_roll_bytes, output_compression, output_max_total_bytes))
+    logging.info('Progress output file is {} (created as a {} channel)'.format(progress_output_name, progress_channel))
+    logging.info('Additional progress files are {}'.format(progress_additional_files))
     logging.info('Progress regex is {}'.format(progress_regex_string))
     logging.info('Progress sample interval is {}'.format(progress_sample_interval_ms))
+    logging.info('Progress start mode is {}'.format(progress_start_mode))
+    logging.info('Progress watch mode is {}'.format(progress_watch_mode))
     logging.info('Reset vars are {}'.format(reset_vars))
     logging.info('Sandbox location is {}'.format(sandbox_directory))
     logging.info('Mesos directory is {}'.format(mesos_directory))
     logging.info('Shutdown grace period is {}'.format(shutdown_grace_period))
+    logging.info('Task resource usage is sent every {} secs (0 is never)'.format(telemetry_interval_secs))
 
-    return ExecutorConfig(checkpoint=checkpoint,
+    return ExecutorConfig(capture_output=capture_output,
+                          cgroup_kill=cgroup_kill,
+                          checkpoint=checkpoint,
+                          idle_timeout_secs=idle_timeout_secs,
+                          instrumentation_interval_secs=instrumentation_interval_secs,
                           max_bytes_read_per_line=max_bytes_read_per_line,
                           max_message_length=max_message_length,
                           memory_usage_interval_secs=memory_usage_interval_secs,
                           mesos_directory=mesos_directory,
+                          metric_patterns=metric_patterns,
+                          output_compression=output_compression,
+                          output_max_total_bytes=output_max_total_bytes,
+                          output_roll_bytes=output_roll_bytes,
+                          progress_additional_files=progress_additional_files,
+                          progress_channel=progress_channel,
                           progress_output_env_variable=progress_output_env_variable,
                           progress_output_name=progress_output_name,
                           progress_regex_string=progress_regex_string,
                           progress_sample_interval_ms=progress_sample_interval_ms,
+                          progress_start_mode=progress_start_mode,
+                          progress_watch_mode=progress_watch_mode,
                           recovery_timeout=recovery_timeout,
                           reset_vars=reset_vars,
                           sandbox_directory=sandbox_directory,
-                          shutdown_grace_period=shutdown_grace_period)
+                          shutdown_grace_period=shutdown_grace_period,
+                          telemetry_interval_secs=telemetry_interval_secs)
@@ -1,17 +1,27 @@
+import asyncio
+import collections
 import functools
 import json
 import logging
 import signal
+import sys
 import time
-from threading import Event, Lock, Thread, Timer
+from threading import Condition, Lock, RLock, Thread
 
 import os
 import pymesos as pm
 
 import cook
+import cook.cgroup as ccg
+import cook.channel as cch
+import cook.checkpoint as cck
+import cook.instrumentation as cins
 import cook.io_helper as cio
+import cook.loop as cl
 import cook.progress as cp
+import cook.rotation as cr
 import cook.subprocess as cs
+import cook.telemetry as ct
 import cook.util as cu
 
 
@@ -30,6 +40,10 @@ def get_task_id(task):
     return task['task_id']['value']
 
 
+# The maximum number of messages queued in a MessageSender, see MessageSender.send_message
+DEFAULT_MAX_QUEUE_SIZE = 1024
+
+
 class StatusUpdater(object):
     """Sends status updates for the task."""
 
@@ -37,15 +51,18 @@ class StatusUpdater(object):
         """
         Parameters
         ----------
-        driver: MesosExecutorDriver
+        driver: MesosExecutorDriver or MessageSender
             The driver to send the status update to.
         task_id: dictionary
             The task whose status update to send.
         """
         self.driver = driver
-        self.lock = Lock()
+        # reentrant, a closed MessageSender calls status_update_sent on the calling thread
+        self.lock = RLock()
         self.task_id = task_id
         self.terminal_states = {cook.TASK_ERROR, cook.TASK_FAILED, cook.TASK_FINISHED, cook.TASK_KILLED}
+        # a terminal status update queued to a MessageSender is pending until the driver has sent it
+        self.terminal_status_pending = False
         self.terminal_status_sent = False
 
     def create_status(self, task_state, reason=None):
@@ -71,6 +88,8 @@ class StatusUpdater(object):
 
     def update_status(self, task_state, reason=None):
         """Sends the status using the driver.
+        A MessageSender sends terminal status updates ahead of the queued resource usage messages and the messages of
+        the other tasks, after the queued progress and metrics messages of the task.
 
         Parameters
         ----------
@@ -81,16 +100,23 @@ class StatusUpdater(object):
 
         Returns
         -------
-        True if successfully sent the status update, else False.
+        True if successfully sent, or queued to a MessageSender, the status update, else False.
         """
         with self.lock:
             is_terminal_status = task_state in self.terminal_states
-            if is_terminal_status and self.terminal_status_sent:
+            if is_terminal_status and (self.terminal_status_sent or self.terminal_status_pending):
                 logging.info('Terminal state for task already sent, dropping state {}'.format(task_state))
                 return False
             try:
                 logging.info('Updating task state to {}'.format(task_state))
                 status = self.create_status(task_state, reason=reason)
+                if isinstance(self.driver, MessageSender):
+                    self.terminal_status_pending = is_terminal_status
+                    callback = functools.partial(self.status_update_sent, is_terminal_status)
+                    # the task's own final progress and metrics, queued just before, are still sent first
+                    preceding_keys = {('progress', self.task_id), ('metrics', self.task_id)}
+                    return self.driver.send_status_update(status, priority=is_terminal_status, callback=callback,
+                                                          preceding_keys=preceding_keys)
                 self.driver.sendStatusUpdate(status)
                 self.terminal_status_sent = is_terminal_status
                 return True
@@ -98,6 +124,13 @@ class StatusUpdater(object):
                 logging.exception('Unable to send task state {}'.format(task_state))
                 return False
 
+    def status_update_sent(self, is_terminal_status, sent):
+        """Called by the MessageSender once it has tried to send a status update queued by update_status."""
+        if is_terminal_status:
+            with self.lock:
+                self.terminal_status_pending = False
+                self.terminal_status_sent = self.terminal_status_sent or sent
+
 
 def send_message(driver, error_handler, message):
     """Sends the message, if it is smaller than the max length, using the driver.
@@ -121,7 +154,8 @@ def send_message(driver, error_handler, message):
         logging.info('Sending framework message {}'.format(message))
         message_string = json.dumps(message).encode('utf8')
         encoded_message = pm.encode_data(message_string)
-        driver.sendFrameworkMessage(encoded_message)
+        with cins.timer('driver.send-framework-message'):
+            driver.sendFrameworkMessage(encoded_message)
         logging.info('Sent framework message')
         return True
     except Exception as exception:
@@ -132,7 +166,185 @@ def send_message(driver, error_handler, message):
         return False
 
 
-def launch_task(task, environment):
+class MessageSender(object):
+    """Sends the status updates and framework messages of the executor on a single thread, so that a slow driver
+    connection stalls neither the management of the task nor the tracking of its progress.
+    Messages are sent in the order they are queued. A message queued with a coalesce key supersedes the queued
+    message with the same key, e.g. only the latest progress message of a task is sent.
+    Priority messages, i.e. terminal status updates, are sent after the other queued messages and ahead of the queued
+    coalescable messages, except those whose coalesce key they list, e.g. the final progress of their task, which are
+    moved ahead with them. A backlog of progress of other tasks or of resource usage does not delay a completion.
+    At most max_queue_size coalescable messages are queued, status updates and the other messages are never dropped.
+    The queue depth and the time messages spend in the queue are reported as sender.queue-depth and
+    sender.queue-latency in cook.instrumentation."""
+
+    def __init__(self, driver, max_queue_size=DEFAULT_MAX_QUEUE_SIZE):
+        """
+        Parameters
+        ----------
+        driver: MesosExecutorDriver
+            The driver to send the status updates and messages to.
+        max_queue_size: int
+            The maximum number of queued messages, beyond it coalescable messages are dropped.
+        """
+        self.driver = driver
+        self.max_queue_size = max_queue_size
+        self.closed = False
+        self.coalesced_entries = {}
+        self.condition = Condition()
+        # [function, arguments, coalesce_key, callback, queued_time], the function of a superseded entry is None
+        self.entries = collections.deque()
+        self.num_sending = 0
+        self.queue_depth = 0
+        self.thread = Thread(target=self.__send_entries, name='message-sender', daemon=True)
+        self.thread.start()
+
+    def __enqueue(self, function, arguments, coalesce_key=None, callback=None, priority=False, preceding_keys=()):
+        with self.condition:
+            closed = self.closed
+        if closed:
+            logging.info('Message sender is closed, sending on the calling thread')
+            result = function(*arguments)
+            if callback:
+                callback(result)
+            return result
+        with self.condition:
+            superseded_entry = self.coalesced_entries.pop(coalesce_key, None) if coalesce_key else None
+            if superseded_entry:
+                superseded_entry[0] = None
+                self.queue_depth -= 1
+                cins.increment('sender.messages-coalesced')
+            elif coalesce_key and self.queue_depth >= self.max_queue_size:
+                logging.error('Dropping message {}, {} messages are queued'.format(coalesce_key, self.queue_depth))
+                cins.increment('sender.messages-dropped')
+                return False
+            entry = [function, arguments, coalesce_key, callback, time.perf_counter()]
+            if coalesce_key:
+                self.coalesced_entries[coalesce_key] = entry
+            if priority:
+                self.__insert_priority_entry(entry, preceding_keys)
+            else:
+                self.entries.append(entry)
+            self.queue_depth += 1
+            cins.set_gauge('sender.queue-depth', self.queue_depth)
+            self.condition.notify_all()
+            return True
+
+    def __insert_priority_entry(self, entry, preceding_keys):
+        """Queues the entry after the last queued entry that is not coalescable, the coalescable entries queued after
+        it whose coalesce key is in preceding_keys are moved ahead of the entry, the lock must be held."""
+        index = len(self.entries)
+        while index > 0 and (self.entries[index - 1][0] is None or self.entries[index - 1][2] is not None):
+            index -= 1
+        coalescable_entries = [self.entries.pop() for _ in range(len(self.entries) - index)][::-1]
+        self.entries.extend(e for e in coalescable_entries if e[2] in preceding_keys)
+        self.entries.append(entry)
+        self.entries.extend(e for e in coalescable_entries if e[2] not in preceding_keys)
+
+    def __send_entries(self):
+        while True:
+            with self.condition:
+                while not self.entries and not self.closed:
+                    self.condition.wait()
+                if not self.entries:
+                    return
+                function, arguments, coalesce_key, callback, queued_time = self.entries.popleft()
+                if function is None:
+                    continue
+                if coalesce_key:
+                    del self.coalesced_entries[coalesce_key]
+                self.queue_depth -= 1
+                self.num_sending += 1
+            try:
+                cins.record_time('sender.queue-latency', time.perf_counter() - queued_time)
+                result = function(*arguments)
+                if callback:
+                    callback(result)
+            except Exception:
+                logging.exception('Error in sending {}'.format(arguments))
+            finally:
+                with self.condition:
+                    self.num_sending -= 1
+                    self.condition.notify_all()
+
+    def __send_status_update(self, status):
+        try:
+            with cins.timer('driver.send-status-update'):
+                self.driver.sendStatusUpdate(status)
+            return True
+        except Exception:
+            logging.exception('Unable to send status update {}'.format(status))
+            return False
+
+    def sendStatusUpdate(self, status):
+        """Queues the status update, the driver's interface is implemented so that the sender can replace the driver.
+        Exceptions raised by the driver are logged on the sender's thread."""
+        self.send_status_update(status)
+
+    def send_status_update(self, status, priority=False, callback=None, preceding_keys=()):
+        """Queues the status update.
+
+        Parameters
+        ----------
+        status: dictionary
+            The status update to send.
+        priority: boolean
+            Whether the status update is sent ahead of the queued coalescable messages.
+        callback: fn(sent)
+            Called on the sender's thread with whether the driver sent the status update.
+        preceding_keys: collection
+            The coalesce keys of the queued messages that are moved ahead of a priority status update with it.
+
+        Returns
+        -------
+        whether the status update was queued, or sent once the sender is closed.
+        """
+        return self.__enqueue(self.__send_status_update, (status,), callback=callback, priority=priority,
+                              preceding_keys=preceding_keys)
+
+    def send_message(self, error_handler, message, coalesce_key=None, failure_callback=None):
+        """Queues the message, see the module level send_message.
+
+        Parameters
+        ----------
+        error_handler: fn(os_error)
+            OSError exception handler for out of memory situations, it is called on the sender's thread.
+        message: dictionary
+            The raw message to send.
+        coalesce_key: tuple
+            When provided, the message supersedes the queued message with the same key.
+        failure_callback: fn(message)
+            Called on the sender's thread when the queued message could not be sent.
+
+        Returns
+        -------
+        whether the message was queued, or sent once the sender is closed.
+        """
+        callback = (lambda sent: sent or failure_callback(message)) if failure_callback else None
+        return self.__enqueue(send_message, (self.driver, error_handler, message), coalesce_key, callback)
+
+    def flush(self, timeout_secs=None):
+        """Blocks until the queued messages have been sent or timeout_secs expire.
+
+        Returns
+        -------
+        True if the queued messages have been sent.
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: self.queue_depth == 0 and self.num_sending == 0, timeout_secs)
+
+    def close(self, timeout_secs=None):
+        """Sends the queued messages and stops the sender's thread, waiting at most timeout_secs.
+        Messages sent after the sender is closed are sent on the calling thread."""
+        if not self.flush(timeout_secs):
+            logging.warning('{} messages were not sent in {} seconds'.format(self.queue_depth, timeout_secs))
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join(timeout_secs)
+
+
+def launch_task(task, environment, capture_output=False, cgroup=None):
     """Launches the task using the command available in the json map from the data field.
 
     Parameters
@@ -141,6 +353,10 @@ def launch_task(task, environment):
         The task to execute.
     environment: dictionary
         The task environment.
+    capture_output: boolean
+        Whether the stdout and stderr of the task are captured using pipes, see cook.subprocess.launch_process.
+    cgroup: cook.cgroup.TaskCgroup
+        The cgroup to run the task in, if any.
 
     Returns
     -------
@@ -152,14 +368,14 @@ def launch_task(task, environment):
         data_json = json.loads(data_string)
         command = str(data_json['command']).strip()
         logging.info('Command: {}'.format(command))
-        return cs.launch_process(command, environment)
+        return cs.launch_process(command, environment, capture_output=capture_output, cgroup=cgroup)
     except Exception:
         logging.exception('Error in launch_task')
         return None
 
 
-def await_process_completion(process, stop_signal, shutdown_grace_period_ms):
-    """Awaits process completion. Also sets up the thread that will kill the process if stop_signal is set.
+async def await_process_completion_async(process, stop_signal, shutdown_grace_period_ms, cgroup=None):
+    """Awaits process completion on the executor loop, the process is killed if stop_signal is set first.
 
     Parameters
     ----------
@@ -169,28 +385,59 @@ def await_process_completion(process, stop_signal, shutdown_grace_period_ms):
         Event that determines if the process was requested to terminate
     shutdown_grace_period_ms: int
         Grace period before forceful kill
+    cgroup: cook.cgroup.TaskCgroup
+        The cgroup the process runs in, if any.
 
     Returns
     -------
-    True if the process was killed, False if it terminated naturally.
+    Nothing
     """
-
-    def process_stop_signal():
-        stop_signal.wait()  # wait indefinitely for the stop_signal to be set
-        if cs.is_process_running(process):
+    process_exit = asyncio.ensure_future(cs.await_process_exit(process))
+    stop_requested = asyncio.ensure_future(cl.wait_event(stop_signal))
+    try:
+        await asyncio.wait([process_exit, stop_requested], return_when=asyncio.FIRST_COMPLETED)
+        if not process_exit.done():
             logging.info('Executor has been instructed to terminate running task')
-            cs.kill_process(process, shutdown_grace_period_ms)
+            await cs.terminate_process(process, shutdown_grace_period_ms, process_exit, cgroup)
+        # wait indefinitely for process to terminate (either normally or by being killed)
+        await process_exit
+    finally:
+        stop_requested.cancel()
+
+
+async def send_resource_usage(sender, error_handler, task_id, resource_sampler, interval_secs):
+    """Samples the resource usage of the task every interval_secs and sends it in a framework message, until cancelled.
+    A usage message that is still queued is superseded by the next one.
+
+    Parameters
+    ----------
+    sender: MessageSender
+        The sender of the messages.
+    error_handler: fn(os_error)
+        OSError exception handler for out of memory situations.
+    task_id: string
+        The id of the task.
+    resource_sampler: cook.telemetry.ResourceSampler
+        The sampler of the task's process tree.
+    interval_secs: int
+        The interval between samples.
+    """
+    loop = asyncio.get_event_loop()
+    while True:
+        await asyncio.sleep(interval_secs)
+        resource_usage = await loop.run_in_executor(None, resource_sampler.sample)
+        sender.send_message(error_handler, {'resource-usage': resource_usage, 'task-id': task_id},
+                            coalesce_key=('resource-usage', task_id))
 
-    kill_thread = Thread(target=process_stop_signal, args=())
-    kill_thread.daemon = True
-    kill_thread.start()
 
-    # wait indefinitely for process to terminate (either normally or by being killed)
-    process.wait()
+def await_process_completion(process, stop_signal, shutdown_grace_period_ms, cgroup=None):
+    """Awaits process completion, blocking the calling thread, see await_process_completion_async."""
+    cl.get_executor_loop().run(await_process_completion_async(process, stop_signal, shutdown_grace_period_ms,
+                                                              cgroup))
 
 
-def await_reregister(reregister_signal, recovery_secs, *disconnect_signals):
-    """Awaits reregistration on rerigster_signal, and notifies on stop_signal and disconnect_signal if not set.
+async def await_reregister_async(reregister_signal, recovery_secs, *disconnect_signals):
+    """Awaits reregistration on reregister_signal, and notifies on stop_signal and disconnect_signal if not set.
 
     Parameters
     ----------
@@ -201,20 +448,18 @@ def await_reregister(reregister_signal, recovery_secs, *disconnect_signals):
     disconnect_signals: [Event]
         Events to notify if reregistration does not occur
     """
+    if await cl.wait_event(reregister_signal, recovery_secs):
+        logging.info("Reregistered with mesos agent. Not notifying on disconnect_signals")
+    else:
+        logging.warning(
+            "Failed to reregister within {} seconds. Notifying disconnect_signals".format(recovery_secs))
+        for signal in disconnect_signals:
+            signal.set()
 
-    def await_reregister_thread():
-        reregister_signal.wait(recovery_secs)
-        if reregister_signal.isSet():
-            logging.info("Reregistered with mesos agent. Not notifying on disconnect_signals")
-        else:
-            logging.warning(
-                "Failed to reregister within {} seconds. Notifying disconnect_signals".format(recovery_secs))
-            for signal in disconnect_signals:
-                signal.set()
 
-    await_thread = Thread(target=await_reregister_thread, args=())
-    await_thread.daemon = True
-    await_thread.start()
+def await_reregister(reregister_signal, recovery_secs, *disconnect_signals):
+    """Schedules the wait for reregistration on the executor loop without blocking, see await_reregister_async."""
+    cl.get_executor_loop().submit(await_reregister_async(reregister_signal, recovery_secs, *disconnect_signals))
 
 
 def get_task_state(exit_code):
@@ -285,6 +530,57 @@ def retrieve_process_environment(config, task, os_environ):
     return environment
 
 
+def get_file_sizes(paths):
+    """Returns the map from each of paths to the size of its file, 0 when the file does not exist."""
+    file_sizes = {}
+    for path in paths:
+        try:
+            file_sizes[path] = os.path.getsize(path)
+        except OSError:
+            file_sizes[path] = 0
+    return file_sizes
+
+
+def task_progress_output_name(config, task_id):
+    """Returns the progress location of the task.
+    Several tasks can run concurrently in an executor that waits for new tasks, see config.idle_timeout_secs, their
+    progress is then told apart by suffixing the progress location with the task id."""
+    if config.idle_timeout_secs:
+        return '{}.{}'.format(config.progress_output_name, task_id)
+    return config.progress_output_name
+
+
+def create_progress_channel(config, progress_output_name, task_id):
+    """Creates progress_output_name, the task's progress location, as the channel requested by
+    config.progress_channel, see cook.channel.
+    When the progress location is the channel of a task running concurrently, the channel is created at a location
+    suffixed with task_id instead, the task is pointed to the channel's path by its environment.
+
+    Returns
+    -------
+    the channel, or None when the progress location is tailed as a file, e.g. when the channel cannot be created.
+    """
+    if config.progress_channel == cch.CHANNEL_FILE:
+        return None
+    progress_path = os.path.abspath(progress_output_name)
+    if progress_path in {os.path.abspath(config.stderr_file()), os.path.abspath(config.stdout_file())}:
+        logging.info('Progress is tailed from {} as it is also an output of the task'.format(progress_path))
+        return None
+    try:
+        try:
+            return cch.create_channel(config.progress_channel, progress_output_name)
+        except FileExistsError:
+            task_progress_name = '{}.{}'.format(progress_output_name, task_id)
+            logging.info('The progress location is in use, the channel is created at {}'.format(task_progress_name))
+            return cch.create_channel(config.progress_channel, task_progress_name)
+    except Exception as exception:
+        if cu.is_out_of_memory_error(exception):
+            raise exception
+        logging.exception('Unable to create the {} channel, progress is tailed from {}'.format(
+            config.progress_channel, progress_path))
+        return None
+
+
 def output_task_completion(task_id, task_state):
     """Prints and logs the executor completion message."""
     cio.print_and_log('Executor completed execution of {} (state={})'.format(task_id, task_state))
@@ -313,20 +609,47 @@ def os_error_handler(stop_signal, status_updater, os_error):
     cu.print_memory_usage()
 
 
-def manage_task(driver, task, stop_signal, completed_signal, config):
+def create_output_rotation(config):
+    """Returns the rotation of the captured outputs configured in config, see cook.rotation.OutputRotation."""
+    return cr.OutputRotation(config.output_roll_bytes, config.output_max_total_bytes, config.output_compression)
+
+
+def manage_task(driver, task, stop_signal, completed_signal, config, sender=None, output_rotation=None):
+    """Manages the execution of a task on the executor loop, blocking the calling thread, see manage_task_async."""
+    cl.get_executor_loop().run(manage_task_async(driver, task, stop_signal, completed_signal, config, sender,
+                                                 output_rotation))
+
+
+async def manage_task_async(driver, task, stop_signal, completed_signal, config, sender=None, output_rotation=None):
     """Manages the execution of a task waiting for it to terminate normally or be killed.
        It also sends the task status updates, sandbox location and exit code back to the scheduler.
-       Progress updates are tracked on a separate thread and are also sent to the scheduler.
+       Progress updates from all locations are tracked on a single separate thread and are also sent to the scheduler.
        Setting the stop_signal will trigger termination of the task and associated cleanup.
+       The process exit, the kill grace period and the end of progress tracking are awaited on the running loop.
+       The sandbox files are tracked for progress from their size when the task is launched, they may hold the
+       output of the previous tasks of the executor. Tasks running concurrently write their progress to their own
+       progress location, see task_progress_output_name, and their output is captured to tell it apart.
+       When a sender shared by the executor's tasks is provided, it is flushed instead of being closed.
+       When an output rotation shared by the executor's tasks is provided, the task's captured output is rolled by it
+       and it is left open, else the task uses its own rotation.
 
     Returns
     -------
     Nothing
     """
+    loop = asyncio.get_event_loop()
     launched_process = None
+    task_output_rotation = None
+    progress_channel = None
+    progress_checkpointer = None
+    task_cgroup = None
+    resource_sampler = None
+    resource_usage_task = None
     task_id = get_task_id(task)
     cio.print_and_log('Starting task {}'.format(task_id))
-    status_updater = StatusUpdater(driver, task_id)
+    shared_sender = sender is not None
+    sender = sender or MessageSender(driver)
+    status_updater = StatusUpdater(sender, task_id)
 
     inner_os_error_handler = functools.partial(os_error_handler, stop_signal, status_updater)
     try:
@@ -335,10 +658,20 @@ def manage_task(driver, task, stop_signal, completed_signal, config):
 
         # Use MESOS_DIRECTORY instead of MESOS_SANDBOX, to report the sandbox location outside of the container
         sandbox_message = {'sandbox-directory': config.mesos_directory, 'task-id': task_id, 'type': 'directory'}
-        send_message(driver, inner_os_error_handler, sandbox_message)
+        sender.send_message(inner_os_error_handler, sandbox_message)
 
         environment = retrieve_process_environment(config, task, os.environ)
-        launched_process = launch_task(task, environment)
+        progress_output_name = task_progress_output_name(config, task_id)
+        set_environment(environment, config.progress_output_env_variable, progress_output_name)
+        progress_file_sizes = get_file_sizes([progress_output_name, config.stderr_file(), config.stdout_file()] +
+                                             [config.sandbox_file(f) for f in config.progress_additional_files])
+        # the channel is created before the launch, the task can write its progress records as soon as it starts
+        progress_channel = create_progress_channel(config, progress_output_name, task_id)
+        if progress_channel:
+            set_environment(environment, config.progress_output_env_variable, progress_channel.path)
+        if config.cgroup_kill:
+            task_cgroup = ccg.TaskCgroup.create(task_id)
+        launched_process = launch_task(task, environment, capture_output=config.capture_output, cgroup=task_cgroup)
         if launched_process:
             # task has begun running successfully
             status_updater.update_status(cook.TASK_RUNNING)
@@ -349,53 +682,120 @@ def manage_task(driver, task, stop_signal, completed_signal, config):
             status_updater.update_status(cook.TASK_ERROR, reason=cook.REASON_TASK_INVALID)
             return
 
-        task_completed_signal = Event()  # event to track task execution completion
-        sequence_counter = cp.ProgressSequenceCounter()
+        if config.telemetry_interval_secs:
+            resource_sampler = ct.ResourceSampler(launched_process.pid, task_cgroup)
+            resource_usage_task = asyncio.ensure_future(
+                send_resource_usage(sender, inner_os_error_handler, task_id, resource_sampler,
+                                    config.telemetry_interval_secs))
+
+        task_completed_signal = cl.LoopEvent()  # event to track task execution completion
+        progress_checkpoint = None
+        if config.checkpoint:
+            # a recovered task resumes tracking its progress from the checkpointed offsets and sequence
+            checkpoint_path = cck.checkpoint_file(config, task_id)
+            progress_checkpoint = cck.load_checkpoint(checkpoint_path, task_id)
+            progress_checkpointer = cck.ProgressCheckpointer(checkpoint_path, task_id)
+        sequence_counter = cp.ProgressSequenceCounter(progress_checkpoint['progress-sequence']
+                                                      if progress_checkpoint else 0)
+
+        def send_progress_message(message):
+            return sender.send_message(inner_os_error_handler, message, coalesce_key=('progress', task_id),
+                                       failure_callback=progress_updater.progress_message_failed)
 
-        send_progress_message = functools.partial(send_message, driver, inner_os_error_handler)
         max_message_length = config.max_message_length
         sample_interval_ms = config.progress_sample_interval_ms
         progress_updater = cp.ProgressUpdater(task_id, max_message_length, sample_interval_ms, send_progress_message)
-        progress_termination_signal = Event()
+        progress_termination_signal = cl.LoopEvent()
+
+        metric_extractor, metrics_updater = None, None
+        if config.metric_patterns:
+            def send_metrics_message(message):
+                return sender.send_message(inner_os_error_handler, message, coalesce_key=('metrics', task_id),
+                                           failure_callback=metrics_updater.metrics_message_failed)
 
-        def launch_progress_tracker(progress_location, location_tag):
+            metric_extractor = cp.MetricExtractor(config.metric_patterns)
+            metrics_updater = cp.MetricsUpdater(task_id, sample_interval_ms, send_metrics_message)
+
+        progress_tracker = cp.MultiplexedProgressTracker(config, stop_signal, task_completed_signal, sequence_counter,
+                                                         progress_updater, progress_termination_signal,
+                                                         inner_os_error_handler, progress_checkpointer,
+                                                         metric_extractor, metrics_updater)
+
+        def add_progress_location(progress_location, location_tag):
             progress_file_path = os.path.abspath(progress_location)
             logging.info('Location {} (absolute path={}) tagged as [tag={}]'.format(
                 progress_location, progress_file_path, location_tag))
-            progress_tracker = cp.ProgressTracker(config, stop_signal, task_completed_signal, sequence_counter,
-                                                  progress_updater, progress_termination_signal, progress_location,
-                                                  location_tag, inner_os_error_handler)
-            progress_tracker.start()
-            return progress_tracker
-
-        progress_locations = {config.progress_output_name: 'progress',
-                              config.stderr_file(): 'stderr',
-                              config.stdout_file(): 'stdout'}
+            start_offset, progress = cck.resume_location(progress_checkpoint, progress_location,
+                                                         progress_file_sizes.get(progress_location, 0))
+            # a recovered task resumes from its checkpoint instead
+            scan_last_match = progress_checkpoint is None and config.progress_start_mode == cp.START_MODE_LAST_MATCH
+            progress_tracker.add_location(progress_location, location_tag, start_offset, progress, scan_last_match)
+
+        if config.capture_output:
+            # the captured output is matched in memory, the copies written to the sandbox are not read back
+            progress_locations = {progress_output_name: 'progress'}
+            captured_files = {os.path.abspath(config.stderr_file()), os.path.abspath(config.stdout_file())}
+        else:
+            progress_locations = {progress_output_name: 'progress',
+                                  config.stderr_file(): 'stderr',
+                                  config.stdout_file(): 'stdout'}
+            captured_files = set()
+        for additional_file in config.progress_additional_files:
+            progress_locations.setdefault(config.sandbox_file(additional_file), 'additional:{}'.format(additional_file))
+        if progress_channel:
+            progress_locations.pop(progress_output_name)
+        progress_locations = {l: progress_locations[l] for l in progress_locations
+                              if os.path.abspath(l) not in captured_files}
         logging.info('Progress will be tracked from {} locations'.format(len(progress_locations)))
-        progress_trackers = [launch_progress_tracker(l, progress_locations[l]) for l in progress_locations]
-
-        await_process_completion(launched_process, stop_signal, config.shutdown_grace_period_ms)
+        [add_progress_location(l, progress_locations[l]) for l in progress_locations]
+        if config.capture_output:
+            stderr_output, stdout_output = None, None
+            if config.output_roll_bytes:
+                if output_rotation is None:
+                    task_output_rotation = create_output_rotation(config)
+                    output_rotation = task_output_rotation
+                stderr_output = output_rotation.rotating_output(config.stderr_file(), lambda: sys.stderr)
+                stdout_output = output_rotation.rotating_output(config.stdout_file(), lambda: sys.stdout)
+            progress_tracker.add_output_stream(cio.capture_stderr(launched_process.stderr, stderr_output), 'stderr')
+            progress_tracker.add_output_stream(cio.capture_stdout(launched_process.stdout, stdout_output), 'stdout')
+        if progress_channel:
+            # the tracker closes the channel once it has been tracked
+            progress_tracker.add_channel(progress_channel, 'progress')
+            progress_channel = None
+        progress_tracker.start()
+
+        await await_process_completion_async(launched_process, stop_signal, config.shutdown_grace_period_ms,
+                                             task_cgroup)
         task_completed_signal.set()
+        progress_tracker.wake()
+
+        def terminate_progress_tracking():
+            progress_termination_signal.set()
+            progress_tracker.wake()
 
-        progress_termination_timer = Timer(config.shutdown_grace_period_ms / 1000.0, progress_termination_signal.set)
-        progress_termination_timer.daemon = True
-        progress_termination_timer.start()
+        loop.call_later(config.shutdown_grace_period_ms / 1000.0, terminate_progress_tracking)
 
         # propagate the exit code
         exit_code = launched_process.returncode
         cio.print_and_log('Command exited with status {} (pid: {})'.format(exit_code, launched_process.pid))
 
         exit_message = {'exit-code': exit_code, 'task-id': task_id}
-        send_message(driver, inner_os_error_handler, exit_message)
+        if resource_sampler:
+            resource_usage_task.cancel()
+            # a cgroup still holds the usage of the exited processes, else the last sample is summarized
+            exit_message['resource-usage'] = await loop.run_in_executor(None, resource_sampler.sample)
+            logging.info('Sampled the task resource usage {} times using {:.3f} cpu secs'.format(
+                resource_sampler.num_samples, resource_sampler.sample_cpu_secs))
+        sender.send_message(inner_os_error_handler, exit_message)
 
         # await progress updater termination if executor is terminating normally
         if not stop_signal.isSet():
             logging.info('Awaiting completion of progress updaters')
-            [progress_tracker.wait() for progress_tracker in progress_trackers]
+            await cl.wait_event(progress_tracker.progress_complete_event)
             logging.info('Progress updaters completed')
 
         # force send the latest progress state if available
-        [progress_tracker.force_send_progress_update() for progress_tracker in progress_trackers]
+        progress_tracker.force_send_progress_update()
 
         # task either completed successfully or aborted with an error
         task_state = get_task_state(exit_code)
@@ -412,22 +812,44 @@ def manage_task(driver, task, stop_signal, completed_signal, config):
             status_updater.update_status(cook.TASK_FAILED, reason=cook.REASON_EXECUTOR_TERMINATED)
 
     finally:
-        # ensure completed_signal is set so driver can stop
+        if resource_usage_task:
+            resource_usage_task.cancel()
+        if progress_channel:
+            progress_channel.close()
+        if progress_checkpointer:
+            progress_checkpointer.remove()
+        # the driver is stopped once completed, the queued status updates and messages are sent first
+        await loop.run_in_executor(None, sender.flush if shared_sender else sender.close,
+                                   config.shutdown_grace_period_ms / 1000.0)
+        # ensure completed_signal is set so driver can stop, the remaining cleanup does not delay the terminal update
         completed_signal.set()
         if launched_process and cs.is_process_running(launched_process):
-            cs.send_signal(launched_process.pid, signal.SIGKILL)
+            await loop.run_in_executor(None, cs.send_signal, launched_process.pid, signal.SIGKILL, task_cgroup)
+        if task_cgroup:
+            await loop.run_in_executor(None, task_cgroup.remove, cook.DAEMON_GRACE_SECS)
+        if task_output_rotation:
+            await loop.run_in_executor(None, task_output_rotation.close, config.shutdown_grace_period_ms / 1000.0)
 
 
 class CookExecutor(pm.Executor):
-    """This class is responsible for launching the task sent by the scheduler.
-    It implements the Executor methods."""
+    """This class is responsible for launching the tasks sent by the scheduler.
+    It implements the Executor methods.
+    Each task has its own stop signal, status updater and progress tracker, the tasks share the executor's loop and
+    message sender. The executor completes once none of its tasks has been running for config.idle_timeout_secs."""
 
     def __init__(self, stop_signal, config):
-        self.completed_signal = Event()
+        self.completed_signal = cl.LoopEvent()
         self.config = config
-        self.disconnect_signal = Event()
+        self.disconnect_signal = cl.LoopEvent()
+        self.executor_loop = cl.get_executor_loop()
         self.stop_signal = stop_signal
         self.reregister_signal = None
+        self.lock = Lock()
+        self.num_launched_tasks = 0
+        self.output_rotation = None
+        self.sender = None
+        # task id -> stop signal of the running task
+        self.task_stop_signals = {}
 
     def registered(self, driver, executor_info, framework_info, agent_info):
         logging.info('Executor registered executor={}, framework={}, agent={}'.
@@ -459,7 +881,7 @@ class CookExecutor(pm.Executor):
         if self.config.checkpoint:
             if self.reregister_signal is None:
                 logging.info('Executor checkpointing is enabled. Waiting for agent recovery.')
-                new_event = Event()
+                new_event = cl.LoopEvent()
                 self.reregister_signal = new_event
                 await_reregister(new_event, self.config.recovery_timeout_ms / 1000, self.stop_signal,
                                  self.disconnect_signal)
@@ -473,13 +895,54 @@ class CookExecutor(pm.Executor):
     def launchTask(self, driver, task):
         logging.info('Driver {} launching task {}'.format(driver, task))
 
-        stop_signal = self.stop_signal
-        completed_signal = self.completed_signal
-        config = self.config
-
-        task_thread = Thread(target=manage_task, args=(driver, task, stop_signal, completed_signal, config))
-        task_thread.daemon = True
-        task_thread.start()
+        task_id = get_task_id(task)
+        with self.lock:
+            if self.completed_signal.isSet() or task_id in self.task_stop_signals:
+                logging.error('Unable to launch task {}, the executor has completed or the task is running'.format(
+                    task_id))
+                StatusUpdater(driver, task_id).update_status(cook.TASK_FAILED, reason=cook.REASON_EXECUTOR_TERMINATED)
+                return
+            task_stop_signal = cl.LoopEvent()
+            self.task_stop_signals[task_id] = task_stop_signal
+            self.num_launched_tasks += 1
+            if self.sender is None:
+                self.sender = MessageSender(driver)
+            if self.output_rotation is None and self.config.capture_output and self.config.output_roll_bytes:
+                # the tasks write to the same outputs, a single rotation numbers and caps all their segments
+                self.output_rotation = create_output_rotation(self.config)
+
+        self.executor_loop.submit(self.run_task(driver, task, task_stop_signal))
+
+    async def run_task(self, driver, task, task_stop_signal):
+        """Manages the task until it terminates, the task is stopped when the executor's stop_signal is set.
+        The executor completes once no task is running and no task has been launched for config.idle_timeout_secs."""
+        task_id = get_task_id(task)
+
+        async def propagate_stop_signal():
+            await cl.wait_event(self.stop_signal)
+            task_stop_signal.set()
+
+        stop_propagation = asyncio.ensure_future(propagate_stop_signal())
+        try:
+            await manage_task_async(driver, task, task_stop_signal, cl.LoopEvent(), self.config, self.sender,
+                                    self.output_rotation)
+        finally:
+            stop_propagation.cancel()
+            with self.lock:
+                del self.task_stop_signals[task_id]
+                num_running_tasks = len(self.task_stop_signals)
+                num_launched_tasks = self.num_launched_tasks
+            logging.info('Task {} completed, {} tasks are running'.format(task_id, num_running_tasks))
+            if num_running_tasks == 0:
+                idle_timeout_secs = self.config.idle_timeout_secs
+                if idle_timeout_secs and not self.stop_signal.isSet():
+                    logging.info('Waiting up to {} seconds for a new task'.format(idle_timeout_secs))
+                    await cl.wait_event(self.stop_signal, idle_timeout_secs)
+                with self.lock:
+                    # a task launched while waiting completes the executor when it terminates
+                    if num_launched_tasks == self.num_launched_tasks:
+                        logging.info('No task is running, the executor has completed')
+                        self.completed_signal.set()
 
     def killTask(self, driver, task_id):
         logging.info('Mesos requested executor to kill task {}'.format(task_id))
@@ -487,7 +950,12 @@ class CookExecutor(pm.Executor):
         grace_period = os.environ.get('MESOS_EXECUTOR_SHUTDOWN_GRACE_PERIOD', '')
         cio.print_and_log('Received kill for task {} with grace period of {}'.format(task_id_str, grace_period))
         cu.log_thread_stack_traces()
-        self.stop_signal.set()
+        with self.lock:
+            task_stop_signal = self.task_stop_signals.get(task_id_str)
+        if task_stop_signal:
+            task_stop_signal.set()
+        else:
+            logging.warning('Task {} is not running, ignoring the kill'.format(task_id_str))
 
     def shutdown(self, driver):
         logging.info('Mesos requested executor to shutdown')
@@ -500,7 +968,7 @@ class CookExecutor(pm.Executor):
     def await_completion(self):
         """
         Blocks until the internal flag completed_signal is set.
-        The completed_signal Event is expected to be set by manage_task.
+        The completed_signal Event is set by run_task once the executor is idle.
         """
         logging.info('Waiting for CookExecutor to complete...')
         self.completed_signal.wait()
@@ -0,0 +1,105 @@
+"""This module provides a minimal ctypes binding to the Linux inotify API."""
+
+import errno
+import logging
+import os
+import struct
+import sys
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+_event_header = struct.Struct('iIII')
+_libc = None
+
+
+def _load_libc():
+    """Loads the C library exposing the inotify functions, returns None when inotify is unavailable."""
+    global _libc
+    if _libc is None:
+        if not sys.platform.startswith('linux'):
+            _libc = False
+        else:
+            try:
+                # imported lazily, ctypes is only loaded once a progress file is watched
+                import ctypes
+                import ctypes.util
+                libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+                libc.inotify_init1.argtypes = [ctypes.c_int]
+                libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+                _libc = libc
+            except (AttributeError, OSError):
+                logging.exception('Unable to load inotify functions from libc')
+                _libc = False
+    return _libc or None
+
+
+def is_supported():
+    """Returns true if the inotify API is available on the current platform."""
+    return _load_libc() is not None
+
+
+def _raise_os_error(message):
+    import ctypes
+    error_number = ctypes.get_errno()
+    raise OSError(error_number, '{}: {}'.format(message, os.strerror(error_number)))
+
+
+class Inotify(object):
+    """Wraps a non-blocking inotify file descriptor."""
+
+    def __init__(self):
+        libc = _load_libc()
+        if libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not supported on {}'.format(sys.platform))
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            _raise_os_error('inotify_init1 failed')
+
+    def fileno(self):
+        """Returns the inotify file descriptor, it becomes readable when events are available."""
+        return self.fd
+
+    def add_watch(self, path, mask):
+        """Adds a watch for the events in mask on path and returns the watch descriptor."""
+        watch_descriptor = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if watch_descriptor < 0:
+            _raise_os_error('inotify_add_watch failed for {}'.format(path))
+        return watch_descriptor
+
+    def read_events(self):
+        """Reads the pending events without blocking.
+        At most a single buffer of events is read, so that a directory with a steady stream of events
+        cannot keep the caller reading indefinitely.
+
+        Returns
+        -------
+        a list of (watch_descriptor, mask, name) tuples, name is the empty string for events on the watched path.
+        """
+        events = []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return events
+        offset = 0
+        while offset + _event_header.size <= len(data):
+            watch_descriptor, mask, _, name_length = _event_header.unpack_from(data, offset)
+            offset += _event_header.size
+            name = data[offset:offset + name_length].rstrip(b'\0')
+            offset += name_length
+            events.append((watch_descriptor, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        """Closes the inotify file descriptor, all watches are removed."""
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
@@ -0,0 +1,256 @@
+"""This module keeps counters, gauges and timers of the executor's hot paths, e.g. the bytes read from each progress
+location, the depth of the message queue or the latency of the driver calls, and writes them to a json file,
+see write_snapshot.
+It also captures cProfile and tracemalloc profiles on demand, see toggle_profiling.
+"""
+
+import contextlib
+import functools
+import json
+import logging
+import os
+import time
+from threading import Lock, local
+
+INSTRUMENTATION_FILE_NAME = 'executor-instrumentation.json'
+TRACEMALLOC_FRAMES = 16
+TRACEMALLOC_TOP_STATS = 10
+
+
+class NullTimer(object):
+    """A timer that records nothing, used while timers are disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Instrumentation(object):
+    """Thread-safe counters, gauges and timers, each identified by a dotted name, e.g. progress.bytes-read.stdout.
+    Timers wrap the per-line and per-match paths of the progress trackers, they are only recorded when timers_enabled
+    is set to avoid the cost of reading the clock and taking the lock when the instrumentation is never written."""
+
+    def __init__(self, timers_enabled=True):
+        self.lock = Lock()
+        self.timers_enabled = timers_enabled
+        self.counters = {}
+        # name -> [value, max_value]
+        self.gauges = {}
+        self.start_time = time.time()
+        # name -> [count, total_secs, max_secs]
+        self.timers = {}
+
+    def increment(self, name, value=1):
+        """Increments the counter name by value."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        """Sets the current value of the gauge name, its maximum value is kept as well."""
+        with self.lock:
+            gauge = self.gauges.get(name)
+            if gauge is None:
+                self.gauges[name] = [value, value]
+            else:
+                gauge[0] = value
+                gauge[1] = max(gauge[1], value)
+
+    def record_time(self, name, duration_secs):
+        """Records a duration of the timer name."""
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, duration_secs, duration_secs]
+            else:
+                timer[0] += 1
+                timer[1] += duration_secs
+                timer[2] = max(timer[2], duration_secs)
+
+    def timer(self, name):
+        """Records the duration of the with block in the timer name, nothing is recorded when timers are disabled."""
+        if not self.timers_enabled:
+            return NULL_TIMER
+        return self.__timer(name)
+
+    @contextlib.contextmanager
+    def __timer(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_time(name, time.perf_counter() - start_time)
+
+    def snapshot(self):
+        """Returns the counters, gauges and timers as a dictionary that can be serialized to json."""
+        with self.lock:
+            counters = dict(sorted(self.counters.items()))
+            gauges = {name: {'max': max_value, 'value': value}
+                      for name, (value, max_value) in sorted(self.gauges.items())}
+            timers = {name: {'count': count,
+                             'max-secs': round(max_secs, 6),
+                             'mean-secs': round(total_secs / count, 6),
+                             'total-secs': round(total_secs, 6)}
+                      for name, (count, total_secs, max_secs) in sorted(self.timers.items())}
+        now = time.time()
+        return {'counters': counters,
+                'gauges': gauges,
+                'timers': timers,
+                'timestamp': round(now, 3),
+                'uptime-secs': round(now - self.start_time, 3)}
+
+
+__instrumentation__ = Instrumentation(timers_enabled=False)
+
+
+def set_timers_enabled(enabled):
+    """Enables or disables the timers of the executor's instrumentation, they are disabled by default."""
+    __instrumentation__.timers_enabled = enabled
+
+
+def increment(name, value=1):
+    """Increments a counter of the executor's instrumentation, see Instrumentation.increment."""
+    __instrumentation__.increment(name, value)
+
+
+def set_gauge(name, value):
+    """Sets a gauge of the executor's instrumentation, see Instrumentation.set_gauge."""
+    __instrumentation__.set_gauge(name, value)
+
+
+def record_time(name, duration_secs):
+    """Records a duration in a timer of the executor's instrumentation, see Instrumentation.record_time."""
+    __instrumentation__.record_time(name, duration_secs)
+
+
+def timer(name):
+    """Times a with block in a timer of the executor's instrumentation, see Instrumentation.timer."""
+    return __instrumentation__.timer(name)
+
+
+def timed(name):
+    """Decorates a function to record the duration of each call in the timer name."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with __instrumentation__.timer(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def snapshot():
+    """Returns the counters, gauges and timers of the executor's instrumentation, see Instrumentation.snapshot."""
+    return __instrumentation__.snapshot()
+
+
+def write_snapshot(path):
+    """Writes the counters, gauges and timers of the executor's instrumentation to the json file at path.
+    The file is replaced atomically, readers never see a partially written file."""
+    try:
+        temporary_path = '{}.tmp'.format(path)
+        with open(temporary_path, 'w') as snapshot_file:
+            json.dump(snapshot(), snapshot_file, indent=2)
+        os.replace(temporary_path, path)
+    except Exception:
+        logging.exception('Error in writing instrumentation to {}'.format(path))
+
+
+class ProfileCapture(object):
+    """Toggles a tracemalloc capture of the executor and cProfile captures of its participating threads.
+    cProfile only profiles the thread that enables it, so every participating thread calls profile_thread regularly,
+    e.g. once per iteration of its loop, to start or stop its own profiler."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.active = False
+        self.directory = '.'
+        self.generation = 0
+        self.thread_state = local()
+
+    def toggle(self, directory):
+        """Starts a capture if none is active, else stops the active capture.
+        Stopping writes the tracemalloc snapshot to directory, the thread profiles are written by profile_thread.
+
+        Returns
+        -------
+        True if a capture was started.
+        """
+        # imported lazily, the profilers are not needed until a capture is requested
+        import tracemalloc
+        with self.lock:
+            self.active = not self.active
+            if self.active:
+                self.generation += 1
+                self.directory = directory
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                logging.info('Started profile capture {} into {}'.format(self.generation, directory))
+                return True
+        snapshot_path = os.path.join(self.directory, 'executor-tracemalloc-{}.snapshot'.format(self.generation))
+        try:
+            tracemalloc_snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            tracemalloc_snapshot.dump(snapshot_path)
+            for statistic in tracemalloc_snapshot.statistics('lineno')[:TRACEMALLOC_TOP_STATS]:
+                logging.info('Allocated {}'.format(statistic))
+            logging.info('Stopped profile capture {}, tracemalloc snapshot written to {}'.format(
+                self.generation, snapshot_path))
+        except Exception:
+            logging.exception('Error in writing the tracemalloc snapshot to {}'.format(snapshot_path))
+        return False
+
+    def profile_thread(self, name, exiting=False):
+        """Starts or stops the cProfile capture of the calling thread to match the active capture.
+        A stopped profile is written to the capture's directory as executor-profile-<generation>-<name>.pstats.
+
+        Parameters
+        ----------
+        name: string
+            The name of the calling thread in the profile file name.
+        exiting: boolean
+            True when the calling thread exits, its running profile is written.
+        """
+        profile = getattr(self.thread_state, 'profile', None)
+        active = self.active and not exiting
+        if profile is not None and (not active or self.thread_state.generation != self.generation):
+            profile.disable()
+            self.thread_state.profile = None
+            profile_path = os.path.join(self.thread_state.directory, 'executor-profile-{}-{}.pstats'.format(
+                self.thread_state.generation, name))
+            try:
+                profile.dump_stats(profile_path)
+                logging.info('Profile of the {} thread written to {}'.format(name, profile_path))
+            except Exception:
+                logging.exception('Error in writing the profile to {}'.format(profile_path))
+            profile = None
+        if active and profile is None and getattr(self.thread_state, 'generation', None) != self.generation:
+            self.thread_state.directory = self.directory
+            self.thread_state.generation = self.generation
+            import cProfile
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                self.thread_state.profile = profile
+            except ValueError:
+                # since Python 3.12 a single profiler, enabled by another thread, profiles all threads
+                logging.info('The {} thread is profiled by the profiler of another thread'.format(name))
+
+
+__profile_capture__ = ProfileCapture()
+
+
+def toggle_profiling(directory):
+    """Starts or stops the executor's profile capture, see ProfileCapture.toggle."""
+    return __profile_capture__.toggle(directory)
+
+
+def profile_thread(name, exiting=False):
+    """Matches the calling thread's profiler to the executor's profile capture, see ProfileCapture.profile_thread."""
+    __profile_capture__.profile_thread(name, exiting)
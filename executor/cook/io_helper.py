@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-"""This module ensures atomic writes to stdout."""
+"""This module ensures atomic writes to stdout and copies the captured output of the task to the executor's outputs."""
 
 import logging
 import sys
@@ -9,6 +9,7 @@ from threading import Lock
 import os
 
 __stdout_lock__ = Lock()
+__stderr_lock__ = Lock()
 
 
 def print_to_buffer(lock, buffer, data, flush=False, newline=True):
@@ -78,3 +79,70 @@ def print_and_log(string_data, newline=True):
     """
     print_out('{}{}'.format(os.linesep, string_data), flush=True, newline=newline)
     logging.info(string_data)
+
+
+class CapturedOutput(object):
+    """Reads the output of the task from a pipe without blocking and copies it to one of the executor's outputs.
+    The data read is also returned, which allows the output to be scanned for progress messages in memory."""
+
+    def __init__(self, pipe, name, buffer_fn, lock):
+        """
+        Parameters
+        ----------
+        pipe: file
+            The read end of the pipe connected to the output of the task.
+        name: string
+            The name of the output, e.g. stdout.
+        buffer_fn: fn()
+            Returns the byte buffer the output is copied to, resolved on every write.
+        lock: threading.Lock
+            The lock that guards writes to the buffer.
+        """
+        self.pipe = pipe
+        self.name = name
+        self.buffer_fn = buffer_fn
+        self.lock = lock
+        self.bytes_read = 0
+        self.eof = False
+        os.set_blocking(pipe.fileno(), False)
+
+    def fileno(self):
+        """Returns the file descriptor of the pipe, it becomes readable when output is available."""
+        return self.pipe.fileno()
+
+    def read(self, size):
+        """Reads and copies up to size bytes of the available output.
+
+        Returns
+        -------
+        the data read, None when no output is currently available, empty once the pipe has been closed by the task.
+        """
+        try:
+            data = os.read(self.pipe.fileno(), size)
+        except BlockingIOError:
+            return None
+        if not data:
+            self.eof = True
+            return data
+        self.bytes_read += len(data)
+        with self.lock:
+            buffer = self.buffer_fn()
+            buffer.write(data)
+            buffer.flush()
+        return data
+
+    def close(self):
+        """Closes the read end of the pipe."""
+        self.pipe.close()
+
+
+def capture_stdout(pipe, rotating_output=None):
+    """Returns a CapturedOutput that copies the output read from pipe to sys.stdout, or to rotating_output."""
+    buffer_fn = (lambda: rotating_output) if rotating_output else (lambda: sys.stdout.buffer)
+    return CapturedOutput(pipe, 'stdout', buffer_fn, __stdout_lock__)
+
+
+def capture_stderr(pipe, rotating_output=None):
+    """Returns a CapturedOutput that copies the output read from pipe to sys.stderr, or to rotating_output."""
+    buffer_fn = (lambda: rotating_output) if rotating_output else (lambda: sys.stderr.buffer)
+    return CapturedOutput(pipe, 'stderr', buffer_fn, __stderr_lock__)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+"""This module provides the asyncio event loop that drives the executor.
+Process exit, the kill grace period, the end of progress tracking, status updates and timeouts are tasks on a
+single loop running on a dedicated thread. The driver callbacks and the remaining threads, e.g. the progress
+tracker, interact with the loop through LoopEvents and the thread-safe methods of ExecutorLoop.
+"""
+
+import asyncio
+import logging
+from threading import Event, Lock, Thread
+
+# the interval at which plain threading.Events are checked by wait_event
+EVENT_POLL_INTERVAL_SECS = 0.05
+
+
+class LoopEvent(Event):
+    """A threading.Event that can also be awaited on an event loop without blocking a thread, see wait_async."""
+
+    def __init__(self):
+        super().__init__()
+        self.waiters_lock = Lock()
+        self.waiters = set()
+
+    def set(self):
+        super().set()
+        with self.waiters_lock:
+            waiters, self.waiters = self.waiters, set()
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve_future, future)
+            except RuntimeError:
+                # the loop has been closed, there is nothing left to wake up
+                pass
+
+    async def wait_async(self, timeout_secs=None):
+        """Waits until the event is set or timeout_secs elapse.
+
+        Returns
+        -------
+        True if the event was set, False on timeout.
+        """
+        if self.is_set():
+            return True
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+        with self.waiters_lock:
+            self.waiters.add(waiter)
+        # the event may have been set before the waiter was registered
+        if self.is_set():
+            _resolve_future(future)
+        try:
+            await asyncio.wait_for(future, timeout_secs)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.waiters_lock:
+                self.waiters.discard(waiter)
+        return self.is_set()
+
+
+def _resolve_future(future):
+    if not future.done():
+        future.set_result(True)
+
+
+async def wait_event(event, timeout_secs=None):
+    """Waits, on the running loop, until event is set or timeout_secs elapse.
+    LoopEvents are awaited directly, plain threading.Events are checked every EVENT_POLL_INTERVAL_SECS.
+
+    Returns
+    -------
+    True if the event was set, False on timeout.
+    """
+    if isinstance(event, LoopEvent):
+        return await event.wait_async(timeout_secs)
+    loop = asyncio.get_event_loop()
+    deadline = None if timeout_secs is None else loop.time() + timeout_secs
+    while not event.is_set():
+        if deadline is not None and loop.time() >= deadline:
+            return False
+        poll_interval_secs = EVENT_POLL_INTERVAL_SECS
+        if deadline is not None:
+            poll_interval_secs = min(poll_interval_secs, max(deadline - loop.time(), 0))
+        await asyncio.sleep(poll_interval_secs)
+    return True
+
+
+class ExecutorLoop(object):
+    """Runs an asyncio event loop on a dedicated daemon thread."""
+
+    def __init__(self, name='executor-loop'):
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.__run, name=name, daemon=True)
+        self.thread.start()
+
+    def __run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        except Exception:
+            logging.exception('Error in the executor loop')
+
+    def submit(self, coroutine):
+        """Schedules the coroutine on the loop from any thread.
+
+        Returns
+        -------
+        a concurrent.futures.Future for the result of the coroutine.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine):
+        """Runs the coroutine on the loop and blocks the calling thread, which cannot be the loop's, until it
+        completes.
+
+        Returns
+        -------
+        the result of the coroutine.
+        """
+        return self.submit(coroutine).result()
+
+
+__executor_loop__ = None
+__executor_loop_lock__ = Lock()
+
+
+def get_executor_loop():
+    """Returns the executor loop shared by the executor's components, it is started on first use."""
+    global __executor_loop__
+    with __executor_loop_lock__:
+        if __executor_loop__ is None:
+            __executor_loop__ = ExecutorLoop()
+        return __executor_loop__
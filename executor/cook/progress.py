@@ -1,11 +1,31 @@
+import json
 import logging
+import numbers
 import os
 import re
+import selectors
 import time
-from threading import Event, Lock, Thread
+from threading import Lock, Thread
 
+import cook.inotify as ci
+import cook.instrumentation as cins
+import cook.loop as cl
+import cook.scanner as cscan
 import cook.util as cu
 
+START_MODE_LAST_MATCH = 'last-match'
+START_MODE_OFFSET = 'offset'
+
+WATCH_MODE_INOTIFY = 'inotify'
+WATCH_MODE_POLL = 'poll'
+
+# Upper bound on the time spent blocked waiting for inotify events before the signals are re-checked
+INOTIFY_MAX_WAIT_MS = 1000
+
+# Regex constructs that change meaning once the regex is a branch of an alternation
+GLOBAL_FLAGS_PATTERN = re.compile(rb'\(\?[aiLmsux]+\)')
+GROUP_REFERENCE_PATTERN = re.compile(rb'\\[1-9]|\(\?P=|\(\?\(')
+
 class ProgressSequenceCounter:
     """Utility class that supports atomically incrementing the sequence value."""
     def __init__(self, initial=0):
@@ -19,6 +39,235 @@ class ProgressSequenceCounter:
             return self.value
 
 
+class PollingChangeWaiter(object):
+    """Waits for changes to the target files by sleeping for a fixed interval."""
+
+    def __init__(self, sleep_time_ms):
+        self.sleep_secs = sleep_time_ms / 1000
+        self.wait_count = 0
+        self.selector = None
+
+    def watch(self, target_file):
+        """Nothing to do, every target file is re-read after each sleep."""
+        pass
+
+    def watch_fd(self, fd):
+        """Ends the sleep early when fd, e.g. a pipe, becomes readable."""
+        if self.selector is None:
+            self.selector = selectors.DefaultSelector()
+        self.selector.register(fd, selectors.EVENT_READ)
+
+    def unwatch_fd(self, fd):
+        """Stops watching fd, it must be called before fd is closed."""
+        self.selector.unregister(fd)
+
+    def wait(self):
+        """Sleeps for the configured interval, or until one of the watched file descriptors is readable."""
+        self.wait_count += 1
+        if self.selector is not None and self.selector.get_map():
+            self.selector.select(self.sleep_secs)
+        else:
+            time.sleep(self.sleep_secs)
+
+    def wake(self):
+        """Nothing to do, the sleep interval is short enough for the caller to notice signals."""
+        pass
+
+    def close(self):
+        if self.selector is not None:
+            self.selector.close()
+
+
+class InotifyChangeWaiter(object):
+    """Waits for changes to the target files using inotify events.
+    The target files are watched for modifications, the directories containing them are watched for the creation
+    (or renaming) of the target files so that files which do not exist yet are also reported.
+    A single waiter can watch any number of files, readiness is multiplexed using a selector.
+    """
+
+    def __init__(self, max_wait_ms, poll_interval_ms):
+        """
+        max_wait_ms: int
+            The maximum time to block in a single wait, bounds the delay in noticing signals set without a wake.
+        poll_interval_ms: int
+            The maximum time to block in a single wait once a target file could not be watched using inotify.
+        """
+        self.max_wait_secs = max_wait_ms / 1000
+        self.poll_interval_secs = poll_interval_ms / 1000
+        self.wait_count = 0
+        self.directory_watches = {}
+        self.file_watches = set()
+        self.watched_names = {}
+        self.inotify = ci.Inotify()
+        try:
+            self.wake_read_fd, self.wake_write_fd = os.pipe()
+        except Exception:
+            self.inotify.close()
+            raise
+        os.set_blocking(self.wake_read_fd, False)
+        os.set_blocking(self.wake_write_fd, False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.inotify.fileno(), selectors.EVENT_READ)
+        self.selector.register(self.wake_read_fd, selectors.EVENT_READ)
+        # guards the wake pipe against being written to after it has been closed
+        self.lock = Lock()
+        self.closed = False
+
+    def watch(self, target_file):
+        """Starts reporting the creation and modification of target_file.
+        When the containing directory cannot be watched, waits are bounded by the polling interval instead."""
+        target_path = os.path.abspath(target_file)
+        directory, file_name = os.path.split(target_path)
+        try:
+            if directory not in self.directory_watches:
+                mask = ci.IN_CREATE | ci.IN_MOVED_TO
+                self.directory_watches[directory] = self.inotify.add_watch(directory, mask)
+            self.watched_names[(self.directory_watches[directory], file_name)] = target_path
+        except OSError:
+            logging.exception('Unable to watch %s using inotify, falling back to polling', target_file)
+            self.max_wait_secs = min(self.max_wait_secs, self.poll_interval_secs)
+            return
+        self.__watch_file(target_path)
+
+    def watch_fd(self, fd):
+        """Ends waits when fd, e.g. a pipe, becomes readable."""
+        self.selector.register(fd, selectors.EVENT_READ)
+
+    def unwatch_fd(self, fd):
+        """Stops watching fd, it must be called before fd is closed."""
+        self.selector.unregister(fd)
+
+    def wait(self):
+        """Blocks until a target file is created or modified, a watched file descriptor is readable,
+        wake is called, or max_wait_ms elapses.
+        Events for other files in the watched directories do not end the wait,
+        an overflow of the event queue does since events for the target files may have been dropped."""
+        self.wait_count += 1
+        deadline = time.time() + self.max_wait_secs
+        remaining_secs = self.max_wait_secs
+        while remaining_secs > 0:
+            ready_fds = [key.fd for key, _ in self.selector.select(remaining_secs)]
+            if self.wake_read_fd in ready_fds:
+                self.__drain_wake_pipe()
+                return
+            if any(fd != self.inotify.fileno() for fd in ready_fds):
+                return
+            if ready_fds:
+                relevant_events = [self.__is_relevant_event(event) for event in self.inotify.read_events()]
+                if any(relevant_events):
+                    return
+            remaining_secs = deadline - time.time()
+
+    def wake(self):
+        """Interrupts a pending or the next wait, safe to call from any thread."""
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                os.write(self.wake_write_fd, b'\0')
+            except BlockingIOError:
+                # the pipe is full, a wake is already pending
+                pass
+
+    def close(self):
+        """Releases the selector, inotify and pipe file descriptors."""
+        with self.lock:
+            self.closed = True
+            self.selector.close()
+            self.inotify.close()
+            os.close(self.wake_read_fd)
+            os.close(self.wake_write_fd)
+
+    def __watch_file(self, target_path):
+        """Watches an existing target file for modifications, files that do not exist yet are watched once created."""
+        try:
+            self.file_watches.add(self.inotify.add_watch(target_path, ci.IN_MODIFY | ci.IN_CLOSE_WRITE))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logging.exception('Unable to watch %s using inotify, falling back to polling', target_path)
+            self.max_wait_secs = min(self.max_wait_secs, self.poll_interval_secs)
+
+    def __is_relevant_event(self, event):
+        watch_descriptor, mask, name = event
+        if mask & ci.IN_Q_OVERFLOW or watch_descriptor in self.file_watches:
+            return True
+        target_path = self.watched_names.get((watch_descriptor, name))
+        if target_path is not None:
+            # the target file has been created or replaced, its modifications are watched from now on
+            self.__watch_file(target_path)
+            return True
+        return False
+
+    def __drain_wake_pipe(self):
+        try:
+            while os.read(self.wake_read_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+
+def create_change_waiter(watch_mode, sleep_time_ms, location_tag):
+    """Creates the waiter used to block until new content may be available in the watched files.
+    Falls back to polling when inotify is requested but unavailable.
+
+    Parameters
+    ----------
+    watch_mode: string
+        Either WATCH_MODE_INOTIFY or WATCH_MODE_POLL.
+    sleep_time_ms: int
+        The polling interval used by the polling waiter.
+    location_tag: string
+        A tag to identify the target locations in logs.
+
+    Returns
+    -------
+    an InotifyChangeWaiter or a PollingChangeWaiter.
+    """
+    if watch_mode == WATCH_MODE_INOTIFY:
+        if ci.is_supported():
+            try:
+                return InotifyChangeWaiter(INOTIFY_MAX_WAIT_MS, sleep_time_ms)
+            except Exception:
+                logging.exception('Unable to use inotify, falling back to polling [tag=%s]', location_tag)
+        else:
+            logging.info('inotify is not supported, falling back to polling [tag=%s]', location_tag)
+    return PollingChangeWaiter(sleep_time_ms)
+
+
+def parse_progress_record(line):
+    """Parses a structured progress record written to a progress channel, see cook.channel.
+    A record is a json object with a numeric percent, an optional message and optional custom fields, e.g.
+    {"percent": 42.5, "message": "stage 2 of 4", "stage": 2}.
+
+    Parameters
+    ----------
+    line: bytes
+        The line to parse.
+
+    Returns
+    -------
+    the dictionary with the percent, the message (as bytes) and the custom fields of the record,
+    or None when the line is not a record.
+    """
+    stripped_line = line.strip()
+    if not stripped_line.startswith(b'{'):
+        return None
+    try:
+        record = json.loads(stripped_line.decode())
+    except ValueError:
+        return None
+    if not isinstance(record, dict):
+        return None
+    percent = record.pop('percent', None)
+    if not isinstance(percent, numbers.Real) or isinstance(percent, bool):
+        return None
+    message = record.pop('message', '')
+    return {'fields': record,
+            'message': str(message).encode(),
+            'percent': float(percent)}
+
+
 class ProgressUpdater(object):
     """This class is responsible for sending progress updates to the scheduler.
     It throttles the rate at which progress updates are sent.
@@ -90,10 +339,12 @@ class ProgressUpdater(object):
             # ensure we do not send outdated progress data due to parallel repeated calls to this method
             if progress_data is None or not self.is_increasing_sequence(progress_data):
                 logging.info('Skipping invalid/outdated progress data {}'.format(progress_data))
+                cins.increment('progress.messages-outdated')
             elif not force_send and not self.has_enough_time_elapsed_since_last_update():
                 logging.debug('Not sending progress data as enough time has not elapsed since last update')
+                cins.increment('progress.messages-throttled')
             else:
-                logging.info('Sending progress message {}'.format(progress_data))
+                logging.info('Sending progress message %s', progress_data)
                 message_dict = dict(progress_data)
                 message_dict['task-id'] = self.task_id
 
@@ -116,8 +367,167 @@ class ProgressUpdater(object):
                 if send_success:
                     self.last_progress_data_sent = progress_data
                     self.last_reported_time = time.time()
+                    cins.increment('progress.messages-sent')
                 else:
                     logging.info('Unable to send progress message {}'.format(message_dict))
+                    cins.increment('progress.messages-failed')
+
+    def progress_message_failed(self, message_dict):
+        """Marks the progress in message_dict as not sent, when send_progress_message_fn queued the message but it
+        could not be sent later, so that the progress is sent again by a forced update.
+
+        Parameters
+        ----------
+        message_dict: dictionary
+            The progress message that could not be sent.
+
+        Returns
+        -------
+        Nothing
+        """
+        with self.lock:
+            last_progress_data = self.last_progress_data_sent
+            if last_progress_data and last_progress_data['progress-sequence'] == message_dict['progress-sequence']:
+                logging.info('Unable to send progress message %s', message_dict)
+                self.last_progress_data_sent = None
+                cins.increment('progress.messages-failed')
+
+
+def parse_metric_value(value_data):
+    """Parses the value captured by a metric pattern, ints are kept as ints so that their sums stay exact."""
+    try:
+        return int(value_data)
+    except ValueError:
+        return float(value_data)
+
+
+class MetricExtractor(object):
+    """Extracts the custom numeric metrics published by the task in its output, e.g. rows processed or loss.
+    Every metric has a pattern whose first capture group is the value, the values of each metric are aggregated
+    (count, last, min, max and sum) across all the locations of the task.
+    All the patterns, along with the progress regex, are combined into a single alternation so that each buffer is
+    still scanned in a single pass, only the lines matching the alternation are matched against every pattern.
+    Patterns whose meaning would change inside the alternation, i.e. with global inline flags such as (?i) or with
+    group references, are not combined, every line is then matched against each pattern separately."""
+
+    def __init__(self, metric_patterns):
+        """
+        Parameters
+        ----------
+        metric_patterns: dictionary
+            The map from the metric names to their regex string, see cook.config.parse_metric_patterns.
+        """
+        self.patterns = [(name, re.compile(metric_patterns[name].encode())) for name in sorted(metric_patterns)]
+        self.metrics_pattern = self.combine_patterns([pattern.pattern for _, pattern in self.patterns])
+        self.lock = Lock()
+        self.metrics = {}
+        self.sequence = 0
+
+    @staticmethod
+    def combine_patterns(regex_bytes_list):
+        """Returns the compiled alternation of the non-empty regexes, None when they cannot be combined."""
+        regexes = [regex for regex in regex_bytes_list if regex]
+        if any(GLOBAL_FLAGS_PATTERN.search(regex) or GROUP_REFERENCE_PATTERN.search(regex) for regex in regexes):
+            return None
+        try:
+            return re.compile(b'|'.join(b'(?:' + regex + b')' for regex in regexes))
+        except re.error:
+            logging.exception('Unable to combine the patterns %s, they are matched separately', regexes)
+            return None
+
+    def candidate_pattern(self, progress_regex_string):
+        """Returns the pattern matched by the lines containing either progress or a metric,
+        None when every line is a candidate."""
+        return self.combine_patterns([progress_regex_string.encode()] +
+                                     [pattern.pattern for _, pattern in self.patterns])
+
+    def extract(self, line):
+        """Extracts and aggregates the metric values in line.
+
+        Returns
+        -------
+        the number of values extracted.
+        """
+        if self.metrics_pattern is not None and not self.metrics_pattern.search(line):
+            return 0
+        num_values = 0
+        for name, pattern in self.patterns:
+            match = pattern.search(line)
+            if match is None:
+                continue
+            try:
+                value = parse_metric_value(match.group(1))
+            except (TypeError, ValueError):
+                logging.debug('Skipping the %s value in "%s" as it is not a number', name, line)
+                continue
+            with self.lock:
+                aggregate = self.metrics.get(name)
+                if aggregate is None:
+                    self.metrics[name] = {'count': 1, 'last': value, 'max': value, 'min': value, 'sum': value}
+                else:
+                    aggregate['count'] += 1
+                    aggregate['last'] = value
+                    aggregate['max'] = max(aggregate['max'], value)
+                    aggregate['min'] = min(aggregate['min'], value)
+                    aggregate['sum'] += value
+                self.sequence += 1
+            num_values += 1
+        return num_values
+
+    def current_metrics(self):
+        """Returns the current metrics state, None until a value has been extracted."""
+        with self.lock:
+            if not self.sequence:
+                return None
+            return {'metrics': {name: dict(aggregate) for name, aggregate in self.metrics.items()},
+                    'metrics-sequence': self.sequence}
+
+
+class MetricsUpdater(object):
+    """This class is responsible for sending the aggregated metrics to the scheduler.
+    Like ProgressUpdater, it throttles the rate at which updates are sent and skips outdated updates.
+    """
+
+    def __init__(self, task_id, poll_interval_ms, send_metrics_message_fn):
+        """
+        task_id: string
+            The task id.
+        poll_interval_ms: int
+            The interval after which to send a subsequent metrics update.
+        send_metrics_message_fn: function(message)
+            The helper function used to send the metrics message.
+        """
+        self.task_id = task_id
+        self.poll_interval_ms = poll_interval_ms
+        self.last_reported_time = None
+        self.last_metrics_sequence_sent = 0
+        self.send_metrics_message = send_metrics_message_fn
+        self.lock = Lock()
+
+    def send_metrics_update(self, metrics_data, force_send=False):
+        """Sends a metrics update, see MetricExtractor.current_metrics, if it is newer than the last update sent and
+        enough time has elapsed since the last update. Using this method is thread-safe."""
+        with self.lock:
+            if metrics_data is None or metrics_data['metrics-sequence'] <= self.last_metrics_sequence_sent:
+                return
+            if not force_send and self.last_reported_time is not None and \
+                    (time.time() - self.last_reported_time) * 1000 < self.poll_interval_ms:
+                return
+            message_dict = dict(metrics_data)
+            message_dict['task-id'] = self.task_id
+            if self.send_metrics_message(message_dict):
+                self.last_metrics_sequence_sent = metrics_data['metrics-sequence']
+                self.last_reported_time = time.time()
+                cins.increment('progress.metrics-messages-sent')
+            else:
+                logging.info('Unable to send metrics message %s', message_dict)
+
+    def metrics_message_failed(self, message_dict):
+        """Marks the metrics in message_dict as not sent, so that they are sent again by a forced update."""
+        with self.lock:
+            if self.last_metrics_sequence_sent == message_dict['metrics-sequence']:
+                logging.info('Unable to send metrics message %s', message_dict)
+                self.last_metrics_sequence_sent = 0
 
 
 class ProgressWatcher(object):
@@ -126,7 +536,9 @@ class ProgressWatcher(object):
     """
 
     def __init__(self, output_name, location_tag, sequence_counter, max_bytes_read_per_line, progress_regex_string,
-                 stop_signal, task_completed_signal, progress_termination_signal):
+                 stop_signal, task_completed_signal, progress_termination_signal, watch_mode=WATCH_MODE_POLL,
+                 output_stream=None, start_offset=0, structured=False, progress=None, metric_extractor=None,
+                 scan_last_match=False):
         """The ProgressWatcher constructor.
 
         Parameters
@@ -135,22 +547,66 @@ class ProgressWatcher(object):
             The progress regex to match against, it must return one or two capture groups.
             The first capture group represents the progress percentage.
             The second capture group, if present, represents the progress message.
+        watch_mode: string
+            Either WATCH_MODE_INOTIFY or WATCH_MODE_POLL, determines how tail waits for new content.
+        output_stream: cook.io_helper.CapturedOutput
+            When provided, the lines are read from the captured output of the task instead of output_name.
+        start_offset: int
+            The offset output_name is read from, e.g. its size when the task was launched, so that the content
+            written by the previous tasks of the executor is skipped. The file is read from its start when it is
+            smaller, e.g. after it has been truncated.
+        structured: boolean
+            When true, e.g. for a progress channel, the lines are parsed as progress records (see
+            parse_progress_record) and the lines that are not records are matched against the progress regex.
+        progress: dictionary
+            The initial progress state, e.g. the one restored from a checkpoint, see cook.checkpoint.
+        metric_extractor: MetricExtractor
+            When provided, the metrics published in the lines are also extracted, in the same pass.
+        scan_last_match: boolean
+            When true, start_offset is ignored: the existing content of output_name is scanned backwards from its
+            end for the most recent line matching the progress regex, that line is generated first and output_name
+            is then tailed from its end. The other existing lines, e.g. older progress or metrics, are skipped.
         """
         self.target_file = output_name
+        self.output_stream = output_stream
+        self.start_offset = start_offset
+        self.scan_last_match = scan_last_match
+        self.structured = structured
         self.location_tag = location_tag
         self.sequence_counter = sequence_counter
         self.max_bytes_read_per_line = max_bytes_read_per_line
         self.progress_regex_string = progress_regex_string
         self.progress_regex_pattern = re.compile(progress_regex_string.encode())
-        self.progress = None
+        self.metric_extractor = metric_extractor
+        if metric_extractor is not None:
+            self.candidate_pattern = metric_extractor.candidate_pattern(progress_regex_string)
+        else:
+            self.candidate_pattern = self.progress_regex_pattern
+        if self.candidate_pattern is None:
+            self.progress_regex_literal = None
+        else:
+            self.progress_regex_literal = cscan.required_literal(self.candidate_pattern)
+        self.progress = progress
         self.stop_signal = stop_signal
         self.task_completed_signal = task_completed_signal
         self.progress_termination_signal = progress_termination_signal
+        self.watch_mode = watch_mode
+        self.waiter = None
+        self.fragments_read = 0
+        # the identity of output_name and the offset up to which its content has been processed, once opened
+        self.file_identity = None
+        self.offset = None
 
     def current_progress(self):
         """Returns the current progress dictionary."""
         return self.progress
 
+    def wake(self):
+        """Interrupts tail while it waits for new content, used after one of the signals has been set."""
+        waiter = self.waiter
+        if waiter is not None:
+            waiter.wake()
+
     def tail(self, sleep_time_ms):
         """This method incrementally generates lines from a file by waiting for new content from a file.
         It behaves like the 'tail -f' shell command.
@@ -159,15 +615,49 @@ class ProgressWatcher(object):
         ----------
         sleep_time_ms: int
             The unit of time in ms to repetitively sleep when the file has not been created or no new
-            content is available in the file being tailed.
+            content is available in the file being tailed. Only used when polling for changes.
         
         Returns
         -------
         an incrementally generated list of lines in the file being tailed.
         """
+        self.waiter = create_change_waiter(self.watch_mode, sleep_time_ms, self.location_tag)
         try:
-            sleep_param = sleep_time_ms / 1000
+            self.waiter.watch(self.target_file)
+            for line in self.tail_lines():
+                if line is None:
+                    # no new line available, wait for the file to change before trying again
+                    self.waiter.wait()
+                else:
+                    yield line
+        finally:
+            waiter, self.waiter = self.waiter, None
+            waiter.close()
+
+    def tail_lines(self, max_fragments_per_poll=None, candidates_only=False):
+        """This method incrementally generates lines from a file without waiting for new content.
+        None is generated when the file has not been created or no new content is available, the caller is
+        expected to wait for the file to change before resuming the generator.
+        The file is read in large chunks, see cook.scanner.LineScanner.
+
+        Parameters
+        ----------
+        max_fragments_per_poll: int, optional
+            When provided, None is also generated once this many consecutive fragments have been read so that
+            the caller can service other locations. Callers can use fragments_read to tell the two cases apart.
+        candidates_only: boolean, optional
+            When true, only the lines that match the progress regex are generated.
+            Lines without the literal required by the progress regex, if any, are skipped without being matched.
 
+        Returns
+        -------
+        an incrementally generated list of lines in the file being tailed, interleaved with None.
+        """
+        if self.output_stream is not None:
+            yield from self.__scan_lines(self.output_stream, max_fragments_per_poll, candidates_only)
+            return
+
+        try:
             if os.path.exists(self.target_file) and not os.path.isfile(self.target_file):
                 logging.info('Skipping progress monitoring on %s as it is not a file', self.target_file)
                 return
@@ -176,7 +666,7 @@ class ProgressWatcher(object):
                 logging.debug('Awaiting creation of file %s [tag=%s]', self.target_file, self.location_tag)
 
             while not os.path.isfile(self.target_file) and not self.task_completed_signal.isSet():
-                time.sleep(sleep_param)
+                yield None
 
             if not os.path.isfile(self.target_file):
                 logging.info('Progress output file has not been created [tag=%s]', self.location_tag)
@@ -187,40 +677,97 @@ class ProgressWatcher(object):
                 return
 
             logging.info('File has been created, reading contents [tag=%s]', self.location_tag)
-            linesep_bytes = os.linesep.encode()
-            fragment_index = 0
-            line_index = 0
-
-            def log_tail_summary():
-                log_message = '%s fragments and %s lines read while processing progress messages [tag=%s]'
-                logging.info(log_message, fragment_index, line_index, self.location_tag)
-
             with open(self.target_file, 'rb') as target_file_obj:
-                while not self.stop_signal.isSet():
-                    if self.progress_termination_signal.isSet():
-                        logging.info('tail short-circuiting due to progress termination [tag=%s]', self.location_tag)
-                        log_tail_summary()
-                        break
-                    line = target_file_obj.readline(self.max_bytes_read_per_line)
-                    if not line:
-                        # exit if program has completed and there are no more lines to read
-                        if self.task_completed_signal.isSet():
-                            log_tail_summary()
-                            break
-                        # no new line available, sleep before trying again
-                        time.sleep(sleep_param)
-                        continue
-
-                    fragment_index += 1
-                    if line.endswith(linesep_bytes):
-                        line_index += 1
-                    yield line
-                if self.stop_signal.isSet() and not self.task_completed_signal.isSet():
-                    logging.info('Task requested to be killed, may not have processed all progress messages')
+                stat_result = os.fstat(target_file_obj.fileno())
+                last_match_line = None
+                if self.scan_last_match and self.progress_regex_string:
+                    last_match_line = self.__find_last_match(target_file_obj, stat_result.st_size)
+                elif 0 < self.start_offset <= stat_result.st_size:
+                    logging.info('Skipping the first %s bytes [tag=%s]', self.start_offset, self.location_tag)
+                    target_file_obj.seek(self.start_offset)
+                self.file_identity = [stat_result.st_dev, stat_result.st_ino]
+                self.offset = target_file_obj.tell()
+                if last_match_line is not None:
+                    yield last_match_line
+                yield from self.__scan_lines(target_file_obj, max_fragments_per_poll, candidates_only)
         except Exception as exception:
             logging.exception('Error while tailing %s [tag=%s]', self.target_file, self.location_tag)
             raise exception
 
+    def __find_last_match(self, target_file_obj, file_size):
+        """Scans target_file_obj backwards from file_size for the last line matching the progress regex.
+        The file is left positioned after its last complete line, the lines after it are tailed.
+
+        Returns
+        -------
+        the last matching line, None when no line matches.
+        """
+        reverse_scanner = cscan.ReverseLineScanner(target_file_obj, file_size, self.max_bytes_read_per_line)
+        last_match_line = None
+        with cins.timer('progress.reverse-scan'):
+            for line in reverse_scanner.lines():
+                if self.progress_regex_pattern.search(line):
+                    last_match_line = line
+                    break
+        target_file_obj.seek(reverse_scanner.lines_end)
+        logging.info('Scanned the last %s of %s bytes backwards, %s matching line found [tag=%s]',
+                     reverse_scanner.bytes_read, file_size, 'a' if last_match_line else 'no', self.location_tag)
+        return last_match_line
+
+    def __scan_lines(self, source, max_fragments_per_poll, candidates_only):
+        """Generates the lines read from source, a file or captured output, see tail_lines."""
+        if candidates_only:
+            scanner = cscan.LineScanner(source, self.max_bytes_read_per_line,
+                                        candidate_filter=self.candidate_pattern and self.candidate_pattern.search,
+                                        candidate_literal=self.progress_regex_literal)
+        else:
+            scanner = cscan.LineScanner(source, self.max_bytes_read_per_line)
+        fragments_since_poll = 0
+        bytes_counter = 'progress.bytes-read.{}'.format(self.location_tag)
+        lines_counter = 'progress.lines-read.{}'.format(self.location_tag)
+
+        def log_tail_summary():
+            log_message = '%s fragments and %s lines read while processing progress messages [tag=%s]'
+            logging.info(log_message, self.fragments_read, scanner.lines_read, self.location_tag)
+
+        # captured output is drained even after a stop was requested, the task must never block writing its output
+        while self.output_stream is not None or not self.stop_signal.isSet():
+            fragments_before_scan = scanner.fragments_read
+            bytes_before_scan, lines_before_scan = scanner.bytes_read, scanner.lines_read
+            with cins.timer('progress.scan'):
+                lines = scanner.scan()
+            if source is not self.output_stream:
+                # the content of the trailing partial line is read again after a resume
+                self.offset = source.tell() - len(scanner.partial_line)
+            if scanner.bytes_read != bytes_before_scan:
+                cins.increment(bytes_counter, scanner.bytes_read - bytes_before_scan)
+                cins.increment(lines_counter, scanner.lines_read - lines_before_scan)
+            # checked after the scan, content written after the termination is never generated
+            if self.progress_termination_signal.isSet():
+                logging.info('tail short-circuiting due to progress termination [tag=%s]', self.location_tag)
+                log_tail_summary()
+                break
+            if lines is None:
+                # exit if program has completed (or closed its output) and there are no more lines to read
+                if self.task_completed_signal.isSet() or (self.output_stream is not None and self.output_stream.eof):
+                    log_tail_summary()
+                    break
+                fragments_since_poll = 0
+                yield None
+                continue
+
+            self.fragments_read += scanner.fragments_read - fragments_before_scan
+            for line in lines:
+                yield line
+
+            if max_fragments_per_poll:
+                fragments_since_poll += scanner.fragments_read - fragments_before_scan
+                if fragments_since_poll >= max_fragments_per_poll:
+                    fragments_since_poll = 0
+                    yield None
+        if self.stop_signal.isSet() and not self.task_completed_signal.isSet():
+            logging.info('Task requested to be killed, may not have processed all progress messages')
+
     def match_progress_update(self, input_data):
         """Returns the progress tuple when the input string matches the provided regex.
 
@@ -237,16 +784,33 @@ class ProgressWatcher(object):
         matches = self.progress_regex_pattern.findall(input_data)
         return matches[0] if len(matches) >= 1 else None
 
+    def __match_line(self, line):
+        """Returns the progress report in line, a record (see parse_progress_record) or a regex match, or None."""
+        if self.structured:
+            with cins.timer('progress.record-parse'):
+                progress_record = parse_progress_record(line)
+            if progress_record is not None:
+                return progress_record
+        if not self.progress_regex_string:
+            return None
+        with cins.timer('progress.regex-match'):
+            return self.match_progress_update(line)
+
     def __update_progress(self, progress_report):
         """Updates the progress field with the data from progress_report if it is valid."""
-        if isinstance(progress_report, tuple) and len(progress_report) == 2:
-            percent_data, message_data = progress_report
-        elif isinstance(progress_report, tuple) and len(progress_report) == 1:
-            percent_data, message_data = progress_report[0], b''
+        progress_fields = None
+        if isinstance(progress_report, dict):
+            percent_float, message_data = progress_report['percent'], progress_report['message']
+            progress_fields = progress_report['fields']
         else:
-            percent_data, message_data = progress_report, b''
+            if isinstance(progress_report, tuple) and len(progress_report) == 2:
+                percent_data, message_data = progress_report
+            elif isinstance(progress_report, tuple) and len(progress_report) == 1:
+                percent_data, message_data = progress_report[0], b''
+            else:
+                percent_data, message_data = progress_report, b''
+            percent_float = float(percent_data.decode())
 
-        percent_float = float(percent_data.decode())
         if percent_float < 0 or percent_float > 100:
             logging.info('Skipping "%s" as the percent is not in [0, 100]', progress_report)
             return False
@@ -257,6 +821,8 @@ class ProgressWatcher(object):
         self.progress = {'progress-message': message_data,
                          'progress-percent': percent_int,
                          'progress-sequence': self.sequence_counter.increment_and_get()}
+        if progress_fields:
+            self.progress['progress-fields'] = progress_fields
         return True
 
     def retrieve_progress_states(self):
@@ -269,16 +835,45 @@ class ProgressWatcher(object):
 
         Note: This function must rethrow any OSError exceptions that it encounters.
 
+        Returns
+        -------
+        An incrementally generated list of progress states.
+        """
+        sleep_time_ms = 50
+        return self.progress_states(self.tail(sleep_time_ms))
+
+    def progress_states(self, lines):
+        """Generates the progress states from the provided lines, see retrieve_progress_states.
+        None entries in lines (see tail_lines) are passed through as None entries in the progress states.
+
+        Note: This function must rethrow any OSError exceptions that it encounters.
+
+        Parameters
+        ----------
+        lines: iterable
+            The lines to match, lines are only consumed when the progress regex is not empty.
+
         Returns
         -------
         An incrementally generated list of progress states.
         """
         last_unprocessed_report = None
-        if self.progress_regex_string:
-            sleep_time_ms = 50
-            for line in self.tail(sleep_time_ms):
+        matches_lines = self.progress_regex_string or self.structured or self.metric_extractor is not None
+        if not matches_lines and self.output_stream is not None:
+            # captured output must be consumed even though it is not matched
+            for line in lines:
+                if line is None:
+                    yield None
+        elif matches_lines:
+            for line in lines:
+                if line is None:
+                    yield None
+                    continue
                 try:
-                    progress_report = self.match_progress_update(line)
+                    if self.metric_extractor is not None:
+                        with cins.timer('progress.metric-match'):
+                            self.metric_extractor.extract(line)
+                    progress_report = self.__match_line(line)
                     if progress_report is not None:
                         if self.task_completed_signal.isSet():
                             last_unprocessed_report = progress_report
@@ -294,13 +889,18 @@ class ProgressWatcher(object):
                 yield self.progress
 
 
-class ProgressTracker(object):
-    """Helper class to track progress messages from the specified location."""
+class MultiplexedProgressTracker(object):
+    """Helper class to track progress messages from any number of locations using a single thread.
+    Every location is read without blocking, the thread only blocks (on a single waiter) when none of the
+    locations has new content available."""
 
-    def __init__(self, config, stop_signal, task_completed_signal, counter, progress_updater,
-                 progress_termination_signal, location, location_tag, os_error_handler):
-        """Launches the threads that track progress and send progress updates to the driver.
+    # Number of fragments read from a location before the other locations are serviced, checked after each chunk
+    max_fragments_per_poll = 1000
 
+    def __init__(self, config, stop_signal, task_completed_signal, counter, progress_updater,
+                 progress_termination_signal, os_error_handler, checkpointer=None, metric_extractor=None,
+                 metrics_updater=None):
+        """
         Parameters
         ----------
         config: cook.config.ExecutorConfig
@@ -309,27 +909,80 @@ class ProgressTracker(object):
             Event that determines if an interrupt was sent
         task_completed_signal: threading.Event
             Event that tracks task execution completion
+        counter: ProgressSequenceCounter
+            The sequence counter shared by all the locations
         progress_updater: ProgressUpdater
             The progress updater used to send the progress messages
-        counter: ProgressSequenceCounter
-            The sequence counter
-        location: string
-            The target location to read for progress messages
-        location_tag: string
-            A tag to identify the target location.
+        progress_termination_signal: threading.Event
+            Event that short-circuits tracking of the remaining content in all locations
         os_error_handler: fn(os_error)
-            OSError exception handler for out of memory situations."""
-        self.location_tag = location_tag
-        self.os_error_handler = os_error_handler
-        self.progress_complete_event = Event()
-        self.watcher = ProgressWatcher(location, location_tag, counter, config.max_bytes_read_per_line,
-                                       config.progress_regex_string, stop_signal, task_completed_signal,
-                                       progress_termination_signal)
+            OSError exception handler for out of memory situations.
+        checkpointer: cook.checkpoint.ProgressCheckpointer
+            When provided, the offsets and progress of the locations are checkpointed by the tracker thread.
+        metric_extractor: MetricExtractor
+            When provided, the metrics published in every location are extracted and aggregated.
+        metrics_updater: MetricsUpdater
+            The metrics updater used to send the aggregated metrics, required with metric_extractor."""
+        self.config = config
+        self.stop_signal = stop_signal
+        self.task_completed_signal = task_completed_signal
+        self.counter = counter
         self.updater = progress_updater
+        self.progress_termination_signal = progress_termination_signal
+        self.os_error_handler = os_error_handler
+        self.checkpointer = checkpointer
+        self.metric_extractor = metric_extractor
+        self.metrics_updater = metrics_updater
+        self.progress_complete_event = cl.LoopEvent()
+        self.lock = Lock()
+        self.pending_watchers = []
+        self.watchers = []
+        self.waiter = create_change_waiter(config.progress_watch_mode, 50, 'multiplexed')
+
+    def add_location(self, location, location_tag, start_offset=0, progress=None, scan_last_match=False):
+        """Registers a location to track progress messages from, can be called before or after start.
+        Locations registered after the task has completed are ignored.
+        The location is read from start_offset, or from its last progress match when scan_last_match is true, with
+        the initial progress state, see ProgressWatcher."""
+        logging.info('Adding progress monitoring location %s [tag=%s]', location, location_tag)
+        watcher = ProgressWatcher(location, location_tag, self.counter, self.config.max_bytes_read_per_line,
+                                  self.config.progress_regex_string, self.stop_signal, self.task_completed_signal,
+                                  self.progress_termination_signal, watch_mode=self.config.progress_watch_mode,
+                                  start_offset=start_offset, progress=progress,
+                                  metric_extractor=self.metric_extractor, scan_last_match=scan_last_match)
+        return self.__add_watcher(watcher)
+
+    def add_output_stream(self, output_stream, location_tag):
+        """Registers the captured output of the task to track progress messages from, see add_location.
+        The output is consumed by the tracker thread (and copied by output_stream) until the task completes,
+        even when it is not matched, and its pipe is closed once it has been tracked."""
+        logging.info('Adding progress monitoring of captured %s [tag=%s]', output_stream.name, location_tag)
+        watcher = ProgressWatcher(output_stream.name, location_tag, self.counter, self.config.max_bytes_read_per_line,
+                                  self.config.progress_regex_string, self.stop_signal, self.task_completed_signal,
+                                  self.progress_termination_signal, output_stream=output_stream,
+                                  metric_extractor=self.metric_extractor)
+        return self.__add_watcher(watcher)
+
+    def add_channel(self, channel, location_tag):
+        """Registers a progress channel (see cook.channel) to track progress records from, see add_location.
+        The channel is read until the task completes and closed once it has been tracked."""
+        logging.info('Adding progress monitoring of the %s channel %s [tag=%s]', channel.name, channel.path,
+                     location_tag)
+        watcher = ProgressWatcher(channel.path, location_tag, self.counter, self.config.max_bytes_read_per_line,
+                                  self.config.progress_regex_string, self.stop_signal, self.task_completed_signal,
+                                  self.progress_termination_signal, output_stream=channel, structured=True,
+                                  metric_extractor=self.metric_extractor)
+        return self.__add_watcher(watcher)
+
+    def __add_watcher(self, watcher):
+        with self.lock:
+            self.pending_watchers.append(watcher)
+        self.wake()
+        return watcher
 
     def start(self):
-        """Launches a thread that starts monitoring the progress location for progress messages."""
-        logging.info('Starting progress monitoring from [tag=%s]', self.location_tag)
+        """Launches a thread that starts monitoring the progress locations for progress messages."""
+        logging.info('Starting multiplexed progress monitoring')
         tracker_thread = Thread(target=self.track_progress, args=())
         tracker_thread.daemon = True
         tracker_thread.start()
@@ -338,25 +991,112 @@ class ProgressTracker(object):
         """Waits for the progress tracker thread to run to completion."""
         self.progress_complete_event.wait(timeout=timeout)
         if self.progress_complete_event.isSet():
-            logging.info('Progress monitoring complete [tag=%s]', self.location_tag)
+            logging.info('Progress monitoring complete')
         else:
-            logging.info('Progress monitoring did not complete [tag=%s]', self.location_tag)
+            logging.info('Progress monitoring did not complete')
+
+    def wake(self):
+        """Wakes up the tracker thread if it is waiting for new content, e.g. after the task has completed."""
+        self.waiter.wake()
 
     def track_progress(self):
-        """Retrieves and sends progress updates using send_progress_update_fn.
+        """Retrieves and sends progress updates from all the registered locations.
         It sets the progress_complete_event before returning."""
+        active_states = []
         try:
-            for current_progress in self.watcher.retrieve_progress_states():
+            while True:
+                cins.profile_thread('progress')
+                with self.lock:
+                    new_watchers, self.pending_watchers = self.pending_watchers, []
+                for watcher in new_watchers:
+                    if watcher.output_stream is not None:
+                        self.waiter.watch_fd(watcher.output_stream.fileno())
+                    else:
+                        self.waiter.watch(watcher.target_file)
+                    lines = watcher.tail_lines(self.max_fragments_per_poll, candidates_only=not watcher.structured)
+                    progress_states = watcher.progress_states(lines)
+                    active_states.append((watcher, progress_states))
+                    self.watchers.append(watcher)
+
+                made_progress = False
+                for watcher, progress_states in list(active_states):
+                    fragments_read = watcher.fragments_read
+                    if not self.__send_available_progress_updates(watcher, progress_states):
+                        logging.info('Progress monitoring complete [tag=%s]', watcher.location_tag)
+                        active_states.remove((watcher, progress_states))
+                        self.__close_output_stream(watcher)
+                    made_progress = made_progress or watcher.fragments_read != fragments_read
+                if self.metric_extractor:
+                    self.__send_metrics_update()
+                if self.checkpointer:
+                    self.__checkpoint()
+
+                if not active_states and (self.task_completed_signal.isSet() or
+                                          self.stop_signal.isSet() or
+                                          self.progress_termination_signal.isSet()):
+                    with self.lock:
+                        if not self.pending_watchers:
+                            break
+                elif not made_progress:
+                    self.waiter.wait()
+        except Exception:
+            logging.exception('Exception while tracking progress')
+        finally:
+            for watcher, progress_states in active_states:
+                progress_states.close()
+                self.__close_output_stream(watcher)
+            self.waiter.close()
+            cins.profile_thread('progress', exiting=True)
+            self.progress_complete_event.set()
+
+    def __send_metrics_update(self, force_send=False):
+        """Sends the aggregated metrics when they have changed, unless throttled."""
+        try:
+            self.metrics_updater.send_metrics_update(self.metric_extractor.current_metrics(), force_send=force_send)
+        except Exception as exception:
+            if cu.is_out_of_memory_error(exception):
+                self.os_error_handler(exception)
+            else:
+                logging.exception('Exception while sending the metrics')
+
+    def __checkpoint(self):
+        """Writes the checkpoint of the locations, when due, all the lines read so far have been processed."""
+        try:
+            with cins.timer('progress.checkpoint'):
+                self.checkpointer.maybe_write(self.watchers, self.counter)
+        except Exception as exception:
+            if cu.is_out_of_memory_error(exception):
+                self.os_error_handler(exception)
+            else:
+                logging.exception('Exception while checkpointing progress')
+
+    def __close_output_stream(self, watcher):
+        """Stops watching and closes the captured output tracked by watcher, if any."""
+        if watcher.output_stream is not None:
+            logging.info('%s bytes of captured %s processed [tag=%s]', watcher.output_stream.bytes_read,
+                         watcher.output_stream.name, watcher.location_tag)
+            self.waiter.unwatch_fd(watcher.output_stream.fileno())
+            watcher.output_stream.close()
+
+    def __send_available_progress_updates(self, watcher, progress_states):
+        """Sends the progress updates available from a location without blocking.
+        Returns False once the location has been fully processed."""
+        try:
+            for current_progress in progress_states:
+                if current_progress is None:
+                    return True
                 self.updater.send_progress_update(current_progress)
         except Exception as exception:
             if cu.is_out_of_memory_error(exception):
                 self.os_error_handler(exception)
             else:
-                logging.exception('Exception while tracking progress [tag=%s]', self.location_tag)
-        finally:
-            self.progress_complete_event.set()
+                logging.exception('Exception while tracking progress [tag=%s]', watcher.location_tag)
+        return False
 
     def force_send_progress_update(self):
-        """Retrieves the latest progress message and attempts to force send it to the scheduler."""
-        latest_progress = self.watcher.current_progress()
-        self.updater.send_progress_update(latest_progress, force_send=True)
+        """Retrieves the latest progress message from each location and attempts to force send it to the scheduler.
+        The latest metrics, if any, are also force sent."""
+        for watcher in self.watchers:
+            self.updater.send_progress_update(watcher.current_progress(), force_send=True)
+        if self.metric_extractor:
+            self.__send_metrics_update(force_send=True)
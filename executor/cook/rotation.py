@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+"""This module rolls the outputs of the executor, e.g. the sandbox stdout, once they reach a size limit.
+Rolled segments are compressed on a background thread and the oldest segments are removed to cap the total size.
+The newest segment of each output is never compressed or removed.
+"""
+
+import logging
+import os
+import queue
+import re
+from threading import Lock, Thread
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_GZIP = 'gzip'
+COMPRESSION_NONE = 'none'
+COMPRESSION_ZSTD = 'zstd'
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def default_compression():
+    """Returns zstd when the zstandard module is available, gzip otherwise."""
+    return COMPRESSION_ZSTD if zstandard is not None else COMPRESSION_GZIP
+
+
+def compress_segment(segment_path, compression):
+    """Compresses the segment into a sibling file and removes the uncompressed segment.
+
+    Parameters
+    ----------
+    segment_path: string
+        The path of the rolled segment.
+    compression: string
+        One of COMPRESSION_GZIP, COMPRESSION_ZSTD or COMPRESSION_NONE.
+
+    Returns
+    -------
+    the path of the compressed segment, or segment_path when compression is disabled.
+    """
+    if compression == COMPRESSION_GZIP:
+        import gzip
+        import shutil
+        compressed_path = '{}.gz'.format(segment_path)
+        with open(segment_path, 'rb') as segment_file, gzip.open(compressed_path, 'wb', compresslevel=6) as target:
+            shutil.copyfileobj(segment_file, target, COPY_BUFFER_SIZE)
+    elif compression == COMPRESSION_ZSTD:
+        compressed_path = '{}.zst'.format(segment_path)
+        with open(segment_path, 'rb') as segment_file, open(compressed_path, 'wb') as target:
+            zstandard.ZstdCompressor().copy_stream(segment_file, target, read_size=COPY_BUFFER_SIZE)
+    else:
+        return segment_path
+    os.remove(segment_path)
+    return compressed_path
+
+
+def existing_segments(path):
+    """Returns the (index, path) of the segments of the output at path present on disk, ordered by index.
+    The segments may have been rolled by a previous task or executor, compressed or not."""
+    directory = os.path.dirname(path)
+    segment_pattern = re.compile(r'{}\.([0-9]+)(\.gz|\.zst)?$'.format(re.escape(os.path.basename(path))))
+    segments = []
+    try:
+        for name in os.listdir(directory or '.'):
+            segment_match = segment_pattern.match(name)
+            if segment_match:
+                segments.append((int(segment_match.group(1)), os.path.join(directory, name)))
+    except OSError:
+        logging.exception('Unable to list the segments of %s', path)
+    return sorted(segments)
+
+
+class RotatingOutput(object):
+    """A byte buffer that writes to one of the executor's outputs and rolls the file behind it.
+    Rolling renames the file to the next segment name, e.g. stdout.1, and re-opens the file in place of the
+    output's file descriptor, so that writes of the executor and of the captured task output continue in a new file.
+    Segments are numbered after the segments already present on disk, they are never overwritten.
+    Writes must be guarded by the lock of the output, e.g. cook.io_helper.__stdout_lock__."""
+
+    def __init__(self, path, output_fn, rotation, segment_index=0):
+        """
+        Parameters
+        ----------
+        path: string
+            The path of the file the output writes to.
+        output_fn: fn()
+            Returns the text output, e.g. sys.stdout, resolved on every write.
+        rotation: OutputRotation
+            The rotation the rolled segments are handed to.
+        segment_index: int
+            The index of the newest segment already rolled.
+        """
+        self.path = path
+        self.output_fn = output_fn
+        self.rotation = rotation
+        self.enabled = None
+        self.segment_index = segment_index
+
+    def write(self, data):
+        self.output_fn().buffer.write(data)
+
+    def flush(self):
+        """Flushes the output and rolls it once it has reached the roll size."""
+        output = self.output_fn()
+        output.flush()
+        if self.enabled is None:
+            self.enabled = self.__writes_to_path(output)
+        if self.enabled and os.fstat(output.fileno()).st_size >= self.rotation.roll_bytes:
+            self.__roll(output)
+
+    def current_size(self):
+        """Returns the size of the newest segment."""
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def __writes_to_path(self, output):
+        """Returns true if the output writes to path, only then can the output be rolled."""
+        try:
+            if os.path.samestat(os.fstat(output.fileno()), os.stat(self.path)):
+                return True
+        except OSError:
+            pass
+        logging.warning('Output is not written to %s, it will not be rolled', self.path)
+        return False
+
+    def __roll(self, output):
+        self.segment_index += 1
+        segment_path = '{}.{}'.format(self.path, self.segment_index)
+        os.rename(self.path, segment_path)
+        new_fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.dup2(new_fd, output.fileno())
+        finally:
+            os.close(new_fd)
+        logging.info('Rolled %s to %s', self.path, segment_path)
+        self.rotation.add_segment(segment_path)
+
+
+class OutputRotation(object):
+    """Manages the rolled segments of the outputs of the executor's tasks, the tasks share a single rotation.
+    The segments present on disk when an output is registered count towards the cap and are removed first.
+    Segments are compressed in the order they are rolled on a single background thread, after each segment the
+    oldest segments of all outputs are removed until the total size is at most max_total_bytes."""
+
+    def __init__(self, roll_bytes, max_total_bytes, compression):
+        """
+        Parameters
+        ----------
+        roll_bytes: int
+            The size at which an output is rolled.
+        max_total_bytes: int
+            The cap on the total size of the outputs and their segments, disabled when 0.
+            The newest segments are never removed, the cap should allow at least roll_bytes per output.
+        compression: string
+            One of COMPRESSION_GZIP, COMPRESSION_ZSTD or COMPRESSION_NONE.
+        """
+        self.roll_bytes = roll_bytes
+        self.max_total_bytes = max_total_bytes
+        self.compression = compression
+        self.lock = Lock()
+        self.outputs = []
+        self.segments = []
+        self.pending_segments = queue.Queue()
+        self.compressor_thread = None
+        self.removed_bytes = 0
+
+    def rotating_output(self, path, output_fn):
+        """Returns the RotatingOutput for the output writing to path, see RotatingOutput.
+        The output is created when path is first registered, later calls return the same output."""
+        with self.lock:
+            for rotating_output in self.outputs:
+                if rotating_output.path == path:
+                    return rotating_output
+            segments = existing_segments(path)
+            if segments:
+                logging.info('Found %s existing segments of %s', len(segments), path)
+            self.segments.extend(segment_path for _, segment_path in segments)
+            rotating_output = RotatingOutput(path, output_fn, self, segments[-1][0] if segments else 0)
+            self.outputs.append(rotating_output)
+        return rotating_output
+
+    def add_segment(self, segment_path):
+        """Schedules the compression of a rolled segment."""
+        with self.lock:
+            if self.compressor_thread is None:
+                self.compressor_thread = Thread(target=self.__process_segments, name='output-rotation', daemon=True)
+                self.compressor_thread.start()
+        self.pending_segments.put(segment_path)
+
+    def close(self, timeout_secs=None):
+        """Waits, up to timeout_secs, for the pending segments to be processed and stops the background thread."""
+        with self.lock:
+            compressor_thread = self.compressor_thread
+        if compressor_thread is not None:
+            self.pending_segments.put(None)
+            compressor_thread.join(timeout_secs)
+
+    def __process_segments(self):
+        while True:
+            segment_path = self.pending_segments.get()
+            if segment_path is None:
+                return
+            try:
+                compressed_path = compress_segment(segment_path, self.compression)
+                with self.lock:
+                    self.segments.append(compressed_path)
+                self.__enforce_max_total_bytes()
+            except Exception:
+                logging.exception('Error while processing rolled segment %s', segment_path)
+
+    def __enforce_max_total_bytes(self):
+        """Removes the oldest segments until the total size of the outputs is at most max_total_bytes."""
+        if not self.max_total_bytes:
+            return
+        with self.lock:
+            segment_sizes = [(s, os.path.getsize(s)) for s in self.segments]
+            total_bytes = sum(size for _, size in segment_sizes) + sum(o.current_size() for o in self.outputs)
+            while segment_sizes and total_bytes > self.max_total_bytes:
+                segment_path, segment_size = segment_sizes.pop(0)
+                os.remove(segment_path)
+                self.segments.remove(segment_path)
+                self.removed_bytes += segment_size
+                total_bytes -= segment_size
+                logging.info('Removed %s (%s bytes) to cap the outputs at %s bytes',
+                             segment_path, segment_size, self.max_total_bytes)
@@ -0,0 +1,236 @@
+"""This module provides a scanner that splits file content read in large chunks into line fragments."""
+
+import re
+
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+def required_literal(pattern):
+    """Returns the longest literal that every match of the compiled pattern contains, or None.
+    Only literals at the top level of the pattern are considered, e.g. b'progress: ' for 'progress: ([0-9]+)'.
+
+    Parameters
+    ----------
+    pattern: re.Pattern
+        The compiled bytes pattern.
+
+    Returns
+    -------
+    the required literal as bytes, or None when the pattern has no such literal or ignores case.
+    """
+    if pattern.flags & re.IGNORECASE:
+        return None
+    try:
+        parsed_pattern = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return None
+    longest_literal = b''
+    current_literal = bytearray()
+    for op_code, argument in list(parsed_pattern) + [(None, None)]:
+        # fragments end with a newline, a literal spanning a newline cannot be found in a single fragment
+        if op_code == sre_parse.LITERAL and argument != ord('\n'):
+            current_literal.append(argument)
+        else:
+            if len(current_literal) > len(longest_literal):
+                longest_literal = bytes(current_literal)
+            current_literal = bytearray()
+    return longest_literal or None
+
+
+class LineScanner(object):
+    """Splits the content of a file, read in large chunks, into line fragments.
+    The fragments are the ones produced by repeatedly calling readline(max_bytes_per_line) on the file:
+    lines longer than max_bytes_per_line are split into multiple fragments, and a trailing partial line is
+    produced once no more content is available in the file.
+    Only the fragments accepted by the candidate filter are returned, every fragment is counted.
+    When a candidate literal is provided, only the lines containing it are split and filtered, the regions
+    in between are skipped using a substring search over the whole chunk.
+    """
+
+    def __init__(self, file_obj, max_bytes_per_line, candidate_filter=None, candidate_literal=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Parameters
+        ----------
+        file_obj: file
+            The binary file object to read from, its read may return None when no content is available yet.
+        max_bytes_per_line: int
+            The maximum size of a fragment.
+        candidate_filter: fn(fragment)
+            Returns a truthy value for the fragments that should be returned, all fragments are returned when None.
+        candidate_literal: bytes
+            A literal that every fragment accepted by the candidate filter contains, see required_literal.
+        chunk_size: int
+            The number of bytes requested from the file in a single read.
+        """
+        self.file_obj = file_obj
+        self.max_bytes_per_line = max_bytes_per_line
+        self.candidate_filter = candidate_filter
+        self.candidate_literal = candidate_literal
+        self.chunk_size = chunk_size
+        # a fragment is either a line (including its newline) of at most max_bytes_per_line bytes,
+        # or the next max_bytes_per_line bytes of a longer line
+        self.fragment_pattern = re.compile('[^\\n]{{0,{}}}\\n|[^\\n]{{1,{}}}'.format(max_bytes_per_line - 1,
+                                                                                max_bytes_per_line).encode())
+        self.partial_line = b''
+        self.bytes_read = 0
+        self.fragments_read = 0
+        self.lines_read = 0
+
+    def scan(self):
+        """Reads the next chunk from the file and splits it into fragments.
+
+        Returns
+        -------
+        the list of candidate fragments completed by the chunk, or None when no more content is available.
+        """
+        chunk = self.file_obj.read(self.chunk_size)
+        if chunk is None:
+            # a non-blocking source without available content, its partial line may still be completed
+            return None
+        self.bytes_read += len(chunk)
+        if not chunk:
+            if not self.partial_line:
+                return None
+            # readline would have returned the partial line once it reached the end of the file
+            partial_line, self.partial_line = self.partial_line, b''
+            return self.__collect(partial_line, len(partial_line))
+        data = self.partial_line + chunk if self.partial_line else chunk
+        if self.candidate_literal is not None:
+            candidates = self.__scan_literal_candidates(data)
+            if candidates is not None:
+                return candidates
+        if b'\r' not in data:
+            # without carriage returns splitlines splits on newlines only, keeping them, with one allocation per line
+            lines = data.splitlines(True)
+            partial_line = lines.pop() if not lines[-1].endswith(b'\n') else b''
+            if len(partial_line) < self.max_bytes_per_line and \
+                    max(map(len, lines), default=0) <= self.max_bytes_per_line:
+                self.lines_read += len(lines)
+                self.partial_line = partial_line
+                return self.__filter(lines)
+        lines_end = data.rfind(b'\n') + 1
+        remainder = len(data) - lines_end
+        # readline returns full fragments of a long line even before its newline is available
+        fragments_end = lines_end + remainder - remainder % self.max_bytes_per_line
+        self.lines_read += data.count(b'\n', 0, lines_end)
+        self.partial_line = data[fragments_end:]
+        return self.__collect(data, fragments_end)
+
+    def __scan_literal_candidates(self, data):
+        """Returns the candidate fragments of the lines in data containing the candidate literal.
+        Returns None, without consuming data, when data may contain lines longer than max_bytes_per_line: the
+        fragments of the skipped regions are counted using the number of newlines, which requires short lines."""
+        lines_end = data.rfind(b'\n') + 1
+        if len(data) - lines_end >= self.max_bytes_per_line or self.__may_contain_long_line(data, lines_end):
+            return None
+        candidate_literal = self.candidate_literal
+        candidate_filter = self.candidate_filter
+        fragments = []
+        literal_index = data.find(candidate_literal, 0, lines_end)
+        while literal_index >= 0:
+            line_start = data.rfind(b'\n', 0, literal_index) + 1
+            line_end = data.find(b'\n', literal_index, lines_end) + 1
+            fragment = data[line_start:line_end]
+            if candidate_filter is None or candidate_filter(fragment):
+                fragments.append(fragment)
+            literal_index = data.find(candidate_literal, line_end, lines_end)
+        num_lines = data.count(b'\n', 0, lines_end)
+        self.lines_read += num_lines
+        self.fragments_read += num_lines
+        self.partial_line = data[lines_end:]
+        return fragments
+
+    def __may_contain_long_line(self, data, end):
+        """Returns true if data[:end] may contain a line that does not fit in a single fragment.
+        Such a line contains an aligned window, half a fragment wide, without newlines; lines slightly shorter
+        than a fragment can also be reported."""
+        window_size = max(self.max_bytes_per_line // 2, 1)
+        find_newline = data.find
+        for window_start in range(0, end - window_size + 1, window_size):
+            if find_newline(b'\n', window_start, window_start + window_size) < 0:
+                return True
+        return False
+
+    def __collect(self, data, end):
+        """Returns the candidate fragments in data[:end], long lines are split into multiple fragments."""
+        return self.__filter(self.fragment_pattern.findall(data, 0, end))
+
+    def __filter(self, fragments):
+        """Counts the fragments and returns the ones accepted by the candidate filter."""
+        self.fragments_read += len(fragments)
+        if self.candidate_filter is None:
+            return fragments
+        return list(filter(self.candidate_filter, fragments))
+
+
+class ReverseLineScanner(object):
+    """Generates the complete lines of a file from the last one to the first one, reading the file backwards in
+    large chunks, so that finding a line near the end of a large file does not read the rest of the file.
+    The content after the last newline, e.g. a line that is still being written, is not generated and neither are the
+    lines that do not fit in a single fragment of max_bytes_per_line bytes.
+    """
+
+    def __init__(self, file_obj, end_offset, max_bytes_per_line, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Parameters
+        ----------
+        file_obj: file
+            The seekable binary file object to read from.
+        end_offset: int
+            The offset the file is read backwards from, e.g. its size.
+        max_bytes_per_line: int
+            The maximum size of a generated line, including its newline.
+        chunk_size: int
+            The number of bytes requested from the file in a single read.
+        """
+        self.file_obj = file_obj
+        self.end_offset = end_offset
+        self.max_bytes_per_line = max_bytes_per_line
+        self.chunk_size = chunk_size
+        # the offset right after the last newline before end_offset, known once the first line is generated
+        self.lines_end = None
+        self.bytes_read = 0
+
+    def lines(self):
+        """Generates the complete lines, including their newline, from the last one to the first one."""
+        position = self.end_offset
+        # the end of the line preceding the lines generated so far, whose start has not been read yet
+        line_end = b''
+        # set while skipping the content of a partial or long line until the newline preceding it is found
+        skipping = True
+        while position > 0:
+            read_size = min(self.chunk_size, position)
+            position -= read_size
+            self.file_obj.seek(position)
+            chunk = self.file_obj.read(read_size)
+            if not chunk:
+                # the file was truncated
+                break
+            self.bytes_read += len(chunk)
+            if skipping:
+                newline_index = chunk.rfind(b'\n')
+                if newline_index < 0:
+                    continue
+                if self.lines_end is None:
+                    self.lines_end = position + newline_index + 1
+                skipping = False
+                data = chunk[:newline_index + 1]
+            else:
+                data = chunk + line_end
+            # data ends with a newline, its first line is only known to be complete at the start of the file
+            lines_start = 0 if position == 0 else data.find(b'\n') + 1
+            line_end = data[:lines_start]
+            for line in reversed(data[lines_start:].split(b'\n')[:-1]):
+                if len(line) < self.max_bytes_per_line:
+                    yield line + b'\n'
+            if len(line_end) > self.max_bytes_per_line:
+                line_end = b''
+                skipping = True
+        if self.lines_end is None:
+            self.lines_end = 0
@@ -1,18 +1,21 @@
 """This module provides helper functions for subprocess management."""
 
+import asyncio
+import collections
 import logging
 import signal
 import subprocess
 import sys
 
 import os
-import psutil
 
 import cook
+import cook.instrumentation as cins
 import cook.io_helper as cio
+import cook.loop as cl
 
 
-def launch_process(command, environment):
+def launch_process(command, environment, capture_output=False, cgroup=None):
     """Launches the process using the command and specified environment.
 
     Parameters
@@ -21,6 +24,11 @@ def launch_process(command, environment):
         The command to execute.
     environment: dictionary
         The environment.
+    capture_output: boolean
+        When true, the stdout and stderr of the process are pipes that the caller must read from,
+        else the process writes directly to the executor's stdout and stderr.
+    cgroup: cook.cgroup.TaskCgroup
+        When provided, the process and its descendants run in the cgroup.
 
     Returns
     -------
@@ -29,15 +37,49 @@ def launch_process(command, environment):
     if not command:
         logging.warning('No command provided!')
         return None
-    # The preexec_fn is run after the fork() but before exec() to run the shell.
-    # setsid will run the program in a new session, thus assigning a new process group to it and its children.
-    return subprocess.Popen(command,
-                            bufsize=0,
-                            env=environment,
-                            preexec_fn=os.setsid,
-                            shell=True,
-                            stderr=sys.stderr,
-                            stdout=sys.stdout)
+
+    def prepare_process():
+        # The preexec_fn is run after the fork() but before exec() to run the shell.
+        # setsid will run the program in a new session, thus assigning a new process group to it and its children.
+        os.setsid()
+        if cgroup:
+            try:
+                cgroup.add_current_process()
+            except OSError:
+                # the process stays in the executor's cgroup, signals fall back to the process tree
+                pass
+
+    process = subprocess.Popen(command,
+                               bufsize=0,
+                               env=environment,
+                               preexec_fn=prepare_process,
+                               shell=True,
+                               stderr=subprocess.PIPE if capture_output else sys.stderr,
+                               stdout=subprocess.PIPE if capture_output else sys.stdout)
+    if cgroup and process.pid not in cgroup.process_ids():
+        logging.info('Process (pid: {}) is not running in cgroup {}'.format(process.pid, cgroup.path))
+    return process
+
+
+def open_pidfd(process):
+    """Opens a pidfd, a file descriptor that becomes readable once the process exits (Linux 5.3+).
+
+    Parameters
+    ----------
+    process: subprocess.Popen
+        The process to open a pidfd for.
+
+    Returns
+    -------
+    the pidfd, or None when pidfds are not supported or the process has already been reaped.
+    """
+    if not hasattr(os, 'pidfd_open') or process.returncode is not None:
+        return None
+    try:
+        return os.pidfd_open(process.pid)
+    except OSError as error:
+        logging.info('Unable to open pidfd for process (pid: {}): {}'.format(process.pid, error))
+        return None
 
 
 def is_process_running(process):
@@ -99,8 +141,91 @@ def _send_signal_to_process(process_id, signal_to_send):
     return False
 
 
+def read_parent_process_ids():
+    """Returns the map from process id to parent process id of all processes.
+    On Linux the map is built from a single scan of /proc/*/stat, elsewhere psutil is used."""
+    parent_process_ids = {}
+    if not os.path.isdir('/proc'):
+        # imported lazily, psutil adds about 10 ms to the executor's startup
+        import psutil
+        for process in psutil.process_iter():
+            try:
+                parent_process_ids[process.pid] = process.ppid()
+            except psutil.NoSuchProcess:
+                pass
+        return parent_process_ids
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(entry), 'rb') as stat_file:
+                stat = stat_file.read()
+        except OSError:
+            # the process exited during the scan
+            continue
+        # the command name may contain spaces and parentheses, the fields after it are separated by spaces
+        fields = stat[stat.rfind(b')') + 2:].split(b' ', 2)
+        parent_process_ids[int(entry)] = int(fields[1])
+    return parent_process_ids
+
+
+def find_process_tree(root_process_id, parent_process_ids):
+    """Returns the ids of the processes in the tree rooted at root_process_id, in breadth-first order.
+
+    Parameters
+    ----------
+    root_process_id: int
+        The id of the root process.
+    parent_process_ids: dictionary
+        The map from process id to parent process id, see read_parent_process_ids.
+
+    Returns
+    -------
+    the list of process ids, empty when the root process does not exist.
+    """
+    if root_process_id not in parent_process_ids:
+        return []
+    children = collections.defaultdict(list)
+    for process_id, parent_process_id in parent_process_ids.items():
+        children[parent_process_id].append(process_id)
+    tree_process_ids = []
+    visited_process_ids = {root_process_id}
+    process_queue = collections.deque([root_process_id])
+    while process_queue:
+        loop_process_id = process_queue.popleft()
+        tree_process_ids.append(loop_process_id)
+        for child_process_id in children.get(loop_process_id, []):
+            if child_process_id not in visited_process_ids:
+                visited_process_ids.add(child_process_id)
+                process_queue.append(child_process_id)
+    return tree_process_ids
+
+
+def _send_signal_to_processes(process_ids, signal_to_send):
+    """Sends the signal_to_send signal to each of the processes, without logging every process.
+
+    Returns
+    -------
+    the number of processes the signal was sent to.
+    """
+    num_processes_signalled = 0
+    for process_id in process_ids:
+        try:
+            os.kill(process_id, signal_to_send)
+            num_processes_signalled += 1
+        except ProcessLookupError:
+            pass
+        except Exception:
+            logging.exception('Error in sending {} to process (id: {})'.format(signal_to_send.name, process_id))
+    return num_processes_signalled
+
+
+@cins.timed('subprocess.signal-process-tree')
 def _send_signal_to_process_tree(root_process_id, signal_to_send):
     """Send the signal_to_send signal to the process tree rooted at process_id.
+    The tree is found using a single scan of the processes, all its processes are stopped to keep them from forking
+    since a forked child might get re-parented. Children forked before their parent was stopped are found by
+    scanning again until no new process is found, the signal is then sent to the whole tree at once.
     Parameters
     ----------
     process_id: int
@@ -114,45 +239,31 @@ def _send_signal_to_process_tree(root_process_id, signal_to_send):
     signal_name = signal_to_send.name
     logging.info('Sending {} to process tree rooted at (id: {})'.format(signal_name, root_process_id))
 
-    process_queue = [root_process_id]
-    visited_process_ids = set()
+    tree_process_ids = []
+    known_process_ids = set()
+    new_process_ids = find_process_tree(root_process_id, read_parent_process_ids())
+    num_scans = 1
+    while new_process_ids:
+        _send_signal_to_processes(new_process_ids, signal.SIGSTOP)
+        tree_process_ids.extend(new_process_ids)
+        known_process_ids.update(new_process_ids)
+        new_process_ids = [process_id
+                           for process_id in find_process_tree(root_process_id, read_parent_process_ids())
+                           if process_id not in known_process_ids]
+        num_scans += 1
 
-    num_processes_found = 0
-    num_processes_killed = 0
-    signal_sent_to_all_processes_successfully = True
+    if not tree_process_ids:
+        logging.info('Unable to send {} as could not find process (id: {})'.format(signal_name, root_process_id))
+    num_processes_killed = _send_signal_to_processes(tree_process_ids, signal_to_send)
 
-    while process_queue:
-        loop_process_id = process_queue.pop(0)
-        num_processes_found += 1
-        try:
-            visited_process_ids.add(loop_process_id)
-
-            # Stop the process to keep it from forking since a forked child might get re-parented
-            _send_signal_to_process(loop_process_id, signal.SIGSTOP)
-
-            # Now safe to retrieve the children
-            process = psutil.Process(loop_process_id)
-            children = process.children()
-            [process_queue.append(child.pid) for child in children if child.pid not in visited_process_ids]
-
-            if _send_signal_to_process(loop_process_id, signal_to_send):
-                num_processes_killed += 1
-            else:
-                signal_sent_to_all_processes_successfully = False
-        except psutil.NoSuchProcess:
-            logging.info('Unable to send {} as could not find process (id: {})'.format(signal_name, loop_process_id))
-        except Exception:
-            logging.exception('Error in sending {} to process (id: {})'.format(signal_name, loop_process_id))
-            signal_sent_to_all_processes_successfully = False
-
-    log_message = 'Found {} process(es) in tree rooted at (id: {}), successfully sent {} to {} process(es)'
-    logging.info(log_message.format(num_processes_found, root_process_id, signal_name, num_processes_killed))
+    log_message = 'Found {} process(es) in tree rooted at (id: {}) in {} scan(s), successfully sent {} to {} process(es)'
+    logging.info(log_message.format(len(tree_process_ids), root_process_id, num_scans, signal_name,
+                                    num_processes_killed))
 
-    for loop_process_id in visited_process_ids:
-        # Try and continue the processes in case the signal is non-terminating but doesn't continue the process.
-        _send_signal_to_process(loop_process_id, signal.SIGCONT)
+    # Try and continue the processes in case the signal is non-terminating but doesn't continue the process.
+    _send_signal_to_processes(tree_process_ids, signal.SIGCONT)
 
-    return signal_sent_to_all_processes_successfully
+    return num_processes_killed == len(tree_process_ids)
 
 
 def _send_signal_to_process_group(process_id, signal_to_send):
@@ -181,16 +292,19 @@ def _send_signal_to_process_group(process_id, signal_to_send):
     return False
 
 
-def send_signal(process_id, signal_to_send):
+def send_signal(process_id, signal_to_send, cgroup=None):
     """Send the signal_to_send signal to the process with process_id.
-    The function uses a three-step mechanism:
+    When the process runs in a cgroup, the signal is sent to every process of the cgroup at once, see
+    cook.cgroup.TaskCgroup.send_signal. Else, or if that fails, the function uses a three-step mechanism:
     1. It sends the signal to the process tree rooted at process_id;
     2. If unsuccessful, it sends the signal to the process group of process_id;
     3. If unsuccessful, it sends the signal directly to the process with id process_id."""
     if process_id:
         signal_name = signal_to_send.name
         logging.info('Requested to send {} to process (id: {})'.format(signal_name, process_id))
-        if _send_signal_to_process_tree(process_id, signal_to_send):
+        if cgroup and cgroup.send_signal(signal_to_send):
+            logging.info('Successfully sent {} to cgroup of process (id: {})'.format(signal_name, process_id))
+        elif _send_signal_to_process_tree(process_id, signal_to_send):
             logging.info('Successfully sent {} to process tree (id: {})'.format(signal_name, process_id))
         elif _send_signal_to_process_group(process_id, signal_to_send):
             logging.info('Successfully sent {} to group for process (id: {})'.format(signal_name, process_id))
@@ -200,11 +314,54 @@ def send_signal(process_id, signal_to_send):
             logging.info('Failed to send {} to process (id: {})'.format(signal_name, process_id))
 
 
-def kill_process(process, shutdown_grace_period_ms):
-    """Attempts to kill a process.
+def kill_process(process, shutdown_grace_period_ms, cgroup=None):
+    """Attempts to kill a process on the executor loop, blocking the calling thread, see terminate_process.
+
+    Returns
+    -------
+    True if the process completed execution or was killed.
+    """
+    if not is_process_running(process):
+        return True
+
+    async def kill():
+        process_exit = asyncio.ensure_future(await_process_exit(process))
+        return await terminate_process(process, shutdown_grace_period_ms, process_exit, cgroup)
+
+    return cl.get_executor_loop().run(kill())
+
+
+async def await_process_exit(process):
+    """Waits, on the running loop, for the process to exit.
+    On Linux 5.3+ the loop watches a pidfd of the process, so no thread is blocked and the exit is noticed as
+    soon as it happens. Else the blocking wait for the process runs on the default thread pool of the loop.
+
+    Returns
+    -------
+    the exit code of the process.
+    """
+    loop = asyncio.get_event_loop()
+    pidfd = open_pidfd(process)
+    if pidfd is None:
+        return await loop.run_in_executor(None, process.wait)
+    exited = loop.create_future()
+    loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(True))
+    try:
+        await exited
+    finally:
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+    # the process has exited, reaping it does not block
+    return process.wait()
+
+
+async def terminate_process(process, shutdown_grace_period_ms, process_exit, cgroup=None):
+    """Attempts to kill a process from the running loop.
      First attempt is made by sending the process a SIGTERM.
      If the process does not terminate inside (shutdown_grace_period_ms - 100) ms, it is then sent a SIGKILL.
      The 100 ms grace period is allocated for the executor to perform its other cleanup actions.
+     The grace period after the SIGTERM is awaited on the loop instead of blocking a thread, the signals are sent on
+     the default thread pool of the loop as scanning /proc or freezing the cgroup would stall the other tasks.
 
     Parameters
     ----------
@@ -212,31 +369,36 @@ def kill_process(process, shutdown_grace_period_ms):
         The process to kill
     shutdown_grace_period_ms: int
         Grace period before forceful kill
+    process_exit: asyncio.Future
+        Completes once the process has exited, see await_process_exit.
+    cgroup: cook.cgroup.TaskCgroup
+        The cgroup the process runs in, if any.
 
     Returns
     -------
     True if the process completed execution or was killed.
     """
+    loop = asyncio.get_event_loop()
     shutdown_grace_period_ms = max(shutdown_grace_period_ms - (1000 * cook.TERMINATE_GRACE_SECS), 0)
-    if is_process_running(process):
+    if not process_exit.done():
         logging.info('Waiting up to {} ms for process to terminate'.format(shutdown_grace_period_ms))
 
-        send_signal(process.pid, signal.SIGTERM)
+        await loop.run_in_executor(None, send_signal, process.pid, signal.SIGTERM, cgroup)
         shutdown_grace_period_secs = shutdown_grace_period_ms / 1000.0
         try:
-            process.wait(shutdown_grace_period_secs)
+            await asyncio.wait_for(asyncio.shield(process_exit), shutdown_grace_period_secs)
             cio.print_and_log('Command terminated with signal Terminated (pid: {})'.format(process.pid))
-        except subprocess.TimeoutExpired:
+        except asyncio.TimeoutError:
             logging.info('Process did not terminate via SIGTERM after {} seconds'.format(shutdown_grace_period_secs))
         except Exception:
             logging.exception('Error while sending SIGTERM to (pid: {})'.format(process.pid))
 
-        if is_process_running(process):
-            send_signal(process.pid, signal.SIGKILL)
+        if not process_exit.done():
+            await loop.run_in_executor(None, send_signal, process.pid, signal.SIGKILL, cgroup)
             try:
-                process.wait() # wait indefinitely for process to die/complete, it cannot ignore SIGKILL
+                await process_exit  # wait indefinitely for process to die/complete, it cannot ignore SIGKILL
                 cio.print_and_log('Command terminated with signal Killed (pid: {})'.format(process.pid))
             except Exception:
                 logging.exception('Error while sending SIGKILL to (pid: {})'.format(process.pid))
 
-    return not is_process_running(process)
+    return process_exit.done()
@@ -0,0 +1,178 @@
+"""This module samples the resource usage of the task's process tree.
+
+Overhead: a sample finds the task's processes with one scan of /proc, or one read of cgroup.procs when the task runs
+in a cgroup, and then reads /proc/<pid>/stat and /proc/<pid>/io of at most max_processes of them. A sample costs in
+the order of 50 microseconds per process, i.e. about 5 ms for a tree of 100 processes and at most about 50 ms for
+DEFAULT_MAX_PROCESSES. Samples are at least MIN_INTERVAL_SECS apart and run on a thread of the executor loop's pool,
+which bounds the sampler to 0.5% of a CPU.
+When the task runs in a cgroup v2, its cpu.stat, memory.peak and io.stat are used instead, as they also account for
+processes that exited between samples.
+"""
+
+import logging
+import os
+import time
+from threading import Lock
+
+import cook.subprocess as cs
+
+DEFAULT_MAX_PROCESSES = 1024
+MIN_INTERVAL_SECS = 10
+
+_clock_ticks_per_sec = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+_page_size_bytes = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def read_process_usage(process_id):
+    """Reads the cpu time, resident memory and storage io of a process from /proc.
+
+    Returns
+    -------
+    the tuple (cpu_secs, rss_bytes, read_bytes, write_bytes), or None when the process has exited.
+    """
+    try:
+        with open('/proc/{}/stat'.format(process_id), 'rb') as stat_file:
+            stat = stat_file.read()
+    except OSError:
+        return None
+    # the fields after the command name start at the state, the third field of stat
+    fields = stat[stat.rfind(b')') + 2:].split()
+    cpu_secs = (int(fields[11]) + int(fields[12])) / _clock_ticks_per_sec
+    rss_bytes = int(fields[21]) * _page_size_bytes
+    read_bytes, write_bytes = 0, 0
+    try:
+        with open('/proc/{}/io'.format(process_id), 'rb') as io_file:
+            for line in io_file:
+                if line.startswith(b'read_bytes:'):
+                    read_bytes = int(line[11:])
+                elif line.startswith(b'write_bytes:'):
+                    write_bytes = int(line[12:])
+    except OSError:
+        # io accounting is not available or not permitted
+        pass
+    return cpu_secs, rss_bytes, read_bytes, write_bytes
+
+
+def _read_cgroup_file(cgroup, file_name):
+    """Returns the content of a file of the cgroup, or None when the file is not available, e.g. its controller is
+    not enabled."""
+    try:
+        with open(os.path.join(cgroup.path, file_name)) as cgroup_file:
+            return cgroup_file.read()
+    except OSError:
+        return None
+
+
+class ResourceSampler(object):
+    """Samples the resource usage of a task's process tree and keeps rolling aggregates of it:
+    the peak resident memory, the cpu seconds, the storage bytes read and written, and the number of processes.
+    The cpu and io of a process that exits are kept as last sampled, see the module documentation for the overhead."""
+
+    def __init__(self, process_id, cgroup=None, max_processes=DEFAULT_MAX_PROCESSES):
+        """
+        Parameters
+        ----------
+        process_id: int
+            The id of the root process of the task.
+        cgroup: cook.cgroup.TaskCgroup
+            The cgroup the task runs in, if any.
+        max_processes: int
+            The maximum number of processes read per sample, the remaining processes are only counted.
+        """
+        self.process_id = process_id
+        self.cgroup = cgroup
+        self.max_processes = max_processes
+        self.lock = Lock()
+        self.exited_usage = [0.0, 0, 0]
+        self.process_usage = {}
+        self.cpu_secs = 0.0
+        self.num_processes = 0
+        self.peak_num_processes = 0
+        self.peak_rss_bytes = 0
+        self.read_bytes = 0
+        self.rss_bytes = 0
+        self.write_bytes = 0
+        self.num_samples = 0
+        self.sample_cpu_secs = 0.0
+
+    def __find_process_ids(self):
+        if self.cgroup and self.cgroup.is_populated():
+            return self.cgroup.process_ids()
+        return cs.find_process_tree(self.process_id, cs.read_parent_process_ids())
+
+    def __sample_processes(self, process_ids):
+        process_usage = {}
+        rss_bytes = 0
+        for process_id in process_ids[:self.max_processes]:
+            usage = read_process_usage(process_id)
+            if usage is not None:
+                cpu_secs, process_rss_bytes, read_bytes, write_bytes = usage
+                process_usage[process_id] = (cpu_secs, read_bytes, write_bytes)
+                rss_bytes += process_rss_bytes
+        running_process_ids = set(process_ids)
+        for process_id, usage in self.process_usage.items():
+            if process_id in process_usage:
+                continue
+            if process_id in running_process_ids:
+                # the process was not sampled as the process tree is truncated, its last usage is kept
+                process_usage[process_id] = usage
+            else:
+                self.exited_usage = [total + value for total, value in zip(self.exited_usage, usage)]
+        self.process_usage = process_usage
+        totals = [sum(values) for values in zip(self.exited_usage, *process_usage.values())]
+        self.cpu_secs = max(self.cpu_secs, totals[0])
+        self.read_bytes = max(self.read_bytes, totals[1])
+        self.write_bytes = max(self.write_bytes, totals[2])
+        self.rss_bytes = rss_bytes
+        self.peak_rss_bytes = max(self.peak_rss_bytes, rss_bytes)
+
+    def __sample_cgroup(self):
+        cpu_stat = _read_cgroup_file(self.cgroup, 'cpu.stat')
+        if cpu_stat:
+            usage_usec = dict(line.split() for line in cpu_stat.splitlines()).get('usage_usec')
+            if usage_usec is not None:
+                self.cpu_secs = max(self.cpu_secs, int(usage_usec) / 1000000.0)
+        memory_current = _read_cgroup_file(self.cgroup, 'memory.current')
+        if memory_current:
+            self.rss_bytes = int(memory_current)
+        memory_peak = _read_cgroup_file(self.cgroup, 'memory.peak')
+        if memory_peak:
+            self.peak_rss_bytes = max(self.peak_rss_bytes, int(memory_peak))
+        io_stat = _read_cgroup_file(self.cgroup, 'io.stat')
+        if io_stat:
+            # one line per device, e.g. 8:0 rbytes=1024 wbytes=0 rios=1 wios=0 dbytes=0 dios=0
+            device_stats = [dict(f.split('=') for f in line.split()[1:]) for line in io_stat.splitlines()]
+            self.read_bytes = max(self.read_bytes, sum(int(s.get('rbytes', 0)) for s in device_stats))
+            self.write_bytes = max(self.write_bytes, sum(int(s.get('wbytes', 0)) for s in device_stats))
+
+    def sample(self):
+        """Samples the process tree and updates the aggregates.
+
+        Returns
+        -------
+        the aggregates, see summary.
+        """
+        with self.lock:
+            start_cpu_secs = time.thread_time()
+            try:
+                process_ids = self.__find_process_ids()
+                self.num_processes = len(process_ids)
+                self.peak_num_processes = max(self.peak_num_processes, self.num_processes)
+                self.__sample_processes(process_ids)
+                if self.cgroup:
+                    self.__sample_cgroup()
+            except Exception:
+                logging.exception('Error in sampling the resource usage of process (pid: {})'.format(self.process_id))
+            self.num_samples += 1
+            self.sample_cpu_secs += time.thread_time() - start_cpu_secs
+            return self.summary()
+
+    def summary(self):
+        """Returns the aggregates as a dictionary that can be sent in a framework message."""
+        return {'cpu-secs': round(self.cpu_secs, 3),
+                'num-processes': self.num_processes,
+                'peak-num-processes': self.peak_num_processes,
+                'peak-rss-bytes': self.peak_rss_bytes,
+                'read-bytes': self.read_bytes,
+                'rss-bytes': self.rss_bytes,
+                'write-bytes': self.write_bytes}
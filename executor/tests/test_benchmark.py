@@ -0,0 +1,429 @@
+import json
+import logging
+import os
+import shlex
+import subprocess
+import sys
+import time
+import unittest
+from threading import Event, Thread
+from unittest.mock import patch
+
+import psutil
+import pymesos as pm
+
+import cook.executor as ce
+import cook.instrumentation as cins
+import cook.io_helper as cio
+import cook.progress as cp
+import tests.utils as tu
+
+# The number of lines written to the files parsed by the benchmarks, can be increased for more stable results
+BENCHMARK_LINES = int(os.environ.get('EXECUTOR_BENCHMARK_LINES', 200000))
+
+PROGRESS_REGEX_STRING = 'progress: ([0-9]*\.?[0-9]+), (.*)'
+
+# The seconds each progress scenario writes output for, and the file the results of the scenarios are saved to.
+# The results of the previous run found in the file are compared to the new results before the file is replaced.
+BENCHMARK_DURATION_SECS = float(os.environ.get('EXECUTOR_BENCHMARK_DURATION_SECS', 1))
+BENCHMARK_RESULTS_FILE = os.environ.get('EXECUTOR_BENCHMARK_RESULTS_FILE', 'build/benchmark-progress-results.json')
+
+# (output bytes per second, bytes per line, lines per progress line, capture output)
+PROGRESS_SCENARIOS = [(10 * 1024, 100, 10, False),
+                      (1024 * 1024, 100, 100, False),
+                      (1024 * 1024, 1024, 1, False),
+                      (50 * 1024 * 1024, 100, 1000, False),
+                      (50 * 1024 * 1024, 100, 1000, True),
+                      (50 * 1024 * 1024, 16 * 1024, 10, False),
+                      (500 * 1024 * 1024, 1024, 10000, False),
+                      (500 * 1024 * 1024, 1024, 10000, True)]
+
+# Writes lines of output at a given rate for a given duration, the message of each progress line is the time it was
+# written at. Arguments: bytes per second, duration secs, bytes per line, lines per progress line.
+RATE_LIMITED_OUTPUT_SCRIPT = '''
+import sys, time
+rate, duration_secs, line_length, progress_every = float(sys.argv[1]), float(sys.argv[2]), int(sys.argv[3]), \\
+    int(sys.argv[4])
+filler_line = b'x' * (line_length - 1) + b'\\n'
+output = sys.stdout.buffer
+start_time = time.time()
+bytes_written, line_index, num_progress_lines = 0, 0, 0
+while time.time() - start_time < duration_secs:
+    num_lines = min(int((rate * (time.time() - start_time) - bytes_written) // line_length), 65536)
+    if num_lines <= 0:
+        time.sleep(0.001)
+        continue
+    parts = []
+    end_index = line_index + num_lines
+    while line_index < end_index:
+        next_progress_index = -(-line_index // progress_every) * progress_every
+        num_filler_lines = min(next_progress_index, end_index) - line_index
+        parts.append(filler_line * num_filler_lines)
+        line_index += num_filler_lines
+        if line_index < end_index:
+            num_progress_lines += 1
+            parts.append(b'progress: %d, %.6f\\n' % (num_progress_lines % 100, time.time()))
+            line_index += 1
+    chunk = b''.join(parts)
+    output.write(chunk)
+    output.flush()
+    bytes_written += len(chunk)
+'''
+
+# The target latency from the exec of the executor to its TASK_RUNNING update, the best of STARTUP_RUNS runs is checked
+STARTUP_TARGET_SECS = float(os.environ.get('EXECUTOR_STARTUP_TARGET_SECS', 0.5))
+STARTUP_RUNS = 3
+
+# The modules only used to kill, recover or troubleshoot a task, they must not be loaded before the task runs
+LAZY_MODULES = ['cProfile', 'faulthandler', 'gzip', 'psutil', 'tracemalloc']
+
+# Runs the executor's main with a driver that registers and launches a task as soon as it is started,
+# prints the time at which the executor was registered and at which it sent TASK_RUNNING
+STARTUP_SCRIPT = '''
+import json, sys, threading, time
+import cook.__main__ as cm
+
+timestamps = {}
+task = {'task_id': {'value': 'startup-task'},
+        'data': cm.pm.encode_data(json.dumps({'command': 'exit 0'}).encode('utf8'))}
+
+class StartupDriver(object):
+    def __init__(self, executor):
+        self.executor = executor
+
+    def start(self):
+        def register_and_launch():
+            timestamps['registered'] = time.time()
+            self.executor.registered(self, {'executor_id': {'value': 'executor'}}, {'id': 'framework'},
+                                     {'id': {'value': 'agent'}})
+            self.executor.launchTask(self, task)
+        threading.Thread(target=register_and_launch).start()
+
+    def sendStatusUpdate(self, status):
+        if status['state'] == 'TASK_RUNNING':
+            timestamps['running'] = time.time()
+            timestamps['lazy-modules-loaded'] = [m for m in sys.argv[2:] if m in sys.modules]
+
+    def sendFrameworkMessage(self, message):
+        pass
+
+    def stop(self):
+        self.executor.disconnect_signal.set()
+
+cm.pm.MesosExecutorDriver = StartupDriver
+try:
+    cm.main()
+except SystemExit:
+    pass
+with open(sys.argv[1], 'w') as timestamps_file:
+    json.dump(timestamps, timestamps_file)
+'''
+
+
+def write_chatty_output(file_name, num_lines, progress_every=1000):
+    """Writes num_lines lines of task output to file_name, one in every progress_every lines is a progress message."""
+    with open(file_name, 'w') as file:
+        for line_index in range(num_lines):
+            if line_index % progress_every == 0:
+                file.write('progress: {}, processed batch {}\n'.format(line_index * 100 // num_lines, line_index))
+            else:
+                file.write('INFO worker-{} processed record {} in {} ms\n'.format(line_index % 8, line_index,
+                                                                                  line_index % 97))
+
+
+def readline_fragments(file_name, max_bytes_per_line):
+    """Generates the fragments of the file the way ProgressWatcher did before chunked scanning: one readline each."""
+    with open(file_name, 'rb') as file_obj:
+        while True:
+            line = file_obj.readline(max_bytes_per_line)
+            if not line:
+                return
+            yield line
+
+
+def create_watcher(file_name, max_bytes_per_line):
+    """Creates a watcher for the complete file_name, only its last progress state is generated."""
+    task_completed_signal = Event()
+    task_completed_signal.set()
+    return cp.ProgressWatcher(file_name, 'benchmark', cp.ProgressSequenceCounter(), max_bytes_per_line,
+                              PROGRESS_REGEX_STRING, Event(), task_completed_signal, Event())
+
+
+def chatty_command(num_lines, progress_every=1000):
+    """Returns the command of a task that writes the output of write_chatty_output to its stdout."""
+    return 'awk \'BEGIN {{ for (i = 0; i < {0}; i++) {{ ' \
+           'if (i % {1} == 0) printf "progress: %d, processed batch %d\\n", i * 100 / {0}, i; ' \
+           'else printf "INFO worker-%d processed record %d in %d ms\\n", i % 8, i, i % 97 }} }}\''.format(
+        num_lines, progress_every)
+
+
+class TimestampingDriver(tu.FakeMesosExecutorDriver):
+    """Records the time at which each framework message is sent."""
+
+    def __init__(self):
+        super().__init__()
+        self.message_times = []
+
+    def sendFrameworkMessage(self, message):
+        self.message_times.append(time.time())
+        super().sendFrameworkMessage(message)
+
+
+class RssSampler(object):
+    """Samples the resident memory of the executor on a thread, until stopped, and keeps its peak."""
+
+    def __init__(self, interval_secs=0.005):
+        self.interval_secs = interval_secs
+        self.peak_rss_bytes = 0
+        self.process = psutil.Process()
+        self.stopped = Event()
+        self.thread = Thread(target=self.__sample, daemon=True)
+
+    def __sample(self):
+        while True:
+            self.peak_rss_bytes = max(self.peak_rss_bytes, self.process.memory_info().rss)
+            if self.stopped.wait(self.interval_secs):
+                return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stopped.set()
+        self.thread.join()
+
+
+def percentile(sorted_values, fraction):
+    """Returns the value at fraction of the sorted values, None when there are no values."""
+    if not sorted_values:
+        return None
+    return sorted_values[int(round(fraction * (len(sorted_values) - 1)))]
+
+
+def counter_total(counters, prefix):
+    """Returns the sum of the counters whose name starts with prefix."""
+    return sum(value for name, value in counters.items() if name.startswith(prefix))
+
+
+def measure_manage_task(command, capture_output, driver=None, progress_sample_interval_ms=100):
+    """Runs command in manage_task and returns the executor CPU seconds, the bytes it read from files,
+    the bytes it read from pipes, the progress messages sent and the peak executor rss."""
+    task_id = tu.get_random_task_id()
+    stdout_name = tu.ensure_directory('build/stdout.{}'.format(task_id))
+    stderr_name = tu.ensure_directory('build/stderr.{}'.format(task_id))
+    config = tu.FakeExecutorConfig({'capture_output': capture_output,
+                                    'cgroup_kill': False,
+                                    'checkpoint': False,
+                                    'idle_timeout_secs': 0,
+                                    'max_bytes_read_per_line': 4 * 1024,
+                                    'max_message_length': 512,
+                                    'mesos_directory': '/mesos/directory/{}'.format(task_id),
+                                    'metric_patterns': {},
+                                    'output_roll_bytes': 0,
+                                    'progress_additional_files': [],
+                                    'progress_channel': 'file',
+                                    'progress_output_env_variable': 'DEFAULT_PROGRESS_FILE_ENV_VARIABLE',
+                                    'progress_output_name': 'build/progress.{}'.format(task_id),
+                                    'progress_regex_string': PROGRESS_REGEX_STRING,
+                                    'progress_sample_interval_ms': progress_sample_interval_ms,
+                                    'progress_start_mode': 'offset',
+                                    'progress_watch_mode': 'inotify',
+                                    'reset_vars': [],
+                                    'sandbox_directory': '/sandbox/directory/{}'.format(task_id),
+                                    'shutdown_grace_period_ms': 60000,
+                                    'stderr_file': stderr_name,
+                                    'stdout_file': stdout_name,
+                                    'telemetry_interval_secs': 0})
+    task = {'task_id': {'value': task_id},
+            'data': pm.encode_data(json.dumps({'command': command}).encode('utf8'))}
+    driver = driver or tu.FakeMesosExecutorDriver()
+    output_streams = []
+
+    def record_output_stream(capture_fn):
+        return lambda *args: output_streams.append(capture_fn(*args)) or output_streams[-1]
+
+    executor_process = psutil.Process()
+    tu.redirect_stdout_to_file(stdout_name)
+    tu.redirect_stderr_to_file(stderr_name)
+    try:
+        with patch.object(cio, 'capture_stdout', record_output_stream(cio.capture_stdout)), \
+             patch.object(cio, 'capture_stderr', record_output_stream(cio.capture_stderr)):
+            with RssSampler() as rss_sampler:
+                start_cpu_secs = time.process_time()
+                start_read_chars = executor_process.io_counters().read_chars
+                ce.manage_task(driver, task, Event(), Event(), config)
+                read_chars = executor_process.io_counters().read_chars - start_read_chars
+                cpu_secs = time.process_time() - start_cpu_secs
+    finally:
+        tu.cleanup_output(stdout_name, stderr_name)
+    pipe_bytes = sum(output_stream.bytes_read for output_stream in output_streams)
+    progress_messages = [m for m in map(tu.parse_message, driver.messages) if 'progress-sequence' in m]
+    return cpu_secs, read_chars - pipe_bytes, pipe_bytes, progress_messages, rss_sampler.peak_rss_bytes
+
+
+def measure_startup():
+    """Executes the executor with a local fake driver and returns the seconds from the exec to the registration,
+    the seconds from the exec to the TASK_RUNNING update and the LAZY_MODULES loaded by then."""
+    sandbox_directory = os.path.abspath(tu.ensure_directory('build/startup.{}/'.format(tu.get_random_task_id())))
+    os.makedirs(sandbox_directory, exist_ok=True)
+    timestamps_file = os.path.join(sandbox_directory, 'timestamps.json')
+    environment = dict(os.environ, MESOS_SANDBOX=sandbox_directory)
+    try:
+        exec_time = time.time()
+        subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, timestamps_file] + LAZY_MODULES,
+                       env=environment, stdout=subprocess.DEVNULL, check=True, timeout=60)
+        with open(timestamps_file) as timestamps_obj:
+            timestamps = json.load(timestamps_obj)
+    finally:
+        for file_name in os.listdir(sandbox_directory):
+            tu.cleanup_file(os.path.join(sandbox_directory, file_name))
+        os.rmdir(sandbox_directory)
+    return timestamps['registered'] - exec_time, timestamps['running'] - exec_time, timestamps['lazy-modules-loaded']
+
+
+def measure_progress_scenario(rate, line_length, progress_every, capture_output):
+    """Runs a task that writes output at rate bytes per second for BENCHMARK_DURATION_SECS in manage_task.
+
+    Returns
+    -------
+    the executor cpu percent, the lines and bytes it read per second, the p50 and p99 latency from the write of a
+    progress line to its framework message, the number of progress messages and the peak executor rss.
+    """
+    command = '{} -c {} {} {} {} {}'.format(sys.executable, shlex.quote(RATE_LIMITED_OUTPUT_SCRIPT), rate,
+                                            BENCHMARK_DURATION_SECS, line_length, progress_every)
+    driver = TimestampingDriver()
+    counters_before = cins.snapshot()['counters']
+    start_time = time.time()
+    cpu_secs, _, _, progress_messages, peak_rss_bytes = measure_manage_task(command, capture_output, driver=driver,
+                                                                            progress_sample_interval_ms=10)
+    elapsed_secs = time.time() - start_time
+    counters_after = cins.snapshot()['counters']
+
+    message_times = {tu.parse_message(m).get('progress-sequence'): t
+                     for m, t in zip(driver.messages, driver.message_times)}
+    # the last progress message is force sent once the task has completed, it does not measure the tracking latency
+    latencies = sorted(message_times[m['progress-sequence']] - float(m['progress-message'])
+                       for m in progress_messages[:-1])
+    lines_read = counter_total(counters_after, 'progress.lines-read.') - \
+                 counter_total(counters_before, 'progress.lines-read.')
+    bytes_read = counter_total(counters_after, 'progress.bytes-read.') - \
+                 counter_total(counters_before, 'progress.bytes-read.')
+    return {'bytes-per-sec': round(bytes_read / elapsed_secs),
+            'cpu-percent': round(100 * cpu_secs / elapsed_secs, 1),
+            'latency-p50-ms': None if not latencies else round(1000 * percentile(latencies, 0.5), 2),
+            'latency-p99-ms': None if not latencies else round(1000 * percentile(latencies, 0.99), 2),
+            'lines-per-sec': round(lines_read / elapsed_secs),
+            'peak-rss-bytes': peak_rss_bytes,
+            'progress-messages': len(progress_messages)}
+
+
+def compare_benchmark_results(previous_results, results):
+    """Logs the change of the throughput, cpu and latency of each scenario from the previous results."""
+    for scenario, result in sorted(results.items()):
+        previous_result = previous_results.get(scenario)
+        if not previous_result:
+            continue
+        changes = []
+        for key in ['lines-per-sec', 'cpu-percent', 'latency-p99-ms', 'peak-rss-bytes']:
+            if previous_result.get(key) and result.get(key) is not None:
+                changes.append('{} {:+.0f}%'.format(key, 100.0 * (result[key] - previous_result[key]) /
+                                                    previous_result[key]))
+        logging.info('Progress scenario {} compared to the previous run: {}'.format(scenario, ', '.join(changes)))
+
+
+def measure_lines_per_second(progress_states):
+    """Returns the last progress state generated and the rate at which the BENCHMARK_LINES lines were parsed."""
+    start_time = time.perf_counter()
+    last_progress_state = None
+    for progress_state in progress_states:
+        last_progress_state = progress_state
+    elapsed_secs = time.perf_counter() - start_time
+    return last_progress_state, BENCHMARK_LINES / max(elapsed_secs, 1e-9)
+
+
+class BenchmarkTest(unittest.TestCase):
+    def test_benchmark_progress_parsing_lines_per_second(self):
+        file_name = tu.ensure_directory('build/benchmark_progress.{}'.format(tu.get_random_task_id()))
+        max_bytes_per_line = 4 * 1024
+
+        try:
+            write_chatty_output(file_name, BENCHMARK_LINES)
+
+            readline_watcher = create_watcher(file_name, max_bytes_per_line)
+            readline_progress, readline_rate = measure_lines_per_second(
+                readline_watcher.progress_states(readline_fragments(file_name, max_bytes_per_line)))
+            scanner_watcher = create_watcher(file_name, max_bytes_per_line)
+            scanner_watcher.progress_regex_literal = None
+            scanner_progress, scanner_rate = measure_lines_per_second(
+                scanner_watcher.progress_states(scanner_watcher.tail_lines(candidates_only=True)))
+            prefilter_watcher = create_watcher(file_name, max_bytes_per_line)
+            prefilter_progress, prefilter_rate = measure_lines_per_second(
+                prefilter_watcher.progress_states(prefilter_watcher.tail_lines(candidates_only=True)))
+
+            logging.info('Progress parsing: readline {:.0f} lines/s, chunked scanner {:.0f} lines/s ({:.1f}x), '
+                         'chunked scanner with literal prefilter {:.0f} lines/s ({:.1f}x)'
+                         .format(readline_rate, scanner_rate, scanner_rate / readline_rate,
+                                 prefilter_rate, prefilter_rate / readline_rate))
+            last_batch = BENCHMARK_LINES - 1000
+            self.assertEqual({'progress-message': 'processed batch {}'.format(last_batch).encode(),
+                              'progress-percent': last_batch * 100 // BENCHMARK_LINES,
+                              'progress-sequence': 1},
+                             readline_progress)
+            self.assertEqual(readline_progress, scanner_progress)
+            self.assertEqual(readline_progress, prefilter_progress)
+            self.assertEqual(BENCHMARK_LINES, scanner_watcher.fragments_read)
+            self.assertEqual(BENCHMARK_LINES, prefilter_watcher.fragments_read)
+        finally:
+            tu.cleanup_file(file_name)
+
+    def test_benchmark_captured_output_executor_cpu_and_reads(self):
+        command = chatty_command(BENCHMARK_LINES)
+
+        file_cpu_secs, file_reads, _, file_messages, _ = measure_manage_task(command, False)
+        capture_cpu_secs, capture_reads, capture_pipe_bytes, capture_messages, _ = measure_manage_task(command, True)
+
+        logging.info('Executor for {} lines of output: re-reading the sandbox files used {:.2f} cpu secs and read '
+                     '{} bytes from files, capturing the output used {:.2f} cpu secs ({:.1f}x) and read {} bytes '
+                     'from files and {} bytes from pipes'
+                     .format(BENCHMARK_LINES, file_cpu_secs, file_reads, capture_cpu_secs,
+                             file_cpu_secs / max(capture_cpu_secs, 1e-9), capture_reads, capture_pipe_bytes))
+        last_batch = BENCHMARK_LINES - 1000
+        self.assertEqual('processed batch {}'.format(last_batch), file_messages[-1]['progress-message'])
+        self.assertEqual(file_messages[-1]['progress-message'], capture_messages[-1]['progress-message'])
+        self.assertGreaterEqual(file_reads, capture_pipe_bytes)
+        self.assertLess(capture_reads, capture_pipe_bytes)
+
+    def test_benchmark_startup_latency(self):
+        measurements = [measure_startup() for _ in range(STARTUP_RUNS)]
+        registered_secs, running_secs, lazy_modules_loaded = min(measurements, key=lambda m: m[1])
+
+        logging.info('Executor startup: exec to registered {:.3f} secs, exec to TASK_RUNNING {:.3f} secs '
+                     '(target {} secs), all runs: {}'
+                     .format(registered_secs, running_secs, STARTUP_TARGET_SECS,
+                             ', '.join('{:.3f}'.format(m[1]) for m in measurements)))
+        self.assertEqual([], lazy_modules_loaded)
+        self.assertLess(registered_secs, running_secs)
+        self.assertLess(running_secs, STARTUP_TARGET_SECS)
+
+    def test_benchmark_progress_scenarios(self):
+        results = {}
+        for rate, line_length, progress_every, capture_output in PROGRESS_SCENARIOS:
+            scenario = '{}KB/s-{}B-lines-progress-every-{}{}'.format(
+                rate // 1024, line_length, progress_every, '-captured' if capture_output else '')
+            result = measure_progress_scenario(rate, line_length, progress_every, capture_output)
+            logging.info('Progress scenario {}: {}'.format(scenario, result))
+            results[scenario] = result
+            self.assertGreater(result['lines-per-sec'], 0)
+            self.assertGreater(result['progress-messages'], 0)
+
+        results_file = tu.ensure_directory(BENCHMARK_RESULTS_FILE)
+        if os.path.isfile(results_file):
+            with open(results_file) as previous_results_obj:
+                compare_benchmark_results(json.load(previous_results_obj)['results'], results)
+        with open(results_file, 'w') as results_obj:
+            json.dump({'duration-secs': BENCHMARK_DURATION_SECS,
+                       'python': sys.version.split()[0],
+                       'results': results,
+                       'timestamp': round(time.time())}, results_obj, indent=2, sort_keys=True)
+        logging.info('Progress scenario results written to {}'.format(results_file))
@@ -0,0 +1,85 @@
+import os
+import signal
+import unittest
+from unittest.mock import patch
+
+import psutil
+
+import cook.cgroup as ccg
+import cook.subprocess as cs
+import tests.utils as tu
+
+
+def is_process_live(process_id):
+    """Returns true if the process exists and is not a zombie."""
+    try:
+        return psutil.Process(process_id).status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+
+
+class CgroupTest(unittest.TestCase):
+    def setUp(self):
+        self.cgroup = ccg.TaskCgroup.create(tu.get_random_task_id())
+        if self.cgroup is None:
+            self.skipTest('requires a delegated cgroup v2')
+
+    def tearDown(self):
+        if os.path.isdir(self.cgroup.path):
+            self.cgroup.kill()
+            self.cgroup.remove(timeout_secs=5)
+
+    def launch_process_tree(self):
+        # the last sleep starts a new session and is re-parented once its parent exits, escaping the process tree
+        command = 'sleep 600 & (sleep 600 & sleep 600) & (setsid sleep 600 &) ; sleep 600'
+        process = cs.launch_process(command, dict(os.environ), cgroup=self.cgroup)
+        process_ids = tu.wait_for(self.cgroup.process_ids, lambda data: len(data) == 6, default_value=[])
+        self.assertEqual(6, len(process_ids))
+        self.assertIn(process.pid, process_ids)
+        return process, process_ids
+
+    def send_signal_helper(self, signal_to_send):
+        process, process_ids = self.launch_process_tree()
+
+        cs.send_signal(process.pid, signal_to_send, self.cgroup)
+
+        process.wait(timeout=5)
+        remaining_process_ids = tu.wait_for(lambda: [p for p in process_ids if is_process_live(p)],
+                                            lambda data: len(data) == 0, default_value=[])
+        self.assertEqual([], remaining_process_ids)
+        self.assertFalse(self.cgroup.is_populated())
+
+        self.cgroup.remove()
+        self.assertFalse(os.path.exists(self.cgroup.path))
+
+    def test_find_cgroup_directory(self):
+        cgroup_directory = ccg.find_cgroup_directory()
+        self.assertEqual(os.path.dirname(self.cgroup.path), cgroup_directory)
+        self.assertTrue(os.path.isfile(os.path.join(cgroup_directory, 'cgroup.procs')))
+
+    def test_send_signal_kill(self):
+        self.send_signal_helper(signal.SIGKILL)
+
+    def test_send_signal_kill_without_cgroup_kill(self):
+        with patch.object(ccg.TaskCgroup, 'kill', return_value=False):
+            self.send_signal_helper(signal.SIGKILL)
+
+    def test_send_signal_term(self):
+        self.send_signal_helper(signal.SIGTERM)
+
+    def test_freeze_and_thaw(self):
+        process, process_ids = self.launch_process_tree()
+
+        self.assertTrue(self.cgroup.freeze(True))
+        self.assertTrue(all(psutil.Process(p).status() in [psutil.STATUS_STOPPED, psutil.STATUS_SLEEPING]
+                            for p in process_ids))
+        self.assertTrue(self.cgroup.freeze(False))
+        self.assertTrue(cs.is_process_running(process))
+
+        self.assertTrue(self.cgroup.send_signal(signal.SIGKILL))
+        process.wait(timeout=5)
+
+    def test_send_signal_empty_cgroup(self):
+        self.assertFalse(self.cgroup.is_populated())
+        self.assertFalse(self.cgroup.send_signal(signal.SIGKILL))
+        self.assertFalse(self.cgroup.send_signal(signal.SIGTERM))
@@ -0,0 +1,150 @@
+import json
+import os
+import unittest
+from threading import Event
+
+import cook.checkpoint as cck
+import cook.progress as cp
+import tests.utils as tu
+
+
+class CheckpointTest(unittest.TestCase):
+    def tracker_helper(self, config, counter, sent_messages, checkpointer, completed):
+        updater = cp.ProgressUpdater(checkpointer.task_id, 100, 0,
+                                     lambda message: sent_messages.append(message) or True)
+        return cp.MultiplexedProgressTracker(config, Event(), completed, counter, updater, Event(),
+                                             tu.fake_os_error_handler, checkpointer)
+
+    def test_resume_from_checkpoint(self):
+        task_id = tu.get_random_task_id()
+        progress_name = tu.ensure_directory('build/progress.{}'.format(task_id))
+        checkpoint_name = tu.ensure_directory('build/checkpoint.{}.json'.format(task_id))
+        config = tu.FakeExecutorConfig({'max_bytes_read_per_line': 1024,
+                                        'progress_regex_string': 'progress: ([0-9]*\.?[0-9]+), (.*)',
+                                        'progress_watch_mode': cp.WATCH_MODE_INOTIFY})
+        first_lines = b'progress: 25, first\nprogress: 50, second\n'
+
+        try:
+            with open(progress_name, 'wb') as f:
+                f.write(first_lines)
+
+            completed = Event()
+            sent_messages = []
+            checkpointer = cck.ProgressCheckpointer(checkpoint_name, task_id, interval_secs=0)
+            tracker = self.tracker_helper(config, cp.ProgressSequenceCounter(), sent_messages, checkpointer, completed)
+            tracker.add_location(progress_name, 'progress')
+            tracker.start()
+            tu.wait_for(lambda: len(sent_messages), lambda n: n >= 2, max_delay_ms=10000)
+
+            expected_checkpoint = {'locations': {progress_name: {'identity': cck.file_identity(progress_name),
+                                                                 'offset': len(first_lines),
+                                                                 'progress': {'progress-message': 'second',
+                                                                              'progress-percent': 50,
+                                                                              'progress-sequence': 2}}},
+                                   'progress-sequence': 2,
+                                   'task-id': task_id}
+            checkpoint = tu.wait_for(lambda: cck.load_checkpoint(checkpoint_name, task_id),
+                                     lambda c: c == expected_checkpoint, max_delay_ms=10000)
+            self.assertEqual(expected_checkpoint, checkpoint)
+            completed.set()
+            tracker.wake()
+            tracker.wait(timeout=5)
+            self.assertIsNone(cck.load_checkpoint(checkpoint_name, 'another-task'))
+
+            # a recovered tracker resumes from the checkpointed offset and sequence, earlier lines are not sent again
+            # and the lines written since the checkpoint, before the file size is measured at launch, are not skipped
+            with open(progress_name, 'ab') as f:
+                f.write(b'progress: 60, third\nprogress: 75, fourth\n')
+            offset, progress = cck.resume_location(checkpoint, progress_name, os.path.getsize(progress_name))
+            self.assertEqual(len(first_lines), offset)
+            self.assertEqual({'progress-message': b'second', 'progress-percent': 50, 'progress-sequence': 2},
+                             progress)
+
+            completed = Event()
+            sent_messages = []
+            checkpointer = cck.ProgressCheckpointer(checkpoint_name, task_id, interval_secs=0)
+            tracker = self.tracker_helper(config, cp.ProgressSequenceCounter(checkpoint['progress-sequence']),
+                                          sent_messages, checkpointer, completed)
+            watcher = tracker.add_location(progress_name, 'progress', offset, progress)
+            tracker.start()
+            tu.wait_for(lambda: len(sent_messages), lambda n: n >= 2, max_delay_ms=10000)
+            completed.set()
+            tracker.wake()
+            tracker.wait(timeout=5)
+
+            self.assertEqual([{'progress-message': 'third', 'progress-percent': 60,
+                               'progress-sequence': 3, 'task-id': task_id},
+                              {'progress-message': 'fourth', 'progress-percent': 75,
+                               'progress-sequence': 4, 'task-id': task_id}],
+                             sent_messages)
+            self.assertEqual(os.path.getsize(progress_name), watcher.offset)
+
+            checkpointer.remove()
+            self.assertFalse(os.path.exists(checkpoint_name))
+            self.assertFalse(checkpointer.maybe_write([watcher], cp.ProgressSequenceCounter(5)))
+            self.assertFalse(os.path.exists(checkpoint_name))
+        finally:
+            tu.cleanup_file(progress_name)
+            tu.cleanup_file(checkpoint_name)
+
+    def test_resume_location_ignores_replaced_or_truncated_files(self):
+        task_id = tu.get_random_task_id()
+        progress_name = tu.ensure_directory('build/progress.{}'.format(task_id))
+
+        try:
+            with open(progress_name, 'wb') as f:
+                f.write(b'progress: 25, first\n')
+            location_state = {'identity': cck.file_identity(progress_name),
+                              'offset': 20,
+                              'progress': {'progress-message': 'first', 'progress-percent': 25,
+                                           'progress-sequence': 1}}
+            checkpoint = {'locations': {progress_name: location_state}, 'progress-sequence': 1, 'task-id': task_id}
+            self.assertEqual((20, {'progress-message': b'first', 'progress-percent': 25, 'progress-sequence': 1}),
+                             cck.resume_location(checkpoint, progress_name, 7))
+            self.assertEqual((7, None), cck.resume_location(None, progress_name, 7))
+            self.assertEqual((7, None), cck.resume_location(checkpoint, 'build/unknown', 7))
+            # the checkpointed offset is used even when the default offset, e.g. the size at launch, is larger
+            location_state['offset'] = 5
+            self.assertEqual((5, {'progress-message': b'first', 'progress-percent': 25, 'progress-sequence': 1}),
+                             cck.resume_location(checkpoint, progress_name, 20))
+            location_state['offset'] = 20
+
+            with open(progress_name, 'wb') as f:
+                f.write(b'progress')
+            self.assertEqual((7, None), cck.resume_location(checkpoint, progress_name, 7))
+
+            os.remove(progress_name)
+            with open(progress_name, 'wb') as f:
+                f.write(b'progress: 25, first\n')
+            location_state['identity'] = [location_state['identity'][0], -1]
+            self.assertEqual((7, None), cck.resume_location(checkpoint, progress_name, 7))
+        finally:
+            tu.cleanup_file(progress_name)
+
+    def test_checkpointer_throttles_writes(self):
+        task_id = tu.get_random_task_id()
+        checkpoint_name = tu.ensure_directory('build/checkpoint.{}.json'.format(task_id))
+        counter = cp.ProgressSequenceCounter()
+
+        try:
+            checkpointer = cck.ProgressCheckpointer(checkpoint_name, task_id, interval_secs=60)
+            self.assertTrue(checkpointer.maybe_write([], counter))
+            counter.increment_and_get()
+            self.assertFalse(checkpointer.maybe_write([], counter))
+            with open(checkpoint_name) as f:
+                self.assertEqual({'locations': {}, 'progress-sequence': 0, 'task-id': task_id}, json.load(f))
+
+            # unchanged checkpoints are not written again
+            checkpointer.interval_secs = 0
+            self.assertTrue(checkpointer.maybe_write([], counter))
+            self.assertFalse(checkpointer.maybe_write([], counter))
+            self.assertEqual(2, checkpointer.num_writes)
+            self.assertEqual(1, cck.load_checkpoint(checkpoint_name, task_id)['progress-sequence'])
+
+            # the checkpoint is not written again once removed
+            checkpointer.remove()
+            counter.increment_and_get()
+            self.assertFalse(checkpointer.maybe_write([], counter))
+            self.assertFalse(os.path.exists(checkpoint_name))
+        finally:
+            tu.cleanup_file(checkpoint_name)
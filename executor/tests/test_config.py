@@ -4,6 +4,7 @@ import unittest
 import os
 
 import cook.config as cc
+import cook.rotation as cr
 
 
 class ConfigTest(unittest.TestCase):
@@ -19,46 +20,85 @@ class ConfigTest(unittest.TestCase):
         self.assertEqual(1000, cc.ExecutorConfig.parse_time_ms('corrupt-value'))
 
     def test_executor_config(self):
+        capture_output = True
+        cgroup_kill = True
         checkpoint = 1
+        idle_timeout_secs = 10
+        instrumentation_interval_secs = 30
         max_bytes_read_per_line = 16 * 1024
         max_message_length = 300
         memory_usage_interval_secs = 150
         mesos_directory = '/mesos/directory'
+        metric_patterns = {'rows': 'rows: ([0-9]+)'}
+        output_compression = 'none'
+        output_max_total_bytes = 1024 * 1024
+        output_roll_bytes = 256 * 1024
+        progress_additional_files = ['extra.log']
+        progress_channel = 'fifo'
         progress_output_env_variable = 'PROGRESS_OUTPUT_ENV_VARIABLE'
         progress_output_name = 'stdout_name'
         progress_regex_string = 'some-regex-string'
         progress_sample_interval_ms = 100
+        progress_start_mode = 'last-match'
+        progress_watch_mode = 'poll'
         recovery_timeout = '5mins'
         reset_vars = ['a', 'b']
         sandbox_directory = '/location/to/task/sandbox/task_id'
         shutdown_grace_period_secs = '5secs'
-        config = cc.ExecutorConfig(checkpoint=checkpoint,
+        telemetry_interval_secs = 30
+        config = cc.ExecutorConfig(capture_output=capture_output,
+                                   cgroup_kill=cgroup_kill,
+                                   checkpoint=checkpoint,
+                                   idle_timeout_secs=idle_timeout_secs,
+                                   instrumentation_interval_secs=instrumentation_interval_secs,
                                    max_bytes_read_per_line=max_bytes_read_per_line,
                                    max_message_length=max_message_length,
                                    memory_usage_interval_secs=memory_usage_interval_secs,
                                    mesos_directory=mesos_directory,
+                                   metric_patterns=metric_patterns,
+                                   output_compression=output_compression,
+                                   output_max_total_bytes=output_max_total_bytes,
+                                   output_roll_bytes=output_roll_bytes,
+                                   progress_additional_files=progress_additional_files,
+                                   progress_channel=progress_channel,
                                    progress_output_env_variable=progress_output_env_variable,
                                    progress_output_name=progress_output_name,
                                    progress_regex_string=progress_regex_string,
                                    progress_sample_interval_ms=progress_sample_interval_ms,
+                                   progress_start_mode=progress_start_mode,
+                                   progress_watch_mode=progress_watch_mode,
                                    recovery_timeout=recovery_timeout,
                                    reset_vars=reset_vars,
                                    sandbox_directory=sandbox_directory,
-                                   shutdown_grace_period=shutdown_grace_period_secs)
+                                   shutdown_grace_period=shutdown_grace_period_secs,
+                                   telemetry_interval_secs=telemetry_interval_secs)
 
+        self.assertEqual(capture_output, config.capture_output)
+        self.assertEqual(cgroup_kill, config.cgroup_kill)
         self.assertEqual(checkpoint, True)
+        self.assertEqual(idle_timeout_secs, config.idle_timeout_secs)
+        self.assertEqual(instrumentation_interval_secs, config.instrumentation_interval_secs)
         self.assertEqual(max_bytes_read_per_line, config.max_bytes_read_per_line)
         self.assertEqual(max_message_length, config.max_message_length)
         self.assertEqual(memory_usage_interval_secs, config.memory_usage_interval_secs)
         self.assertEqual(mesos_directory, config.mesos_directory)
+        self.assertEqual(metric_patterns, config.metric_patterns)
+        self.assertEqual(output_compression, config.output_compression)
+        self.assertEqual(output_max_total_bytes, config.output_max_total_bytes)
+        self.assertEqual(output_roll_bytes, config.output_roll_bytes)
+        self.assertEqual(progress_additional_files, config.progress_additional_files)
+        self.assertEqual(progress_channel, config.progress_channel)
         self.assertEqual(progress_output_env_variable, config.progress_output_env_variable)
         self.assertEqual(progress_output_name, config.progress_output_name)
         self.assertEqual(progress_regex_string, config.progress_regex_string)
         self.assertEqual(progress_sample_interval_ms, config.progress_sample_interval_ms)
+        self.assertEqual(progress_start_mode, config.progress_start_mode)
+        self.assertEqual(progress_watch_mode, config.progress_watch_mode)
         self.assertEqual(5 * 60 * 1000, config.recovery_timeout_ms)
         self.assertEqual(reset_vars, reset_vars)
         self.assertEqual(sandbox_directory, config.sandbox_directory)
         self.assertEqual(5000, config.shutdown_grace_period_ms)
+        self.assertEqual(telemetry_interval_secs, config.telemetry_interval_secs)
         self.assertEqual(os.path.join(sandbox_directory, 'foo.bar'), config.sandbox_file('foo.bar'))
         self.assertEqual(os.path.join(sandbox_directory, 'stderr'), config.stderr_file())
         self.assertEqual(os.path.join(sandbox_directory, 'stdout'), config.stdout_file())
@@ -67,24 +107,50 @@ class ConfigTest(unittest.TestCase):
         environment = {}
         config = cc.initialize_config(environment)
 
+        self.assertEqual(False, config.capture_output)
+        self.assertEqual(False, config.cgroup_kill)
         self.assertEqual(False, config.checkpoint)
+        self.assertEqual(0, config.idle_timeout_secs)
+        self.assertEqual(0, config.instrumentation_interval_secs)
         self.assertEqual(4 * 1024, config.max_bytes_read_per_line)
         self.assertEqual(512, config.max_message_length)
         self.assertEqual('', config.mesos_directory)
+        self.assertEqual({}, config.metric_patterns)
+        self.assertEqual(cr.default_compression(), config.output_compression)
+        self.assertEqual(0, config.output_max_total_bytes)
+        self.assertEqual(0, config.output_roll_bytes)
+        self.assertEqual([], config.progress_additional_files)
+        self.assertEqual('file', config.progress_channel)
         self.assertEqual('executor.progress', config.progress_output_name)
         self.assertEqual('progress: ([0-9]*\\.?[0-9]+), (.*)', config.progress_regex_string)
         self.assertEqual(15 * 60 * 1000, config.recovery_timeout_ms)
         self.assertEqual(1000, config.progress_sample_interval_ms)
+        self.assertEqual('offset', config.progress_start_mode)
+        self.assertEqual('inotify', config.progress_watch_mode)
         self.assertEqual([], config.reset_vars)
         self.assertEqual('', config.sandbox_directory)
         self.assertEqual(2000, config.shutdown_grace_period_ms)
+        self.assertEqual(0, config.telemetry_interval_secs)
 
     def test_initialize_config_custom(self):
-        environment = {'EXECUTOR_MAX_BYTES_READ_PER_LINE': '1234',
+        environment = {'EXECUTOR_CAPTURE_OUTPUT': 'true',
+                       'EXECUTOR_CGROUP_KILL': 'true',
+                       'EXECUTOR_IDLE_TIMEOUT_SECS': '30',
+                       'EXECUTOR_INSTRUMENTATION_INTERVAL_SECS': '0',
+                       'EXECUTOR_MAX_BYTES_READ_PER_LINE': '1234',
                        'EXECUTOR_MAX_MESSAGE_LENGTH': '1024',
                        'EXECUTOR_MEMORY_USAGE_INTERVAL_SECS': '120',
+                       'EXECUTOR_METRIC_PATTERNS': '{"loss": "loss=([0-9.]+)", "rows": "rows: ([0-9]+)"}',
+                       'EXECUTOR_OUTPUT_COMPRESSION': 'none',
+                       'EXECUTOR_OUTPUT_MAX_TOTAL_BYTES': '4194304',
+                       'EXECUTOR_OUTPUT_ROLL_BYTES': '1048576',
+                       'EXECUTOR_PROGRESS_ADDITIONAL_FILES': 'extra.log,/var/log/other.log',
+                       'EXECUTOR_PROGRESS_CHANNEL': 'socket',
                        'EXECUTOR_PROGRESS_OUTPUT_FILE': 'progress_file',
+                       'EXECUTOR_PROGRESS_START_MODE': 'last-match',
+                       'EXECUTOR_PROGRESS_WATCH_MODE': 'poll',
                        'EXECUTOR_RESET_VARS': 'VAR_A,VAR_B',
+                       'EXECUTOR_TELEMETRY_INTERVAL_SECS': '5',
                        'MESOS_CHECKPOINT': '1',
                        'MESOS_DIRECTORY': '/mesos/directory',
                        'MESOS_EXECUTOR_SHUTDOWN_GRACE_PERIOD': '4secs',
@@ -94,19 +160,61 @@ class ConfigTest(unittest.TestCase):
                        'PROGRESS_SAMPLE_INTERVAL_MS': '2500'}
         config = cc.initialize_config(environment)
 
+        self.assertEqual(True, config.capture_output)
+        self.assertEqual(True, config.cgroup_kill)
         self.assertEqual(True, config.checkpoint)
+        self.assertEqual(30, config.idle_timeout_secs)
+        self.assertEqual(0, config.instrumentation_interval_secs)
         self.assertEqual(1234, config.max_bytes_read_per_line)
         self.assertEqual(1024, config.max_message_length)
         self.assertEqual(120, config.memory_usage_interval_secs)
         self.assertEqual('/mesos/directory', config.mesos_directory)
+        self.assertEqual({'loss': 'loss=([0-9.]+)', 'rows': 'rows: ([0-9]+)'}, config.metric_patterns)
+        self.assertEqual('none', config.output_compression)
+        self.assertEqual(4 * 1024 * 1024, config.output_max_total_bytes)
+        self.assertEqual(1024 * 1024, config.output_roll_bytes)
+        self.assertEqual(['extra.log', '/var/log/other.log'], config.progress_additional_files)
+        self.assertEqual('socket', config.progress_channel)
         self.assertEqual('EXECUTOR_PROGRESS_OUTPUT_FILE', config.progress_output_env_variable)
         self.assertEqual('progress_file', config.progress_output_name)
         self.assertEqual('progress/regex', config.progress_regex_string)
         self.assertEqual(5 * 60 * 1000, config.recovery_timeout_ms)
         self.assertEqual(2500, config.progress_sample_interval_ms)
+        self.assertEqual('last-match', config.progress_start_mode)
+        self.assertEqual('poll', config.progress_watch_mode)
         self.assertEqual(['VAR_A', 'VAR_B'], config.reset_vars)
         self.assertEqual('/sandbox/location', config.sandbox_directory)
         self.assertEqual(4000, config.shutdown_grace_period_ms)
+        self.assertEqual(10, config.telemetry_interval_secs)
+
+    def test_parse_metric_patterns(self):
+        self.assertEqual({}, cc.parse_metric_patterns(''))
+        self.assertEqual({}, cc.parse_metric_patterns('{"rows": '))
+        self.assertEqual({}, cc.parse_metric_patterns('["rows: ([0-9]+)"]'))
+        # the patterns without a capture group, or that are not valid regexes, are skipped
+        self.assertEqual({'rows': 'rows: ([0-9]+)'},
+                         cc.parse_metric_patterns('{"loss": "loss=[0-9.]+", "rows": "rows: ([0-9]+)", '
+                                                  '"speed": "speed: ([0-9]+", "stage": 2}'))
+
+    def test_initialize_config_output_rolling(self):
+        config = cc.initialize_config({'EXECUTOR_OUTPUT_COMPRESSION': 'unknown',
+                                       'EXECUTOR_OUTPUT_ROLL_BYTES': '1024'})
+        # rolling requires the outputs to be captured, small roll sizes are raised
+        self.assertEqual(True, config.capture_output)
+        self.assertEqual(cr.default_compression(), config.output_compression)
+        self.assertEqual(64 * 1024, config.output_roll_bytes)
+
+        config = cc.initialize_config({'EXECUTOR_OUTPUT_COMPRESSION': 'zstd', 'EXECUTOR_PROGRESS_CHANNEL': 'pipe'})
+        self.assertEqual(False, config.capture_output)
+        expected_compression = cr.COMPRESSION_ZSTD if cr.zstandard is not None else cr.COMPRESSION_GZIP
+        self.assertEqual(expected_compression, config.output_compression)
+        self.assertEqual('file', config.progress_channel)
+
+    def test_initialize_config_idle_timeout(self):
+        # several tasks can run in the executor, their outputs are captured to tell them apart
+        config = cc.initialize_config({'EXECUTOR_IDLE_TIMEOUT_SECS': '30'})
+        self.assertEqual(True, config.capture_output)
+        self.assertEqual(30, config.idle_timeout_secs)
 
     def test_initialize_config_custom_progress_file_without_sandbox(self):
         environment = {'EXECUTOR_MAX_BYTES_READ_PER_LINE': '1234',
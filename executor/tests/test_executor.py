@@ -1,5 +1,7 @@
 import errno
 import functools
+import glob
+import gzip
 import json
 import logging
 import subprocess
@@ -13,6 +15,8 @@ import pymesos as pm
 import pytest
 
 import cook
+import cook.cgroup as ccg
+import cook.channel as cch
 import cook.config as cc
 import cook.executor as ce
 import cook.subprocess as cs
@@ -127,6 +131,137 @@ class ExecutorTest(unittest.TestCase):
         self.assertFalse(result)
         self.assertEqual(1, len(driver.messages))
 
+    def test_message_sender_does_not_block_on_slow_driver(self):
+        driver = tu.FakeMesosExecutorDriver()
+        driver_blocked = Event()
+        send_framework_message = driver.sendFrameworkMessage
+        driver.sendFrameworkMessage = lambda message: driver_blocked.wait() and send_framework_message(message)
+        task_id = tu.get_random_task_id()
+        sender = ce.MessageSender(driver)
+        status_updater = ce.StatusUpdater(sender, task_id)
+        try:
+            start_time = time.time()
+            self.assertTrue(sender.send_message(tu.fake_os_error_handler, {'sandbox-directory': '/sandbox'}))
+            for progress_sequence in range(1, 6):
+                self.assertTrue(sender.send_message(tu.fake_os_error_handler,
+                                                    {'progress-sequence': progress_sequence, 'task-id': task_id},
+                                                    coalesce_key=('progress', task_id)))
+            self.assertTrue(sender.send_message(tu.fake_os_error_handler, {'exit-code': 0, 'task-id': task_id}))
+            self.assertTrue(status_updater.update_status(cook.TASK_FINISHED))
+            self.assertLess(time.time() - start_time, 1)
+            self.assertFalse(sender.flush(0.1))
+        finally:
+            driver_blocked.set()
+            sender.close()
+
+        # the queued progress messages are superseded by the latest, the order of the messages is kept
+        self.assertEqual([{'sandbox-directory': '/sandbox'},
+                          {'progress-sequence': 5, 'task-id': task_id},
+                          {'exit-code': 0, 'task-id': task_id}],
+                         [tu.parse_message(m) for m in driver.messages])
+        tu.assert_statuses(self, [{'task_id': {'value': task_id}, 'state': cook.TASK_FINISHED}], driver.statuses)
+
+    def test_message_sender_bounded_queue(self):
+        driver = tu.FakeMesosExecutorDriver()
+        driver_blocked = Event()
+        send_status_update = driver.sendStatusUpdate
+        driver.sendStatusUpdate = lambda status: driver_blocked.wait() and send_status_update(status)
+        task_id = tu.get_random_task_id()
+        sender = ce.MessageSender(driver, max_queue_size=2)
+        status_updater = ce.StatusUpdater(sender, task_id)
+        try:
+            status_updater.update_status(cook.TASK_RUNNING)
+            tu.wait_for(lambda: sender.queue_depth, lambda depth: depth == 0, default_value=1)
+            self.assertTrue(sender.send_message(tu.fake_os_error_handler, {'resource-usage': {}},
+                                                coalesce_key=('resource-usage', task_id)))
+            self.assertTrue(sender.send_message(tu.fake_os_error_handler, {'exit-code': 0, 'task-id': task_id}))
+            # coalescable messages are dropped from a full queue, status updates are always queued
+            self.assertFalse(sender.send_message(tu.fake_os_error_handler, {'progress-sequence': 1},
+                                                 coalesce_key=('progress', task_id)))
+            self.assertTrue(status_updater.update_status(cook.TASK_FINISHED))
+            self.assertEqual(3, sender.queue_depth)
+        finally:
+            driver_blocked.set()
+            sender.close()
+
+        tu.assert_statuses(self, [{'task_id': {'value': task_id}, 'state': cook.TASK_RUNNING},
+                                  {'task_id': {'value': task_id}, 'state': cook.TASK_FINISHED}], driver.statuses)
+        self.assertEqual([{'resource-usage': {}}, {'exit-code': 0, 'task-id': task_id}],
+                         [tu.parse_message(m) for m in driver.messages])
+
+    def test_message_sender_sends_terminal_status_first(self):
+        driver = tu.FakeMesosExecutorDriver()
+        driver_blocked = Event()
+        sent = []
+        send_framework_message = driver.sendFrameworkMessage
+        send_status_update = driver.sendStatusUpdate
+        driver.sendFrameworkMessage = lambda message: (driver_blocked.wait() and sent.append(tu.parse_message(message))
+                                                       or send_framework_message(message))
+        driver.sendStatusUpdate = lambda status: (driver_blocked.wait() and sent.append(status['state'])
+                                                  or send_status_update(status))
+        task_id = tu.get_random_task_id()
+        sender = ce.MessageSender(driver)
+        status_updater = ce.StatusUpdater(sender, task_id)
+        try:
+            self.assertTrue(sender.send_message(tu.fake_os_error_handler, {'sandbox-directory': '/sandbox'}))
+            tu.wait_for(lambda: sender.queue_depth, lambda depth: depth == 0, default_value=1)
+            self.assertTrue(sender.send_message(tu.fake_os_error_handler, {'exit-code': 0, 'task-id': task_id}))
+            self.assertTrue(sender.send_message(tu.fake_os_error_handler, {'progress-sequence': 1},
+                                                coalesce_key=('progress', 'other-task')))
+            self.assertTrue(sender.send_message(tu.fake_os_error_handler, {'resource-usage': {}},
+                                                coalesce_key=('resource-usage', task_id)))
+            self.assertTrue(sender.send_message(tu.fake_os_error_handler, {'progress-sequence': 2},
+                                                coalesce_key=('progress', task_id)))
+            self.assertTrue(sender.send_message(tu.fake_os_error_handler, {'metrics-sequence': 1},
+                                                coalesce_key=('metrics', task_id)))
+            self.assertTrue(status_updater.update_status(cook.TASK_FINISHED))
+            # the terminal status is queued but not yet sent, another terminal status is dropped
+            self.assertFalse(status_updater.terminal_status_sent)
+            self.assertFalse(status_updater.update_status(cook.TASK_FAILED))
+        finally:
+            driver_blocked.set()
+            sender.close()
+
+        # the terminal status is sent after the exit code and the final progress and metrics of the task,
+        # ahead of the queued resource usage and the progress of the other tasks
+        self.assertEqual([{'sandbox-directory': '/sandbox'}, {'exit-code': 0, 'task-id': task_id},
+                          {'progress-sequence': 2}, {'metrics-sequence': 1}, cook.TASK_FINISHED,
+                          {'progress-sequence': 1}, {'resource-usage': {}}],
+                         sent)
+        self.assertTrue(status_updater.terminal_status_sent)
+
+    def test_message_sender_terminal_status_failure(self):
+        driver = tu.ErrorMesosExecutorDriver(OSError('socket.error'))
+        task_id = tu.get_random_task_id()
+        sender = ce.MessageSender(driver)
+        status_updater = ce.StatusUpdater(sender, task_id)
+
+        self.assertTrue(status_updater.update_status(cook.TASK_FINISHED))
+        sender.flush(5)
+        # the terminal status was not sent, a later terminal status is sent instead of being dropped
+        self.assertFalse(status_updater.terminal_status_sent)
+        sender.close(5)
+        self.assertFalse(status_updater.update_status(cook.TASK_FAILED))
+        self.assertEqual([cook.TASK_FINISHED, cook.TASK_FAILED], [status['state'] for status in driver.statuses])
+        self.assertFalse(status_updater.terminal_status_pending)
+
+    def test_message_sender_failure_callback_and_close(self):
+        socket_error = OSError('socket.error')
+        driver = tu.ErrorMesosExecutorDriver(socket_error)
+        sender = ce.MessageSender(driver)
+        failed_messages = []
+
+        self.assertTrue(sender.send_message(tu.fake_os_error_handler, {'progress-sequence': 1},
+                                            failure_callback=failed_messages.append))
+        sender.close(5)
+        self.assertEqual([{'progress-sequence': 1}], failed_messages)
+
+        # a closed sender sends on the calling thread
+        self.assertFalse(sender.send_message(tu.fake_os_error_handler, {'progress-sequence': 2},
+                                             failure_callback=failed_messages.append))
+        self.assertEqual(2, len(driver.messages))
+        self.assertFalse(sender.thread.is_alive())
+
     def test_os_error_handler_functools_partial(self):
         driver = tu.FakeMesosExecutorDriver()
         task_id = tu.get_random_task_id()
@@ -319,6 +454,27 @@ class ExecutorTest(unittest.TestCase):
         self.assertEqual(cook.TASK_FAILED, ce.get_task_state(1))
         self.assertEqual(cook.TASK_KILLED, ce.get_task_state(-1))
 
+    def test_create_progress_channel_in_use(self):
+        task_id = tu.get_random_task_id()
+        progress_name = tu.ensure_directory('build/progress.{}'.format(task_id))
+        config = tu.FakeExecutorConfig({'idle_timeout_secs': 0,
+                                        'progress_channel': cch.CHANNEL_FIFO,
+                                        'progress_output_name': progress_name,
+                                        'stderr_file': 'build/stderr.{}'.format(task_id),
+                                        'stdout_file': 'build/stdout.{}'.format(task_id)})
+        self.assertEqual(progress_name, ce.task_progress_output_name(config, task_id))
+        first_channel = ce.create_progress_channel(config, progress_name, task_id)
+        # a task running concurrently gets its own channel
+        second_channel = ce.create_progress_channel(config, progress_name, 'other-task')
+        try:
+            self.assertEqual(progress_name, first_channel.path)
+            self.assertEqual('{}.other-task'.format(progress_name), second_channel.path)
+        finally:
+            first_channel.close()
+            second_channel.close()
+        self.assertFalse(os.path.exists(progress_name))
+        self.assertFalse(os.path.exists(second_channel.path))
+
     def test_retrieve_process_environment(self):
         self.assertEqual({'EXECUTOR_PROGRESS_OUTPUT_FILE': 'stdout'},
                          ce.retrieve_process_environment(cc.ExecutorConfig(), make_task_env({}), {}))
@@ -448,6 +604,36 @@ class ExecutorTest(unittest.TestCase):
         command = 'echo "Hello World"'
         self.manage_task_runner(command, assertions)
 
+    def test_manage_task_sends_resource_usage(self):
+        def assertions(driver, task_id, sandbox_directory, mesos_directory):
+            expected_statuses = [{'task_id': {'value': task_id}, 'state': cook.TASK_STARTING},
+                                 {'task_id': {'value': task_id}, 'state': cook.TASK_RUNNING},
+                                 {'task_id': {'value': task_id}, 'state': cook.TASK_FINISHED}]
+            tu.assert_statuses(self, expected_statuses, driver.statuses)
+
+            messages = [tu.parse_message(m) for m in driver.messages]
+            self.assertEqual({'sandbox-directory': mesos_directory, 'task-id': task_id, 'type': 'directory'},
+                             messages[0])
+            usage_messages = messages[1:-1]
+            self.assertGreaterEqual(len(usage_messages), 1)
+            for usage_message in usage_messages:
+                self.assertEqual(task_id, usage_message['task-id'])
+                self.assertEqual(2, usage_message['resource-usage']['num-processes'])
+
+            exit_message = messages[-1]
+            self.assertEqual(0, exit_message['exit-code'])
+            self.assertEqual(task_id, exit_message['task-id'])
+            self.assertEqual(0, exit_message['resource-usage']['num-processes'])
+            self.assertEqual(2, exit_message['resource-usage']['peak-num-processes'])
+            self.assertGreater(exit_message['resource-usage']['peak-rss-bytes'], 0)
+
+        task_id = tu.get_random_task_id()
+        config = cc.ExecutorConfig(mesos_directory='/mesos/directory/{}'.format(task_id),
+                                   progress_output_name='stdout.{}'.format(task_id),
+                                   sandbox_directory='/location/to/task/sandbox/{}'.format(task_id),
+                                   telemetry_interval_secs=0.5)
+        self.manage_task_runner('sleep 1.75; echo done', assertions, task_id=task_id, config=config)
+
     def test_manage_task_empty_command(self):
         def assertions(driver, task_id, sandbox_directory, mesos_directory):
             expected_statuses = [{'task_id': {'value': task_id},
@@ -559,6 +745,35 @@ class ExecutorTest(unittest.TestCase):
         command = 'sleep 100'
         self.run_command_in_manage_task_runner(command, assertions, 2)
 
+    @unittest.skipIf(ccg.find_cgroup_directory() is None, 'requires cgroup v2')
+    def test_manage_task_terminated_in_cgroup(self):
+        task_id = tu.get_random_task_id()
+        cgroup_path = os.path.join(ccg.find_cgroup_directory(), 'cook-{}'.format(task_id))
+        if ccg.TaskCgroup.create(task_id) is None:
+            self.skipTest('requires a delegated cgroup v2')
+
+        def assertions(driver, task_id, sandbox_directory, mesos_directory):
+            expected_statuses = [{'task_id': {'value': task_id}, 'state': cook.TASK_STARTING},
+                                 {'task_id': {'value': task_id}, 'state': cook.TASK_RUNNING},
+                                 {'task_id': {'value': task_id}, 'state': cook.TASK_KILLED}]
+            tu.assert_statuses(self, expected_statuses, driver.statuses)
+
+            expected_message_0 = {'sandbox-directory': mesos_directory, 'task-id': task_id, 'type': 'directory'}
+            expected_message_1 = {'exit-code': -15, 'task-id': task_id}
+            tu.assert_messages(self, [expected_message_0, expected_message_1], [], driver.messages)
+
+            # the cgroup can only be removed once the daemon that left the task's session has been killed too
+            self.assertFalse(os.path.exists(cgroup_path))
+
+        stop_signal = Event()
+        sleep_and_set_stop_signal_task(stop_signal, 2)
+        config = cc.ExecutorConfig(cgroup_kill=True,
+                                   mesos_directory='/mesos/directory/{}'.format(task_id),
+                                   progress_output_name='stdout.{}'.format(task_id),
+                                   sandbox_directory='/location/to/task/sandbox/{}'.format(task_id))
+        self.manage_task_runner('(setsid sleep 100 &) ; sleep 100', assertions, stop_signal=stop_signal,
+                                task_id=task_id, config=config)
+
     # FIXME - remove the xfail mark once the issue with this test crashing is resolved:
     # https://github.com/twosigma/Cook/issues/856
     @pytest.mark.xfail
@@ -737,18 +952,28 @@ class ExecutorTest(unittest.TestCase):
         stderr_name = tu.ensure_directory('build/stderr.{}'.format(task_id))
         stdout_name = tu.ensure_directory('build/stdout.{}'.format(task_id))
 
-        config = tu.FakeExecutorConfig({'max_bytes_read_per_line': 1024,
+        config = tu.FakeExecutorConfig({'capture_output': False,
+                                        'cgroup_kill': False,
+                                        'checkpoint': False,
+                                        'idle_timeout_secs': 0,
+                                        'max_bytes_read_per_line': 1024,
                                         'max_message_length': max_message_length,
                                         'mesos_directory': '/mesos/directory/for/{}'.format(task_id),
+                                        'metric_patterns': {},
+                                        'progress_additional_files': [],
+                                        'progress_channel': 'file',
                                         'progress_output_env_variable': 'DEFAULT_PROGRESS_FILE_ENV_VARIABLE',
                                         'progress_output_name': progress_name,
                                         'progress_regex_string': '\^\^\^\^JOB-PROGRESS:\s+([0-9]*\.?[0-9]+)($|\s+.*)',
                                         'progress_sample_interval_ms': 10,
+                                        'progress_start_mode': 'offset',
+                                        'progress_watch_mode': 'inotify',
                                         'reset_vars': [],
                                         'sandbox_directory': '/sandbox/directory/for/{}'.format(task_id),
                                         'shutdown_grace_period_ms': 60000,
                                         'stderr_file': stderr_name,
-                                        'stdout_file': stdout_name})
+                                        'stdout_file': stdout_name,
+                                        'telemetry_interval_secs': 0})
 
         command = 'echo "Hello World"; ' \
                   'echo "^^^^JOB-PROGRESS: 50 Fifty percent in progress file" >> {}; ' \
@@ -768,6 +993,305 @@ class ExecutorTest(unittest.TestCase):
         finally:
             tu.cleanup_file(progress_name)
 
+    def test_manage_task_progress_in_captured_stderr_and_stdout(self):
+        def assertions(driver, task_id, sandbox_directory, mesos_directory):
+            expected_statuses = [{'task_id': {'value': task_id}, 'state': cook.TASK_STARTING},
+                                 {'task_id': {'value': task_id}, 'state': cook.TASK_RUNNING},
+                                 {'task_id': {'value': task_id}, 'state': cook.TASK_FINISHED}]
+            tu.assert_statuses(self, expected_statuses, driver.statuses)
+
+            expected_core_messages = [{'sandbox-directory': mesos_directory, 'task-id': task_id, 'type': 'directory'},
+                                      {'exit-code': 0, 'task-id': task_id}]
+            expected_progress_messages = [{'progress-message': 'Fifty percent in progress file',
+                                           'progress-percent': 50, 'progress-sequence': 1, 'task-id': task_id},
+                                          {'progress-message': 'Fifty-five percent in stdout',
+                                           'progress-percent': 55, 'progress-sequence': 2, 'task-id': task_id},
+                                          {'progress-message': 'Sixty percent in stderr',
+                                           'progress-percent': 60, 'progress-sequence': 3, 'task-id': task_id}]
+            tu.assert_messages(self, expected_core_messages, expected_progress_messages, driver.messages)
+
+            # the captured output is still copied to the executor's stdout and stderr
+            with open(stdout_name) as f:
+                stdout_contents = f.read()
+                self.assertTrue('Hello World\n' in stdout_contents)
+                self.assertTrue('^^^^JOB-PROGRESS: 55 Fifty-five percent in stdout\n' in stdout_contents)
+                self.assertTrue('Exiting...\n' in stdout_contents)
+            with open(stderr_name) as f:
+                stderr_contents = f.read()
+                self.assertTrue('^^^^JOB-PROGRESS: 60 Sixty percent in stderr\n' in stderr_contents)
+
+        stop_signal = Event()
+        sleep_and_set_stop_signal_task(stop_signal, 60)
+
+        task_id = tu.get_random_task_id()
+        progress_name = tu.ensure_directory('build/progress.{}'.format(task_id))
+        stderr_name = tu.ensure_directory('build/stderr.{}'.format(task_id))
+        stdout_name = tu.ensure_directory('build/stdout.{}'.format(task_id))
+
+        config = tu.FakeExecutorConfig({'capture_output': True,
+                                        'cgroup_kill': False,
+                                        'checkpoint': False,
+                                        'idle_timeout_secs': 0,
+                                        'max_bytes_read_per_line': 1024,
+                                        'max_message_length': 35,
+                                        'mesos_directory': '/mesos/directory/for/{}'.format(task_id),
+                                        'metric_patterns': {},
+                                        'output_roll_bytes': 0,
+                                        'progress_additional_files': [],
+                                        'progress_channel': 'file',
+                                        'progress_output_env_variable': 'DEFAULT_PROGRESS_FILE_ENV_VARIABLE',
+                                        'progress_output_name': progress_name,
+                                        'progress_regex_string': '\^\^\^\^JOB-PROGRESS:\s+([0-9]*\.?[0-9]+)($|\s+.*)',
+                                        'progress_sample_interval_ms': 10,
+                                        'progress_start_mode': 'offset',
+                                        'progress_watch_mode': 'inotify',
+                                        'reset_vars': [],
+                                        'sandbox_directory': '/sandbox/directory/for/{}'.format(task_id),
+                                        'shutdown_grace_period_ms': 60000,
+                                        'stderr_file': stderr_name,
+                                        'stdout_file': stdout_name,
+                                        'telemetry_interval_secs': 0})
+
+        command = 'echo "Hello World"; ' \
+                  'echo "^^^^JOB-PROGRESS: 50 Fifty percent in progress file" >> {}; ' \
+                  'sleep 0.25; ' \
+                  'echo "^^^^JOB-PROGRESS: 55 Fifty-five percent in stdout"; ' \
+                  'sleep 0.25; ' \
+                  'echo "^^^^JOB-PROGRESS: 60 Sixty percent in stderr" >&2; ' \
+                  'sleep 0.25; ' \
+                  'echo "Exiting..."; ' \
+                  'exit 0'.format(progress_name)
+
+        try:
+            self.manage_task_runner(command, assertions, stop_signal=stop_signal, task_id=task_id, config=config)
+            stop_signal.set()
+        finally:
+            tu.cleanup_file(progress_name)
+
+    def test_manage_task_progress_channel(self):
+        def assertions(driver, task_id, sandbox_directory, mesos_directory):
+            expected_statuses = [{'task_id': {'value': task_id}, 'state': cook.TASK_STARTING},
+                                 {'task_id': {'value': task_id}, 'state': cook.TASK_RUNNING},
+                                 {'task_id': {'value': task_id}, 'state': cook.TASK_FINISHED}]
+            tu.assert_statuses(self, expected_statuses, driver.statuses)
+
+            expected_core_messages = [{'sandbox-directory': mesos_directory, 'task-id': task_id, 'type': 'directory'},
+                                      {'exit-code': 0, 'task-id': task_id}]
+            expected_progress_messages = [{'progress-fields': {'stage': 1}, 'progress-message': 'Fifty percent',
+                                           'progress-percent': 50, 'progress-sequence': 1, 'task-id': task_id},
+                                          {'progress-message': 'Sixty percent in stdout',
+                                           'progress-percent': 60, 'progress-sequence': 2, 'task-id': task_id},
+                                          {'progress-fields': {'stage': 2}, 'progress-message': 'Seventy percent',
+                                           'progress-percent': 70, 'progress-sequence': 3, 'task-id': task_id}]
+            tu.assert_messages(self, expected_core_messages, expected_progress_messages, driver.messages)
+
+            # the channel is removed once the task has completed
+            self.assertFalse(os.path.exists(progress_name))
+
+        stop_signal = Event()
+        sleep_and_set_stop_signal_task(stop_signal, 60)
+
+        task_id = tu.get_random_task_id()
+        progress_name = tu.ensure_directory('build/progress.{}'.format(task_id))
+        stderr_name = tu.ensure_directory('build/stderr.{}'.format(task_id))
+        stdout_name = tu.ensure_directory('build/stdout.{}'.format(task_id))
+
+        config = tu.FakeExecutorConfig({'capture_output': True,
+                                        'cgroup_kill': False,
+                                        'checkpoint': False,
+                                        'idle_timeout_secs': 0,
+                                        'max_bytes_read_per_line': 1024,
+                                        'max_message_length': 35,
+                                        'mesos_directory': '/mesos/directory/for/{}'.format(task_id),
+                                        'metric_patterns': {},
+                                        'output_roll_bytes': 0,
+                                        'progress_additional_files': [],
+                                        'progress_channel': 'fifo',
+                                        'progress_output_env_variable': 'DEFAULT_PROGRESS_FILE_ENV_VARIABLE',
+                                        'progress_output_name': progress_name,
+                                        'progress_regex_string': '\^\^\^\^JOB-PROGRESS:\s+([0-9]*\.?[0-9]+)($|\s+.*)',
+                                        'progress_sample_interval_ms': 10,
+                                        'progress_start_mode': 'offset',
+                                        'progress_watch_mode': 'inotify',
+                                        'reset_vars': [],
+                                        'sandbox_directory': '/sandbox/directory/for/{}'.format(task_id),
+                                        'shutdown_grace_period_ms': 60000,
+                                        'stderr_file': stderr_name,
+                                        'stdout_file': stdout_name,
+                                        'telemetry_interval_secs': 0})
+
+        command = 'test -p $DEFAULT_PROGRESS_FILE_ENV_VARIABLE || exit 1; ' \
+                  'echo \'{{"percent": 50, "message": "Fifty percent", "stage": 1}}\' > {0}; ' \
+                  'sleep 0.25; ' \
+                  'echo "^^^^JOB-PROGRESS: 60 Sixty percent in stdout"; ' \
+                  'sleep 0.25; ' \
+                  'echo \'{{"percent": 70, "message": "Seventy percent", "stage": 2}}\' > {0}; ' \
+                  'sleep 0.25; ' \
+                  'exit 0'.format(progress_name)
+
+        try:
+            self.manage_task_runner(command, assertions, stop_signal=stop_signal, task_id=task_id, config=config)
+            stop_signal.set()
+        finally:
+            tu.cleanup_file(progress_name)
+
+    def test_manage_task_metrics(self):
+        def assertions(driver, task_id, sandbox_directory, mesos_directory):
+            expected_statuses = [{'task_id': {'value': task_id}, 'state': cook.TASK_STARTING},
+                                 {'task_id': {'value': task_id}, 'state': cook.TASK_RUNNING},
+                                 {'task_id': {'value': task_id}, 'state': cook.TASK_FINISHED}]
+            tu.assert_statuses(self, expected_statuses, driver.statuses)
+
+            # the aggregated metrics are sent in their own messages, the last one holds all the values
+            metrics_messages = [m for m in driver.messages if 'metrics' in tu.parse_message(m)]
+            self.assertEqual({'metrics': {'loss': {'count': 2, 'last': 0.25, 'max': 0.5, 'min': 0.25, 'sum': 0.75},
+                                          'rows': {'count': 3, 'last': 30, 'max': 30, 'min': 10, 'sum': 60}},
+                              'metrics-sequence': 5, 'task-id': task_id},
+                             tu.parse_message(metrics_messages[-1]))
+
+            expected_core_messages = [{'sandbox-directory': mesos_directory, 'task-id': task_id, 'type': 'directory'},
+                                      {'exit-code': 0, 'task-id': task_id}]
+            expected_progress_messages = [{'progress-message': 'half way', 'progress-percent': 50,
+                                           'progress-sequence': 1, 'task-id': task_id}]
+            tu.assert_messages(self, expected_core_messages, expected_progress_messages,
+                               [m for m in driver.messages if m not in metrics_messages])
+
+        stop_signal = Event()
+        sleep_and_set_stop_signal_task(stop_signal, 60)
+
+        task_id = tu.get_random_task_id()
+        stderr_name = tu.ensure_directory('build/stderr.{}'.format(task_id))
+        stdout_name = tu.ensure_directory('build/stdout.{}'.format(task_id))
+
+        config = tu.FakeExecutorConfig({'capture_output': True,
+                                        'cgroup_kill': False,
+                                        'checkpoint': False,
+                                        'idle_timeout_secs': 0,
+                                        'max_bytes_read_per_line': 1024,
+                                        'max_message_length': 300,
+                                        'mesos_directory': '/mesos/directory/for/{}'.format(task_id),
+                                        'metric_patterns': {'loss': 'loss=([0-9.]+)', 'rows': 'rows: ([0-9]+)'},
+                                        'output_roll_bytes': 0,
+                                        'progress_additional_files': [],
+                                        'progress_channel': 'file',
+                                        'progress_output_env_variable': 'DEFAULT_PROGRESS_FILE_ENV_VARIABLE',
+                                        'progress_output_name': 'build/progress.{}'.format(task_id),
+                                        'progress_regex_string': 'progress: ([0-9]*\.?[0-9]+), (.*)',
+                                        'progress_sample_interval_ms': 10,
+                                        'progress_start_mode': 'offset',
+                                        'progress_watch_mode': 'inotify',
+                                        'reset_vars': [],
+                                        'sandbox_directory': '/sandbox/directory/for/{}'.format(task_id),
+                                        'shutdown_grace_period_ms': 60000,
+                                        'stderr_file': stderr_name,
+                                        'stdout_file': stdout_name,
+                                        'telemetry_interval_secs': 0})
+
+        command = 'echo "rows: 10"; echo "rows: 20 loss=0.5" >&2; sleep 0.25; ' \
+                  'echo "progress: 50, half way"; sleep 0.25; ' \
+                  'echo "rows: 30"; echo "loss=0.25"'
+        self.manage_task_runner(command, assertions, stop_signal=stop_signal, task_id=task_id, config=config)
+        stop_signal.set()
+
+    def test_manage_task_rolls_captured_output(self):
+        task_id = tu.get_random_task_id()
+        stderr_name = tu.ensure_directory('build/stderr.{}'.format(task_id))
+        stdout_name = tu.ensure_directory('build/stdout.{}'.format(task_id))
+
+        def assertions(driver, task_id, sandbox_directory, mesos_directory):
+            expected_statuses = [{'task_id': {'value': task_id}, 'state': cook.TASK_STARTING},
+                                 {'task_id': {'value': task_id}, 'state': cook.TASK_RUNNING},
+                                 {'task_id': {'value': task_id}, 'state': cook.TASK_FINISHED}]
+            tu.assert_statuses(self, expected_statuses, driver.statuses)
+            progress_messages = [m for m in map(tu.parse_message, driver.messages) if 'progress-sequence' in m]
+            self.assertEqual({'progress-message': 'done', 'progress-percent': 100, 'task-id': task_id},
+                             {k: v for k, v in progress_messages[-1].items() if k != 'progress-sequence'})
+
+            # the rolled segments are compressed, the newest segment is left in place uncompressed
+            segment_names = sorted(glob.glob('{}.*.gz'.format(stdout_name)),
+                                   key=lambda name: int(name.split('.')[-2]))
+            self.assertGreater(len(segment_names), 1)
+            stdout_contents = b''
+            for segment_name in segment_names:
+                with gzip.open(segment_name, 'rb') as f:
+                    stdout_contents += f.read()
+            with open(stdout_name, 'rb') as f:
+                stdout_contents += f.read()
+            for i in range(1, 201):
+                self.assertIn('line {} of the task output\n'.format(i).encode(), stdout_contents)
+            self.assertIn(b'progress: 100, done\n', stdout_contents)
+
+        config = tu.FakeExecutorConfig({'capture_output': True,
+                                        'cgroup_kill': False,
+                                        'checkpoint': False,
+                                        'idle_timeout_secs': 0,
+                                        'max_bytes_read_per_line': 1024,
+                                        'max_message_length': 300,
+                                        'mesos_directory': '/mesos/directory/for/{}'.format(task_id),
+                                        'metric_patterns': {},
+                                        'output_compression': 'gzip',
+                                        'output_max_total_bytes': 0,
+                                        'output_roll_bytes': 1024,
+                                        'progress_additional_files': [],
+                                        'progress_channel': 'file',
+                                        'progress_output_env_variable': 'DEFAULT_PROGRESS_FILE_ENV_VARIABLE',
+                                        'progress_output_name': 'build/progress.{}'.format(task_id),
+                                        'progress_regex_string': 'progress: ([0-9]*\.?[0-9]+), (.*)',
+                                        'progress_sample_interval_ms': 10,
+                                        'progress_start_mode': 'offset',
+                                        'progress_watch_mode': 'inotify',
+                                        'reset_vars': [],
+                                        'sandbox_directory': '/sandbox/directory/for/{}'.format(task_id),
+                                        'shutdown_grace_period_ms': 60000,
+                                        'stderr_file': stderr_name,
+                                        'stdout_file': stdout_name,
+                                        'telemetry_interval_secs': 0})
+
+        command = 'for i in `seq 200`; do echo "line $i of the task output"; ' \
+                  'if [ $((i % 50)) -eq 0 ]; then sleep 0.1; fi; done; ' \
+                  'echo "progress: 100, done"'
+        try:
+            self.manage_task_runner(command, assertions, task_id=task_id, config=config)
+        finally:
+            for segment_name in glob.glob('{}.*'.format(stdout_name)) + glob.glob('{}.*'.format(stderr_name)):
+                tu.cleanup_file(segment_name)
+
+    def exit_to_finished_latency_helper(self):
+        """Returns the seconds between the exit of a task and the TASK_FINISHED status sent by manage_task."""
+        task_id = tu.get_random_task_id()
+        exit_time_name = tu.ensure_directory('build/exit_time.{}'.format(task_id))
+        finished_status = {}
+
+        def assertions(driver, task_id, sandbox_directory, mesos_directory):
+            finished_status.update(driver.statuses[-1])
+            expected_statuses = [{'task_id': {'value': task_id}, 'state': cook.TASK_STARTING},
+                                 {'task_id': {'value': task_id}, 'state': cook.TASK_RUNNING},
+                                 {'task_id': {'value': task_id}, 'state': cook.TASK_FINISHED}]
+            tu.assert_statuses(self, expected_statuses, driver.statuses)
+
+        # the time is recorded by the last command of the task, just before it exits
+        command = 'sleep 0.2; exec python3 -c "import time; print(time.time(), file=open(\'{}\', \'w\'))"'.format(
+            exit_time_name)
+        try:
+            self.manage_task_runner(command, assertions, task_id=task_id)
+            with open(exit_time_name) as f:
+                exit_time = float(f.read())
+            return finished_status['timestamp'] - exit_time
+        finally:
+            tu.cleanup_file(exit_time_name)
+
+    @unittest.skipUnless(hasattr(os, 'pidfd_open'), 'requires pidfd support')
+    def test_manage_task_exit_to_finished_latency_pidfd(self):
+        latency_secs = min(self.exit_to_finished_latency_helper() for _ in range(3))
+        logging.info('Task exit to TASK_FINISHED latency with pidfd: {:.1f} ms'.format(latency_secs * 1000))
+        self.assertLess(latency_secs, 0.5)
+
+    def test_manage_task_exit_to_finished_latency_without_pidfd(self):
+        with patch('cook.subprocess.open_pidfd', return_value=None):
+            latency_secs = min(self.exit_to_finished_latency_helper() for _ in range(3))
+        logging.info('Task exit to TASK_FINISHED latency without pidfd: {:.1f} ms'.format(latency_secs * 1000))
+        self.assertLess(latency_secs, 0.5)
+
     def test_executor_launch_task(self):
 
         task_id = tu.get_random_task_id()
@@ -812,6 +1336,77 @@ class ExecutorTest(unittest.TestCase):
             tu.cleanup_output(stdout_name, stderr_name)
             tu.cleanup_file(output_name)
 
+    def test_executor_multiple_tasks(self):
+        task_ids = [tu.get_random_task_id() for _ in range(3)]
+        stdout_name = tu.ensure_directory('build/stdout.{}'.format(task_ids[0]))
+        stderr_name = tu.ensure_directory('build/stderr.{}'.format(task_ids[0]))
+        progress_name = tu.ensure_directory('build/progress.{}'.format(task_ids[0]))
+
+        tu.redirect_stdout_to_file(stdout_name)
+        tu.redirect_stderr_to_file(stderr_name)
+
+        def make_task(task_id, command):
+            return {'task_id': {'value': task_id},
+                    'data': pm.encode_data(json.dumps({'command': command}).encode('utf8'))}
+
+        def task_statuses(driver, task_id):
+            return [s['state'] for s in driver.statuses if s['task_id']['value'] == task_id]
+
+        def progress_messages(driver):
+            messages = [tu.parse_message(m) for m in driver.messages]
+            return {m['task-id']: m['progress-message'] for m in messages if 'progress-message' in m}
+
+        def write_progress(progress):
+            return 'echo "progress: {}" >> $EXECUTOR_PROGRESS_OUTPUT_FILE'.format(progress)
+
+        try:
+            config = cc.ExecutorConfig(idle_timeout_secs=2,
+                                       progress_output_name=progress_name,
+                                       progress_regex_string='progress: ([0-9]*\\.?[0-9]+), (.*)',
+                                       progress_sample_interval_ms=10)
+            stop_signal = Event()
+            executor = ce.CookExecutor(stop_signal, config)
+            driver = tu.FakeMesosExecutorDriver()
+
+            # two concurrent tasks, the kill only targets the first one
+            executor.launchTask(driver, make_task(task_ids[0], '{}; sleep 100'.format(write_progress('10, zeroth'))))
+            executor.launchTask(driver, make_task(task_ids[1], 'sleep 2; {}'.format(write_progress('25, first'))))
+            tu.wait_for(lambda: progress_messages(driver), lambda p: task_ids[0] in p, default_value={})
+            executor.killTask(driver, {'value': task_ids[0]})
+            finished_states = [cook.TASK_FINISHED, cook.TASK_KILLED]
+            tu.wait_for(lambda: [task_statuses(driver, t)[-1] for t in task_ids[:2]],
+                        lambda states: all(state in finished_states for state in states), default_value=[],
+                        max_delay_ms=10000)
+            self.assertEqual([cook.TASK_STARTING, cook.TASK_RUNNING, cook.TASK_KILLED],
+                             task_statuses(driver, task_ids[0]))
+            self.assertEqual([cook.TASK_STARTING, cook.TASK_RUNNING, cook.TASK_FINISHED],
+                             task_statuses(driver, task_ids[1]))
+            self.assertFalse(stop_signal.isSet())
+
+            # a task launched within the idle timeout runs in the same executor
+            self.assertFalse(executor.completed_signal.isSet())
+            executor.launchTask(driver, make_task(task_ids[2], write_progress('50, third')))
+            executor.await_completion()
+            self.assertEqual([cook.TASK_STARTING, cook.TASK_RUNNING, cook.TASK_FINISHED],
+                             task_statuses(driver, task_ids[2]))
+
+            # every task writes to its own progress file, the progress of a task is not reported for the others
+            self.assertEqual({task_ids[0]: 'zeroth', task_ids[1]: 'first', task_ids[2]: 'third'},
+                             progress_messages(driver))
+            messages = [tu.parse_message(m) for m in driver.messages]
+            for task_id in task_ids:
+                self.assertTrue(os.path.isfile('{}.{}'.format(progress_name, task_id)))
+            exit_codes = {m['task-id']: m['exit-code'] for m in messages if 'exit-code' in m}
+            self.assertEqual({task_ids[0]: -15, task_ids[1]: 0, task_ids[2]: 0}, exit_codes)
+
+            # no task is launched once the executor has completed
+            executor.launchTask(driver, make_task(tu.get_random_task_id(), 'exit 0'))
+            self.assertEqual(cook.TASK_FAILED, driver.statuses[-1]['state'])
+        finally:
+            tu.cleanup_output(stdout_name, stderr_name)
+            for task_id in task_ids:
+                tu.cleanup_file('{}.{}'.format(progress_name, task_id))
+
     def test_executor_launch_task_and_disconnect_no_checkpointing(self):
 
         task_id = tu.get_random_task_id()
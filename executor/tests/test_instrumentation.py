@@ -0,0 +1,125 @@
+import json
+import os
+import pstats
+import time
+import tracemalloc
+import unittest
+from threading import Thread
+
+import cook.instrumentation as cins
+import tests.utils as tu
+
+
+class InstrumentationTest(unittest.TestCase):
+    def test_counters_and_timers(self):
+        instrumentation = cins.Instrumentation()
+        instrumentation.increment('progress.bytes-read.stdout', 100)
+        instrumentation.increment('progress.bytes-read.stdout', 50)
+        instrumentation.increment('progress.messages-sent')
+        instrumentation.set_gauge('sender.queue-depth', 3)
+        instrumentation.set_gauge('sender.queue-depth', 1)
+        instrumentation.record_time('driver.send-status-update', 0.25)
+        instrumentation.record_time('driver.send-status-update', 0.75)
+        with instrumentation.timer('subprocess.signal-process-tree'):
+            time.sleep(0.01)
+
+        snapshot = instrumentation.snapshot()
+        self.assertEqual({'progress.bytes-read.stdout': 150, 'progress.messages-sent': 1}, snapshot['counters'])
+        self.assertEqual({'sender.queue-depth': {'max': 3, 'value': 1}}, snapshot['gauges'])
+        self.assertEqual({'count': 2, 'max-secs': 0.75, 'mean-secs': 0.5, 'total-secs': 1.0},
+                         snapshot['timers']['driver.send-status-update'])
+        self.assertEqual(1, snapshot['timers']['subprocess.signal-process-tree']['count'])
+        self.assertGreaterEqual(snapshot['timers']['subprocess.signal-process-tree']['max-secs'], 0.01)
+        self.assertGreaterEqual(snapshot['uptime-secs'], 0)
+
+    def test_counters_are_thread_safe(self):
+        instrumentation = cins.Instrumentation()
+
+        def increment_counter():
+            for _ in range(10000):
+                instrumentation.increment('counter')
+
+        threads = [Thread(target=increment_counter) for _ in range(4)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        self.assertEqual(40000, instrumentation.snapshot()['counters']['counter'])
+
+    def test_timed(self):
+        @cins.timed('test.timed-function')
+        def timed_function(value):
+            return value * 2
+
+        cins.set_timers_enabled(True)
+        try:
+            self.assertEqual(4, timed_function(2))
+            self.assertEqual(6, timed_function(3))
+        finally:
+            cins.set_timers_enabled(False)
+        self.assertEqual('timed_function', timed_function.__name__)
+        self.assertGreaterEqual(cins.snapshot()['timers']['test.timed-function']['count'], 2)
+
+    def test_disabled_timers(self):
+        instrumentation = cins.Instrumentation(timers_enabled=False)
+        instrumentation.increment('progress.messages-sent')
+        with instrumentation.timer('progress.scan'):
+            pass
+        self.assertIs(cins.NULL_TIMER, instrumentation.timer('progress.scan'))
+
+        snapshot = instrumentation.snapshot()
+        self.assertEqual({'progress.messages-sent': 1}, snapshot['counters'])
+        self.assertEqual({}, snapshot['timers'])
+
+        @cins.timed('test.disabled-timed-function')
+        def timed_function(value):
+            return value * 2
+
+        self.assertEqual(4, timed_function(2))
+        self.assertNotIn('test.disabled-timed-function', cins.snapshot()['timers'])
+
+    def test_write_snapshot(self):
+        snapshot_path = tu.ensure_directory('build/instrumentation.{}.json'.format(tu.get_random_task_id()))
+        try:
+            cins.increment('test.written-counter', 7)
+            cins.write_snapshot(snapshot_path)
+            with open(snapshot_path) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            self.assertEqual(7, snapshot['counters']['test.written-counter'])
+            self.assertFalse(os.path.exists('{}.tmp'.format(snapshot_path)))
+        finally:
+            tu.cleanup_file(snapshot_path)
+
+    def test_profile_capture(self):
+        directory = os.path.abspath(tu.ensure_directory('build/profile.{}/'.format(tu.get_random_task_id())))
+        os.makedirs(directory, exist_ok=True)
+        profile_capture = cins.ProfileCapture()
+
+        def busy_function():
+            return sum(range(10000))
+
+        self.assertTrue(profile_capture.toggle(directory))
+        self.assertTrue(tracemalloc.is_tracing())
+        profile_capture.profile_thread('test')
+        busy_function()
+        data = [bytearray(1024) for _ in range(100)]
+        self.assertFalse(profile_capture.toggle(directory))
+        self.assertFalse(tracemalloc.is_tracing())
+        profile_capture.profile_thread('test')
+
+        self.assertEqual(['executor-profile-1-test.pstats', 'executor-tracemalloc-1.snapshot'],
+                         sorted(os.listdir(directory)))
+        profile_stats = pstats.Stats(os.path.join(directory, 'executor-profile-1-test.pstats'))
+        self.assertIn('busy_function', [function_name for _, _, function_name in profile_stats.stats])
+        snapshot = tracemalloc.Snapshot.load(os.path.join(directory, 'executor-tracemalloc-1.snapshot'))
+        self.assertGreater(len(snapshot.traces), 0)
+        self.assertEqual(100, len(data))
+
+        # a thread exiting during a capture writes its profile
+        self.assertTrue(profile_capture.toggle(directory))
+        profile_capture.profile_thread('test')
+        profile_capture.profile_thread('test', exiting=True)
+        self.assertTrue(os.path.exists(os.path.join(directory, 'executor-profile-2-test.pstats')))
+        self.assertFalse(profile_capture.toggle(directory))
+
+        for file_name in os.listdir(directory):
+            tu.cleanup_file(os.path.join(directory, file_name))
+        os.rmdir(directory)
@@ -0,0 +1,52 @@
+import asyncio
+import time
+import unittest
+from threading import Event, Timer
+
+import cook.loop as cl
+
+
+class LoopTest(unittest.TestCase):
+    def test_loop_event_wait_async(self):
+        executor_loop = cl.get_executor_loop()
+        event = cl.LoopEvent()
+
+        self.assertFalse(executor_loop.run(event.wait_async(timeout_secs=0.1)))
+
+        timer = Timer(0.1, event.set)
+        timer.start()
+        start_time = time.perf_counter()
+        self.assertTrue(executor_loop.run(event.wait_async(timeout_secs=5)))
+        self.assertLess(time.perf_counter() - start_time, 1)
+        self.assertEqual(set(), event.waiters)
+
+        # a set event is also a threading.Event
+        self.assertTrue(event.isSet())
+        self.assertTrue(event.wait(timeout=0))
+        self.assertTrue(executor_loop.run(event.wait_async()))
+
+    def test_wait_event_plain_event(self):
+        executor_loop = cl.get_executor_loop()
+        event = Event()
+
+        self.assertFalse(executor_loop.run(cl.wait_event(event, timeout_secs=0.1)))
+        timer = Timer(0.1, event.set)
+        timer.start()
+        self.assertTrue(executor_loop.run(cl.wait_event(event, timeout_secs=5)))
+
+    def test_wait_event_many_waiters_on_one_loop(self):
+        executor_loop = cl.get_executor_loop()
+        event = cl.LoopEvent()
+
+        async def wait_for_all():
+            return await asyncio.gather(*[event.wait_async(timeout_secs=5) for _ in range(100)])
+
+        future = executor_loop.submit(wait_for_all())
+        time.sleep(0.1)
+        self.assertFalse(future.done())
+        event.set()
+        self.assertEqual([True] * 100, future.result(timeout=5))
+
+    def test_get_executor_loop_is_shared(self):
+        self.assertIs(cl.get_executor_loop(), cl.get_executor_loop())
+        self.assertTrue(cl.get_executor_loop().thread.is_alive())
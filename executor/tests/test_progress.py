@@ -1,12 +1,20 @@
 import errno
+import io
 import json
 import logging
 import math
+import os
+import socket
+import threading
 import time
 import unittest
 from threading import Event, Thread
 
+import cook.channel as cch
 import cook.executor as ce
+import cook.inotify as ci
+import cook.instrumentation as cins
+import cook.io_helper as cio
 import cook.progress as cp
 import tests.utils as tu
 
@@ -241,6 +249,129 @@ class ProgressTest(unittest.TestCase):
         finally:
             tu.cleanup_file(file_name)
 
+    def test_watcher_scan_last_match(self):
+        file_name = tu.ensure_directory('build/tail_progress_test.{}'.format(tu.get_random_task_id()))
+        regex = 'progress: ([0-9]*\.?[0-9]+), (.*)'
+        counter = cp.ProgressSequenceCounter()
+        completed = Event()
+        watcher = cp.ProgressWatcher(file_name, 'test', counter, 1024, regex, Event(), completed, Event(),
+                                     start_offset=10, scan_last_match=True)
+
+        try:
+            with open(file_name, 'wb') as f:
+                f.write(b'progress: 10, earlier attempt\n' + b'noise\n' * 1000000 +
+                        b'progress: 40, latest\n' + b'noise\n' * 100 + b'progress: 45, partia')
+            file_size = os.path.getsize(file_name)
+            progress_states = watcher.progress_states(watcher.tail_lines(candidates_only=True))
+
+            # the latest progress is found scanning backwards from the end, the earlier progress is never reported
+            self.assertEqual({'progress-message': b'latest', 'progress-percent': 40, 'progress-sequence': 1},
+                             next(progress_states))
+            self.assertEqual(file_size - len(b'progress: 45, partia'), watcher.offset)
+
+            # the lines after the last complete line are tailed
+            with open(file_name, 'ab') as f:
+                f.write(b'l\nprogress: 50, tailed\n')
+            self.assertEqual({'progress-message': b'partial', 'progress-percent': 45, 'progress-sequence': 2},
+                             next(progress_states))
+            self.assertEqual({'progress-message': b'tailed', 'progress-percent': 50, 'progress-sequence': 3},
+                             next(progress_states))
+            completed.set()
+            self.assertEqual([], list(progress_states))
+        finally:
+            tu.cleanup_file(file_name)
+
+    def idle_tail_helper(self, watch_mode, idle_secs):
+        """Tails an idle file for idle_secs and then measures the latency of reading a newly written line.
+        Returns the (wait_count, latency_secs) tuple."""
+        file_name = tu.ensure_directory('build/tail_progress_test.' + tu.get_random_task_id())
+        stop = Event()
+        completed = Event()
+        termination = Event()
+        tail_sleep_ms = 50
+        line_read = Event()
+        collected_data = []
+
+        try:
+            open(file_name, 'w+').close()
+            counter = cp.ProgressSequenceCounter()
+            watcher = cp.ProgressWatcher(file_name, 'test', counter, 1024, '', stop, completed, termination,
+                                         watch_mode=watch_mode)
+
+            def tail_file():
+                for line in watcher.tail(tail_sleep_ms):
+                    collected_data.append(line.strip())
+                    line_read.set()
+
+            tail_thread = Thread(target=tail_file, args=())
+            tail_thread.daemon = True
+            tail_thread.start()
+            tu.wait_for(lambda: watcher.waiter, lambda waiter: waiter is not None)
+            waiter = watcher.waiter
+
+            time.sleep(idle_secs)
+            wait_count = waiter.wait_count
+
+            with open(file_name, 'a') as file:
+                write_time = time.time()
+                file.write('line-0\n')
+            line_read.wait(1)
+            latency_secs = time.time() - write_time
+
+            completed.set()
+            watcher.wake()
+            tail_thread.join(1)
+            self.assertFalse(tail_thread.is_alive())
+            self.assertEqual([b'line-0'], collected_data)
+            return wait_count, latency_secs
+        finally:
+            completed.set()
+            tu.cleanup_file(file_name)
+
+    @unittest.skipUnless(ci.is_supported(), 'inotify is not supported')
+    def test_watcher_tail_inotify_idle_wakeups_and_latency(self):
+        idle_secs = 1.0
+        poll_wait_count, poll_latency_secs = self.idle_tail_helper(cp.WATCH_MODE_POLL, idle_secs)
+        inotify_wait_count, inotify_latency_secs = self.idle_tail_helper(cp.WATCH_MODE_INOTIFY, idle_secs)
+        logging.info('Idle wakeups: poll={} inotify={}'.format(poll_wait_count, inotify_wait_count))
+        logging.info('Latency secs: poll={} inotify={}'.format(poll_latency_secs, inotify_latency_secs))
+
+        # polling wakes up every 50 ms, inotify only wakes up once every INOTIFY_MAX_WAIT_MS while idle
+        self.assertGreaterEqual(poll_wait_count, 10)
+        self.assertLessEqual(inotify_wait_count, math.ceil(idle_secs * 1000 / cp.INOTIFY_MAX_WAIT_MS) + 1)
+        # inotify reports the new line without waiting for the next poll interval
+        self.assertLess(inotify_latency_secs, 0.05)
+
+    def test_watcher_tail_inotify_file_creation(self):
+        file_name = tu.ensure_directory('build/tail_progress_test.' + tu.get_random_task_id())
+        items_to_write = 5
+        stop = Event()
+        completed = Event()
+        termination = Event()
+
+        try:
+            def write_to_file():
+                time.sleep(0.1)
+                with open(file_name, 'w+') as file:
+                    for item in range(items_to_write):
+                        file.write('{}\n'.format(item))
+                        file.flush()
+                        time.sleep(0.05)
+                completed.set()
+
+            Thread(target=write_to_file, args=()).start()
+
+            counter = cp.ProgressSequenceCounter()
+            watcher = cp.ProgressWatcher(file_name, 'test', counter, 1024, '', stop, completed, termination,
+                                         watch_mode=cp.WATCH_MODE_INOTIFY)
+            collected_data = [line.strip() for line in watcher.tail(25)]
+
+            self.assertEqual(list(map(lambda x: str.encode(str(x)), range(items_to_write))), collected_data)
+            self.assertIsNone(watcher.waiter)
+        finally:
+            completed.set()
+            tu.cleanup_file(file_name)
+
     def test_collect_progress_updates_one_capture_group(self):
         file_name = tu.ensure_directory('build/collect_progress_test.' + tu.get_random_task_id())
         progress_regex = '\^\^\^\^JOB-PROGRESS:\s+([0-9]*\.?[0-9]+)$'
@@ -593,6 +724,422 @@ class ProgressTest(unittest.TestCase):
             completed.set()
             tu.cleanup_file(file_name)
 
+    def multiplexed_tracker_helper(self, watch_mode):
+        task_id = tu.get_random_task_id()
+        progress_name = tu.ensure_directory('build/progress.{}'.format(task_id))
+        stdout_name = tu.ensure_directory('build/stdout.{}'.format(task_id))
+        extra_name = tu.ensure_directory('build/extra.{}'.format(task_id))
+        progress_regex = '\^\^\^\^JOB-PROGRESS:\s+([0-9]*\.?[0-9]+)($|\s+.*)'
+        config = tu.FakeExecutorConfig({'max_bytes_read_per_line': 1024,
+                                        'progress_regex_string': progress_regex,
+                                        'progress_watch_mode': watch_mode})
+        stop = Event()
+        completed = Event()
+        termination = Event()
+        sent_messages = []
+        sender_threads = set()
+
+        def send_progress_message(message):
+            sent_messages.append(message)
+            sender_threads.add(threading.current_thread())
+            return True
+
+        counter = cp.ProgressSequenceCounter()
+        updater = cp.ProgressUpdater(task_id, 100, 0, send_progress_message)
+        tracker = cp.MultiplexedProgressTracker(config, stop, completed, counter, updater, termination,
+                                                tu.fake_os_error_handler)
+
+        def write_and_await(file_name, line, num_messages):
+            with open(file_name, 'a') as file:
+                file.write(line)
+            tu.wait_for(lambda: len(sent_messages), lambda n: n >= num_messages)
+
+        try:
+            tracker.add_location(progress_name, 'progress')
+            tracker.add_location(stdout_name, 'stdout')
+            tracker.start()
+
+            write_and_await(progress_name, 'Stage One complete\n^^^^JOB-PROGRESS: 25 progress file\n', 1)
+            write_and_await(stdout_name, '^^^^JOB-PROGRESS: 50 stdout\n', 2)
+
+            # locations registered after start are tracked by the same thread
+            tracker.add_location(extra_name, 'extra')
+            write_and_await(extra_name, '^^^^JOB-PROGRESS: 75 extra file\n', 3)
+            self.assertEqual(1, len(sender_threads))
+            self.assertNotIn(threading.main_thread(), sender_threads)
+
+            completed.set()
+            tracker.wake()
+            tracker.wait(timeout=5)
+            self.assertTrue(tracker.progress_complete_event.isSet())
+
+            expected_messages = [{'progress-message': 'progress file', 'progress-percent': 25,
+                                  'progress-sequence': 1, 'task-id': task_id},
+                                 {'progress-message': 'stdout', 'progress-percent': 50,
+                                  'progress-sequence': 2, 'task-id': task_id},
+                                 {'progress-message': 'extra file', 'progress-percent': 75,
+                                  'progress-sequence': 3, 'task-id': task_id}]
+            self.assertEqual(expected_messages, sent_messages)
+            self.assertEqual(['progress', 'stdout', 'extra'], [w.location_tag for w in tracker.watchers])
+
+            # the latest progress of each location is force sent, outdated sequences are skipped
+            tracker.force_send_progress_update()
+            self.assertEqual(expected_messages, sent_messages)
+        finally:
+            completed.set()
+            tu.cleanup_file(progress_name)
+            tu.cleanup_file(stdout_name)
+            tu.cleanup_file(extra_name)
+
+    def test_multiplexed_tracker_inotify(self):
+        self.multiplexed_tracker_helper(cp.WATCH_MODE_INOTIFY)
+
+    def test_multiplexed_tracker_poll(self):
+        self.multiplexed_tracker_helper(cp.WATCH_MODE_POLL)
+
+    def test_multiplexed_tracker_early_termination(self):
+        task_id = tu.get_random_task_id()
+        stdout_name = tu.ensure_directory('build/stdout.{}'.format(task_id))
+        config = tu.FakeExecutorConfig({'max_bytes_read_per_line': 1024,
+                                        'progress_regex_string': 'progress: ([0-9]*\.?[0-9]+), (.*)',
+                                        'progress_watch_mode': cp.WATCH_MODE_INOTIFY})
+        stop = Event()
+        completed = Event()
+        termination = Event()
+        counter = cp.ProgressSequenceCounter()
+        updater = cp.ProgressUpdater(task_id, 100, 0, lambda message: True)
+        tracker = cp.MultiplexedProgressTracker(config, stop, completed, counter, updater, termination,
+                                                tu.fake_os_error_handler)
+
+        try:
+            open(stdout_name, 'w').close()
+            tracker.add_location(stdout_name, 'stdout')
+            tracker.start()
+
+            # an incomplete task is tracked until progress tracking is terminated
+            tracker.wait(timeout=0.5)
+            self.assertFalse(tracker.progress_complete_event.isSet())
+            termination.set()
+            tracker.wake()
+            tracker.wait(timeout=5)
+            self.assertTrue(tracker.progress_complete_event.isSet())
+        finally:
+            completed.set()
+            tu.cleanup_file(stdout_name)
+
+    def test_multiplexed_tracker_captured_output(self):
+        task_id = tu.get_random_task_id()
+        config = tu.FakeExecutorConfig({'max_bytes_read_per_line': 1024,
+                                        'progress_regex_string': 'progress: ([0-9]*\.?[0-9]+), (.*)',
+                                        'progress_watch_mode': cp.WATCH_MODE_INOTIFY})
+        stop = Event()
+        completed = Event()
+        termination = Event()
+        sent_messages = []
+        counter = cp.ProgressSequenceCounter()
+        updater = cp.ProgressUpdater(task_id, 100, 0, lambda message: sent_messages.append(message) or True)
+        tracker = cp.MultiplexedProgressTracker(config, stop, completed, counter, updater, termination,
+                                                tu.fake_os_error_handler)
+        read_fd, write_fd = os.pipe()
+        copied_output = io.BytesIO()
+        output_stream = cio.CapturedOutput(os.fdopen(read_fd, 'rb'), 'stdout', lambda: copied_output,
+                                           threading.Lock())
+
+        try:
+            location_tag = 'stdout-{}'.format(task_id)
+            tracker.add_output_stream(output_stream, location_tag)
+            tracker.start()
+
+            # a partial line is only matched once it is completed
+            os.write(write_fd, b'Stage One complete\nprogress: 25, first')
+            time.sleep(0.1)
+            os.write(write_fd, b' stage\n')
+            tu.wait_for(lambda: len(sent_messages), lambda n: n >= 1)
+            os.write(write_fd, b'progress: 50, second stage\nDone\n')
+            tu.wait_for(lambda: len(sent_messages), lambda n: n >= 2)
+
+            # the location is complete, and its pipe closed, once the task closes its output
+            os.close(write_fd)
+            write_fd = None
+            self.assertTrue(tu.wait_for(lambda: output_stream.pipe.closed, lambda closed: closed, max_delay_ms=5000))
+            self.assertFalse(tracker.progress_complete_event.isSet())
+            completed.set()
+            tracker.wake()
+            tracker.wait(timeout=5)
+            self.assertTrue(tracker.progress_complete_event.isSet())
+
+            self.assertEqual([{'progress-message': 'first stage', 'progress-percent': 25,
+                               'progress-sequence': 1, 'task-id': task_id},
+                              {'progress-message': 'second stage', 'progress-percent': 50,
+                               'progress-sequence': 2, 'task-id': task_id}],
+                             sent_messages)
+            expected_output = b'Stage One complete\nprogress: 25, first stage\nprogress: 50, second stage\nDone\n'
+            self.assertEqual(expected_output, copied_output.getvalue())
+            self.assertEqual(len(expected_output), output_stream.bytes_read)
+
+            counters = cins.snapshot()['counters']
+            self.assertEqual(len(expected_output), counters['progress.bytes-read.{}'.format(location_tag)])
+            self.assertEqual(4, counters['progress.lines-read.{}'.format(location_tag)])
+        finally:
+            completed.set()
+            if write_fd is not None:
+                os.close(write_fd)
+
+    def test_parse_progress_record(self):
+        self.assertEqual({'fields': {}, 'message': b'', 'percent': 25.0},
+                         cp.parse_progress_record(b'{"percent": 25}\n'))
+        self.assertEqual({'fields': {'stage': 2, 'tags': ['a']}, 'message': b'stage 2 of 4', 'percent': 42.5},
+                         cp.parse_progress_record(b' {"percent": 42.5, "message": "stage 2 of 4", "stage": 2, '
+                                                  b'"tags": ["a"]}'))
+        self.assertIsNone(cp.parse_progress_record(b'progress: 25, not a record'))
+        self.assertIsNone(cp.parse_progress_record(b'{"percent": 25'))
+        self.assertIsNone(cp.parse_progress_record(b'{"message": "no percent"}'))
+        self.assertIsNone(cp.parse_progress_record(b'{"percent": "25"}'))
+        self.assertIsNone(cp.parse_progress_record(b'{"percent": true}'))
+
+    def progress_channel_helper(self, channel_type, write_record):
+        task_id = tu.get_random_task_id()
+        progress_name = tu.ensure_directory('build/progress.{}'.format(task_id))
+        config = tu.FakeExecutorConfig({'max_bytes_read_per_line': 1024,
+                                        'progress_regex_string': 'progress: ([0-9]*\.?[0-9]+), (.*)',
+                                        'progress_watch_mode': cp.WATCH_MODE_INOTIFY})
+        stop = Event()
+        completed = Event()
+        termination = Event()
+        sent_messages = []
+        counter = cp.ProgressSequenceCounter()
+        updater = cp.ProgressUpdater(task_id, 100, 0, lambda message: sent_messages.append(message) or True)
+        tracker = cp.MultiplexedProgressTracker(config, stop, completed, counter, updater, termination,
+                                                tu.fake_os_error_handler)
+
+        channel = cch.create_channel(channel_type, progress_name)
+        try:
+            tracker.add_channel(channel, 'progress')
+            tracker.start()
+
+            write_record(progress_name, b'{"percent": 25, "message": "first stage", "stage": 1}\n')
+            tu.wait_for(lambda: len(sent_messages), lambda n: n >= 1)
+            # lines that are not records are matched against the progress regex, invalid records are skipped
+            write_record(progress_name, b'{"percent": 250, "message": "out of range"}\n')
+            write_record(progress_name, b'progress: 50, second stage\n')
+            tu.wait_for(lambda: len(sent_messages), lambda n: n >= 2)
+            write_record(progress_name, b'{"percent": 75}\n')
+            tu.wait_for(lambda: len(sent_messages), lambda n: n >= 3)
+
+            # the channel is tracked until the task completes, and removed once it has been tracked
+            self.assertFalse(tracker.progress_complete_event.isSet())
+            completed.set()
+            tracker.wake()
+            tracker.wait(timeout=5)
+            self.assertTrue(tracker.progress_complete_event.isSet())
+            self.assertFalse(os.path.exists(progress_name))
+
+            self.assertEqual([{'progress-fields': {'stage': 1}, 'progress-message': 'first stage',
+                               'progress-percent': 25, 'progress-sequence': 1, 'task-id': task_id},
+                              {'progress-message': 'second stage', 'progress-percent': 50,
+                               'progress-sequence': 2, 'task-id': task_id},
+                              {'progress-message': '', 'progress-percent': 75,
+                               'progress-sequence': 3, 'task-id': task_id}],
+                             sent_messages)
+        finally:
+            completed.set()
+            channel.close()
+
+    def test_multiplexed_tracker_fifo_channel(self):
+        def write_record(progress_name, record):
+            # every record is written by a short lived writer, the executor keeps the pipe open
+            with open(progress_name, 'wb') as f:
+                f.write(record)
+
+        self.progress_channel_helper(cch.CHANNEL_FIFO, write_record)
+
+    def test_multiplexed_tracker_socket_channel(self):
+        def write_record(progress_name, record):
+            # every datagram is a record, it does not need to end with a newline
+            with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as s:
+                s.sendto(record.rstrip(b'\n'), progress_name)
+
+        self.progress_channel_helper(cch.CHANNEL_SOCKET, write_record)
+
+    def test_channel_live_location_is_not_removed(self):
+        for channel_type in [cch.CHANNEL_FIFO, cch.CHANNEL_SOCKET]:
+            progress_name = tu.ensure_directory('build/progress.{}'.format(tu.get_random_task_id()))
+            first_channel = cch.create_channel(channel_type, progress_name)
+            try:
+                # the channel of a running task is not stale
+                with self.assertRaises(FileExistsError):
+                    cch.create_channel(channel_type, progress_name)
+                self.assertTrue(os.path.exists(progress_name))
+
+                # closing a channel that has been replaced does not remove the channel that replaced it
+                os.unlink(progress_name)
+                second_channel = cch.create_channel(channel_type, progress_name)
+                try:
+                    first_channel.close()
+                    self.assertTrue(os.path.exists(progress_name))
+                finally:
+                    second_channel.close()
+                self.assertFalse(os.path.exists(progress_name))
+
+                # a file left at the location is stale
+                with open(progress_name, 'w'):
+                    pass
+                cch.create_channel(channel_type, progress_name).close()
+                self.assertFalse(os.path.exists(progress_name))
+            finally:
+                first_channel.close()
+                tu.cleanup_file(progress_name)
+
+    def test_metric_extractor(self):
+        extractor = cp.MetricExtractor({'loss': 'loss=([-0-9.e]+)', 'rows': 'rows processed: ([0-9]+)'})
+        self.assertIsNone(extractor.current_metrics())
+
+        candidate_pattern = extractor.candidate_pattern('progress: ([0-9]*\.?[0-9]+), (.*)')
+        self.assertTrue(candidate_pattern.search(b'progress: 50, half way\n'))
+        self.assertTrue(candidate_pattern.search(b'epoch 1 loss=0.5\n'))
+        self.assertFalse(candidate_pattern.search(b'Hello World\n'))
+
+        self.assertEqual(0, extractor.extract(b'Hello World\n'))
+        self.assertEqual(1, extractor.extract(b'rows processed: 100\n'))
+        self.assertEqual(2, extractor.extract(b'rows processed: 50 loss=0.5\n'))
+        self.assertEqual(1, extractor.extract(b'loss=0.25\n'))
+        # values that are not numbers are skipped
+        self.assertEqual(0, extractor.extract(b'loss=..\n'))
+        self.assertEqual({'metrics': {'loss': {'count': 2, 'last': 0.25, 'max': 0.5, 'min': 0.25, 'sum': 0.75},
+                                      'rows': {'count': 2, 'last': 50, 'max': 100, 'min': 50, 'sum': 150}},
+                          'metrics-sequence': 4},
+                         extractor.current_metrics())
+
+    def test_metric_extractor_uncombinable_patterns(self):
+        # inline global flags and group references change meaning inside an alternation, the patterns are then
+        # matched separately and every line is a candidate
+        extractor = cp.MetricExtractor({'loss': '(?i)loss: ([0-9.]+)', 'rows': 'rows processed: ([0-9]+)'})
+        self.assertIsNone(extractor.metrics_pattern)
+        self.assertIsNone(extractor.candidate_pattern('progress: ([0-9]*\.?[0-9]+), (.*)'))
+        self.assertEqual(1, extractor.extract(b'LOSS: 0.5\n'))
+        self.assertEqual(1, extractor.extract(b'rows processed: 100\n'))
+        self.assertEqual(0, extractor.extract(b'Hello World\n'))
+
+        extractor = cp.MetricExtractor({'rows': 'rows processed: ([0-9]+)'})
+        self.assertIsNotNone(extractor.metrics_pattern)
+        self.assertIsNone(extractor.candidate_pattern('(?i)progress: ([0-9]*\.?[0-9]+), (.*)'))
+        self.assertIsNone(extractor.candidate_pattern('(["\'])progress: ([0-9]+)\\1'))
+
+        extractor = cp.MetricExtractor({'rate': 'rate: ([0-9]+) (?P<unit>[a-z]+)/(?P=unit)'})
+        self.assertIsNone(extractor.metrics_pattern)
+        self.assertEqual(1, extractor.extract(b'rate: 7 s/s\n'))
+
+    def test_metrics_updater(self):
+        sent_messages = []
+        updater = cp.MetricsUpdater('task-1', 60000, lambda message: sent_messages.append(message) or True)
+        metrics = {'metrics': {'rows': {'count': 1, 'last': 5, 'max': 5, 'min': 5, 'sum': 5}}, 'metrics-sequence': 1}
+
+        updater.send_metrics_update(None)
+        updater.send_metrics_update(metrics)
+        self.assertEqual([dict(metrics, **{'task-id': 'task-1'})], sent_messages)
+        # outdated updates are skipped, even when forced, newer updates are throttled unless forced
+        updater.send_metrics_update(metrics, force_send=True)
+        newer_metrics = dict(metrics, **{'metrics-sequence': 2})
+        updater.send_metrics_update(newer_metrics)
+        self.assertEqual(1, len(sent_messages))
+        updater.send_metrics_update(newer_metrics, force_send=True)
+        self.assertEqual(2, len(sent_messages))
+
+        # metrics that could not be sent are sent again
+        updater.metrics_message_failed(sent_messages[-1])
+        updater.send_metrics_update(newer_metrics, force_send=True)
+        self.assertEqual(3, len(sent_messages))
+
+    def test_multiplexed_tracker_metrics(self):
+        task_id = tu.get_random_task_id()
+        stdout_name = tu.ensure_directory('build/stdout.{}'.format(task_id))
+        config = tu.FakeExecutorConfig({'max_bytes_read_per_line': 1024,
+                                        'progress_regex_string': 'progress: ([0-9]*\.?[0-9]+), (.*)',
+                                        'progress_watch_mode': cp.WATCH_MODE_INOTIFY})
+        stop = Event()
+        completed = Event()
+        termination = Event()
+        sent_messages = []
+        sent_metrics = []
+        counter = cp.ProgressSequenceCounter()
+        updater = cp.ProgressUpdater(task_id, 100, 0, lambda message: sent_messages.append(message) or True)
+        extractor = cp.MetricExtractor({'rows': 'rows processed: ([0-9]+)'})
+        metrics_updater = cp.MetricsUpdater(task_id, 0, lambda message: sent_metrics.append(message) or True)
+        tracker = cp.MultiplexedProgressTracker(config, stop, completed, counter, updater, termination,
+                                                tu.fake_os_error_handler, metric_extractor=extractor,
+                                                metrics_updater=metrics_updater)
+        read_fd, write_fd = os.pipe()
+        output_stream = cio.CapturedOutput(os.fdopen(read_fd, 'rb'), 'stderr', lambda: io.BytesIO(),
+                                           threading.Lock())
+
+        try:
+            with open(stdout_name, 'w') as f:
+                f.write('rows processed: 10\nprogress: 25, first\n')
+            tracker.add_location(stdout_name, 'stdout')
+            tracker.add_output_stream(output_stream, 'stderr')
+            tracker.start()
+            tu.wait_for(lambda: sent_metrics and sent_metrics[-1]['metrics-sequence'], lambda n: n == 1,
+                        max_delay_ms=10000)
+
+            # the metrics of all the locations are aggregated
+            os.write(write_fd, b'rows processed: 5\n')
+            os.close(write_fd)
+            write_fd = None
+            tu.wait_for(lambda: sent_metrics and sent_metrics[-1]['metrics-sequence'], lambda n: n == 2,
+                        max_delay_ms=10000)
+            completed.set()
+            tracker.wake()
+            tracker.wait(timeout=5)
+            tracker.force_send_progress_update()
+
+            self.assertEqual({'metrics': {'rows': {'count': 2, 'last': 5, 'max': 10, 'min': 5, 'sum': 15}},
+                              'metrics-sequence': 2, 'task-id': task_id},
+                             sent_metrics[-1])
+            self.assertEqual([{'progress-message': 'first', 'progress-percent': 25, 'progress-sequence': 1,
+                               'task-id': task_id}],
+                             sent_messages)
+        finally:
+            completed.set()
+            if write_fd is not None:
+                os.close(write_fd)
+            tu.cleanup_file(stdout_name)
+
+    def test_multiplexed_tracker_metrics_with_inline_flags(self):
+        task_id = tu.get_random_task_id()
+        stdout_name = tu.ensure_directory('build/stdout.{}'.format(task_id))
+        config = tu.FakeExecutorConfig({'max_bytes_read_per_line': 1024,
+                                        'progress_regex_string': '(?i)progress: ([0-9]*\.?[0-9]+), (.*)',
+                                        'progress_watch_mode': cp.WATCH_MODE_INOTIFY})
+        completed = Event()
+        sent_messages = []
+        sent_metrics = []
+        updater = cp.ProgressUpdater(task_id, 100, 0, lambda message: sent_messages.append(message) or True)
+        extractor = cp.MetricExtractor({'loss': '(?i)loss: ([0-9.]+)'})
+        metrics_updater = cp.MetricsUpdater(task_id, 0, lambda message: sent_metrics.append(message) or True)
+        tracker = cp.MultiplexedProgressTracker(config, Event(), completed, cp.ProgressSequenceCounter(), updater,
+                                                Event(), tu.fake_os_error_handler, metric_extractor=extractor,
+                                                metrics_updater=metrics_updater)
+
+        try:
+            with open(stdout_name, 'w') as f:
+                f.write('LOSS: 0.5\nPROGRESS: 25, first\n')
+            tracker.add_location(stdout_name, 'stdout')
+            tracker.start()
+            tu.wait_for(lambda: sent_metrics and sent_messages, lambda ready: ready, max_delay_ms=10000)
+            completed.set()
+            tracker.wake()
+            tracker.wait(timeout=5)
+
+            self.assertEqual({'metrics': {'loss': {'count': 1, 'last': 0.5, 'max': 0.5, 'min': 0.5, 'sum': 0.5}},
+                              'metrics-sequence': 1, 'task-id': task_id},
+                             sent_metrics[-1])
+            self.assertEqual([{'progress-message': 'first', 'progress-percent': 25, 'progress-sequence': 1,
+                               'task-id': task_id}],
+                             sent_messages)
+        finally:
+            completed.set()
+            tu.cleanup_file(stdout_name)
+
     def test_retrieve_progress_states_os_error_from_tail(self):
 
         class FakeProgressWatcher(cp.ProgressWatcher):
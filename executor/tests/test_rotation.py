@@ -0,0 +1,144 @@
+import glob
+import gzip
+import os
+import unittest
+
+import cook.rotation as cr
+import tests.utils as tu
+
+
+def write_chunks(rotating_output, chunks):
+    for chunk in chunks:
+        rotating_output.write(chunk)
+        rotating_output.flush()
+
+
+def read_segment(segment_path):
+    if segment_path.endswith('.gz'):
+        with gzip.open(segment_path, 'rb') as segment_file:
+            return segment_file.read()
+    if segment_path.endswith('.zst'):
+        with open(segment_path, 'rb') as segment_file:
+            return cr.zstandard.ZstdDecompressor().stream_reader(segment_file).read()
+    with open(segment_path, 'rb') as segment_file:
+        return segment_file.read()
+
+
+def cleanup_segments(output_name):
+    for segment_path in glob.glob('{}.*'.format(output_name)):
+        tu.cleanup_file(segment_path)
+
+
+class RotationTest(unittest.TestCase):
+    def rotation_helper(self, compression, suffix):
+        output_name = tu.ensure_directory('build/rotation.{}'.format(tu.get_random_task_id()))
+        output = open(output_name, 'w+')
+        chunks = [chr(ord('a') + i).encode() * 600 for i in range(11)]
+
+        try:
+            rotation = cr.OutputRotation(1024, 0, compression)
+            rotating_output = rotation.rotating_output(output_name, lambda: output)
+            write_chunks(rotating_output, chunks)
+            rotation.close(timeout_secs=5)
+
+            # every two chunks fill a segment, the newest segment is written in place and left uncompressed
+            segment_paths = ['{}.{}{}'.format(output_name, i, suffix) for i in range(1, 6)]
+            self.assertEqual(segment_paths, rotation.segments)
+            self.assertEqual(sorted(segment_paths), sorted(glob.glob('{}.*'.format(output_name))))
+            self.assertEqual(b''.join(chunks), b''.join(map(read_segment, segment_paths)) + read_segment(output_name))
+            self.assertEqual(chunks[-1], read_segment(output_name))
+        finally:
+            output.close()
+            tu.cleanup_file(output_name)
+            cleanup_segments(output_name)
+
+    def test_rotation_gzip(self):
+        self.rotation_helper(cr.COMPRESSION_GZIP, '.gz')
+
+    @unittest.skipIf(cr.zstandard is None, 'requires the zstandard module')
+    def test_rotation_zstd(self):
+        self.rotation_helper(cr.COMPRESSION_ZSTD, '.zst')
+
+    def test_rotation_no_compression(self):
+        self.rotation_helper(cr.COMPRESSION_NONE, '')
+
+    def test_rotation_max_total_bytes(self):
+        stdout_name = tu.ensure_directory('build/rotation.stdout.{}'.format(tu.get_random_task_id()))
+        stderr_name = tu.ensure_directory('build/rotation.stderr.{}'.format(tu.get_random_task_id()))
+        stdout = open(stdout_name, 'w+')
+        stderr = open(stderr_name, 'w+')
+
+        try:
+            # the cap keeps two segments whether or not the last chunk is written when a segment is processed
+            rotation = cr.OutputRotation(1024, 3500, cr.COMPRESSION_NONE)
+            stdout_output = rotation.rotating_output(stdout_name, lambda: stdout)
+            stderr_output = rotation.rotating_output(stderr_name, lambda: stderr)
+            write_chunks(stderr_output, [b'e' * 300])
+            write_chunks(stdout_output, [b'o' * 600] * 9)
+            rotation.close(timeout_secs=5)
+
+            # the oldest segments are removed, the newest segment of every output is kept
+            self.assertEqual(['{}.{}'.format(stdout_name, i) for i in [3, 4]], rotation.segments)
+            self.assertEqual(['{}.{}'.format(stdout_name, i) for i in [3, 4]],
+                             sorted(glob.glob('{}.*'.format(stdout_name))))
+            self.assertEqual(2 * 1200, rotation.removed_bytes)
+            self.assertEqual(600, os.path.getsize(stdout_name))
+            self.assertEqual(300, os.path.getsize(stderr_name))
+        finally:
+            stdout.close()
+            stderr.close()
+            for output_name in [stdout_name, stderr_name]:
+                tu.cleanup_file(output_name)
+                cleanup_segments(output_name)
+
+    def test_rotation_numbers_after_existing_segments(self):
+        output_name = tu.ensure_directory('build/rotation.{}'.format(tu.get_random_task_id()))
+        output = open(output_name, 'w+')
+
+        try:
+            # a previous task rolled two segments, the second was not compressed
+            first_rotation = cr.OutputRotation(1024, 0, cr.COMPRESSION_GZIP)
+            write_chunks(first_rotation.rotating_output(output_name, lambda: output), [b'a' * 600] * 3)
+            first_rotation.close(timeout_secs=5)
+            compressed_size = os.path.getsize('{}.1.gz'.format(output_name))
+            with open('{}.2'.format(output_name), 'wb') as segment_file:
+                segment_file.write(b'b' * 1200)
+
+            rotation = cr.OutputRotation(1024, 2400 + compressed_size - 1, cr.COMPRESSION_NONE)
+            rotating_output = rotation.rotating_output(output_name, lambda: output)
+            self.assertIs(rotating_output, rotation.rotating_output(output_name, lambda: output))
+            write_chunks(rotating_output, [b'c' * 600])
+            rotation.close(timeout_secs=5)
+
+            # the existing segments count towards the cap, the oldest is removed first
+            self.assertEqual(['{}.{}'.format(output_name, i) for i in [2, 3]], rotation.segments)
+            self.assertEqual(['{}.{}'.format(output_name, i) for i in [2, 3]],
+                             sorted(glob.glob('{}.*'.format(output_name))))
+            self.assertEqual(compressed_size, rotation.removed_bytes)
+            self.assertEqual(b'b' * 1200, read_segment('{}.2'.format(output_name)))
+            self.assertEqual(b'a' * 600 + b'c' * 600, read_segment('{}.3'.format(output_name)))
+        finally:
+            output.close()
+            tu.cleanup_file(output_name)
+            cleanup_segments(output_name)
+
+    def test_rotation_skips_output_not_written_to_path(self):
+        output_name = tu.ensure_directory('build/rotation.{}'.format(tu.get_random_task_id()))
+        other_name = tu.ensure_directory('build/rotation.other.{}'.format(tu.get_random_task_id()))
+        open(other_name, 'w').close()
+        output = open(output_name, 'w+')
+
+        try:
+            rotation = cr.OutputRotation(1024, 0, cr.COMPRESSION_GZIP)
+            rotating_output = rotation.rotating_output(other_name, lambda: output)
+            write_chunks(rotating_output, [b'x' * 600] * 4)
+            rotation.close(timeout_secs=5)
+
+            self.assertFalse(rotating_output.enabled)
+            self.assertEqual([], rotation.segments)
+            self.assertEqual(2400, os.path.getsize(output_name))
+            self.assertEqual([], glob.glob('{}.*'.format(other_name)))
+        finally:
+            output.close()
+            tu.cleanup_file(output_name)
+            tu.cleanup_file(other_name)
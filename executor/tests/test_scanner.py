@@ -0,0 +1,143 @@
+import io
+import re
+import unittest
+
+import cook.scanner as cscan
+
+
+def readline_fragments(data, max_bytes_per_line):
+    """Returns the fragments produced by repeatedly calling readline on data."""
+    fragments = []
+    file_obj = io.BytesIO(data)
+    while True:
+        fragment = file_obj.readline(max_bytes_per_line)
+        if not fragment:
+            return fragments
+        fragments.append(fragment)
+
+
+def scanner_fragments(scanner):
+    """Returns all the fragments returned by the scanner until no more content is available."""
+    fragments = []
+    while True:
+        chunk_fragments = scanner.scan()
+        if chunk_fragments is None:
+            return fragments
+        fragments.extend(chunk_fragments)
+
+
+class ScannerTest(unittest.TestCase):
+    def test_scan_matches_readline_fragments(self):
+        data = b'line one\n\nline two is a longer line\nabcd\nabcde\nabc\n' + b'x' * 37 + b'\nno trailing newline'
+        progress_bar_data = b'10%\r20%\r30%\ndone\r\n' + b'y' * 2048 + b'\n\r'
+        for data, num_lines in [(data, 7), (progress_bar_data, 3)]:
+            for max_bytes_per_line in [1, 2, 4, 5, 7, 16, 1024]:
+                for chunk_size in [1, 3, 8, 64, cscan.DEFAULT_CHUNK_SIZE]:
+                    expected_fragments = readline_fragments(data, max_bytes_per_line)
+                    scanner = cscan.LineScanner(io.BytesIO(data), max_bytes_per_line, chunk_size=chunk_size)
+                    actual_fragments = scanner_fragments(scanner)
+                    message = 'max_bytes_per_line={}, chunk_size={}'.format(max_bytes_per_line, chunk_size)
+                    self.assertEqual(expected_fragments, actual_fragments, message)
+                    self.assertEqual(len(expected_fragments), scanner.fragments_read, message)
+                    self.assertEqual(num_lines, scanner.lines_read, message)
+
+    def test_scan_returns_partial_line_when_no_more_content(self):
+        file_obj = io.BytesIO()
+        scanner = cscan.LineScanner(file_obj, 1024)
+        self.assertIsNone(scanner.scan())
+
+        file_obj.write(b'first line\nsecond')
+        file_obj.seek(0)
+        self.assertEqual([b'first line\n'], scanner.scan())
+        self.assertEqual([b'second'], scanner.scan())
+        self.assertIsNone(scanner.scan())
+
+        position = file_obj.tell()
+        file_obj.write(b' half\nthird line\n')
+        file_obj.seek(position)
+        self.assertEqual([b' half\n', b'third line\n'], scanner.scan())
+        self.assertIsNone(scanner.scan())
+        self.assertEqual(4, scanner.fragments_read)
+        self.assertEqual(3, scanner.lines_read)
+
+    def test_scan_keeps_partial_line_of_non_blocking_source(self):
+        class NonBlockingSource(object):
+            def __init__(self, chunks):
+                self.chunks = chunks
+
+            def read(self, size):
+                return self.chunks.pop(0)
+
+        source = NonBlockingSource([b'first line\nsec', None, b'ond line\n', None, b'last', b''])
+        scanner = cscan.LineScanner(source, 1024)
+        self.assertEqual([b'first line\n'], scanner.scan())
+        self.assertIsNone(scanner.scan())
+        self.assertEqual([b'second line\n'], scanner.scan())
+        self.assertIsNone(scanner.scan())
+        self.assertEqual([], scanner.scan())
+        self.assertEqual([b'last'], scanner.scan())
+        self.assertEqual(3, scanner.fragments_read)
+
+    def test_scan_candidate_filter(self):
+        data = b'noise\nprogress: 10, ten\nmore noise\n' + b'y' * 20 + b'progress: 20, twenty\nprogress: 30'
+        scanner = cscan.LineScanner(io.BytesIO(data), 16, candidate_filter=lambda f: b'progress' in f)
+        self.assertEqual([b'progress: 10, te', b'yyyyprogress: 20', b'progress: 30'], scanner_fragments(scanner))
+        self.assertEqual(len(readline_fragments(data, 16)), scanner.fragments_read)
+        self.assertEqual(4, scanner.lines_read)
+
+    def test_required_literal(self):
+        def required_literal(regex_string):
+            return cscan.required_literal(re.compile(regex_string.encode()))
+
+        self.assertEqual(b'progress: ', required_literal('progress: ([0-9]*\.?[0-9]+), (.*)'))
+        self.assertEqual(b'^^^^JOB-PROGRESS:',
+                         required_literal('\^\^\^\^JOB-PROGRESS:\s+([0-9]*\.?[0-9]+)($|\s+.*)'))
+        self.assertEqual(b'% complete', required_literal('([0-9]+)% complete'))
+        self.assertEqual(b'done', required_literal('[0-9]+ (.*)done'))
+        self.assertEqual(b'afterwards', required_literal('before\nafterwards'))
+        self.assertIsNone(required_literal('progress|PROGRESS'))
+        self.assertIsNone(required_literal('(?i)progress: ([0-9]+)'))
+        self.assertIsNone(required_literal('[0-9]+'))
+        self.assertIsNone(required_literal(''))
+
+    def test_scan_candidate_literal_matches_candidate_filter(self):
+        progress_regex = re.compile(b'progress: ([0-9]*\.?[0-9]+), (.*)')
+        candidate_literal = cscan.required_literal(progress_regex)
+        lines = [b'noise', b'progress: 10, ten', b'progress: not a number', b'', b'two progress: 20, twenty',
+                 b'x' * 40, b'progress: 30, ' + b'z' * 30, b'progress: 40, forty\rprogress: 50, fifty', b'end']
+        data = b'\n'.join(lines) + b'\nprogress: 60, partial'
+        for max_bytes_per_line in [8, 16, 64, 1024]:
+            for chunk_size in [1, 5, 32, cscan.DEFAULT_CHUNK_SIZE]:
+                expected_scanner = cscan.LineScanner(io.BytesIO(data), max_bytes_per_line,
+                                                     candidate_filter=progress_regex.search, chunk_size=chunk_size)
+                expected_fragments = scanner_fragments(expected_scanner)
+                scanner = cscan.LineScanner(io.BytesIO(data), max_bytes_per_line,
+                                            candidate_filter=progress_regex.search,
+                                            candidate_literal=candidate_literal, chunk_size=chunk_size)
+                message = 'max_bytes_per_line={}, chunk_size={}'.format(max_bytes_per_line, chunk_size)
+                self.assertEqual(expected_fragments, scanner_fragments(scanner), message)
+                self.assertEqual(expected_scanner.fragments_read, scanner.fragments_read, message)
+                self.assertEqual(len(lines), scanner.lines_read, message)
+
+    def test_reverse_scan_lines(self):
+        lines = [b'first\n', b'\n', b'x' * 40 + b'\n', b'progress: 10, ten\n', b'carriage\rreturn\n', b'last\n']
+        data = b''.join(lines) + b'partial'
+        for max_bytes_per_line in [8, 20, 64]:
+            for chunk_size in [1, 5, 32, cscan.DEFAULT_CHUNK_SIZE]:
+                scanner = cscan.ReverseLineScanner(io.BytesIO(data), len(data), max_bytes_per_line,
+                                                   chunk_size=chunk_size)
+                message = 'max_bytes_per_line={}, chunk_size={}'.format(max_bytes_per_line, chunk_size)
+                # the partial line and the lines longer than a fragment are skipped
+                expected_lines = [line for line in reversed(lines) if len(line) <= max_bytes_per_line]
+                self.assertEqual(expected_lines, list(scanner.lines()), message)
+                self.assertEqual(len(data) - len(b'partial'), scanner.lines_end, message)
+
+        # only the end of the file is read when the line is found there
+        data = b'progress: 10, ten\n' * 100000 + b'progress: 20, twenty\n'
+        scanner = cscan.ReverseLineScanner(io.BytesIO(data), len(data), 1024, chunk_size=4096)
+        self.assertEqual(b'progress: 20, twenty\n', next(scanner.lines()))
+        self.assertEqual(4096, scanner.bytes_read)
+
+        scanner = cscan.ReverseLineScanner(io.BytesIO(b'no newline'), 10, 1024)
+        self.assertEqual([], list(scanner.lines()))
+        self.assertEqual(0, scanner.lines_end)
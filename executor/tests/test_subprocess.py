@@ -5,6 +5,8 @@ import time
 import unittest
 
 import collections
+import os
+import psutil
 import pytest
 
 import cook.subprocess as cs
@@ -35,6 +37,14 @@ def find_process_ids_in_group(group_id):
     return group_id_to_process_ids[group_id_str]
 
 
+def is_process_live(process_id):
+    """Returns true if the process exists and is not a zombie."""
+    try:
+        return psutil.Process(process_id).status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+
+
 class SubprocessTest(unittest.TestCase):
     # FIXME - remove the xfail mark once the issue with this test failing is resolved:
     # https://github.com/twosigma/Cook/issues/737
@@ -164,3 +174,42 @@ class SubprocessTest(unittest.TestCase):
 
     def test_process_group_assignment_and_killing_send_signal_term(self):
         self.process_launch_and_kill_helper(lambda pid: cs.send_signal(pid, signal.SIGTERM))
+
+    def test_send_signal_to_wide_deep_process_tree(self):
+        # a chain of tree_depth processes, each of which also forks tree_width sleeping leaves
+        tree_depth = 8
+        tree_width = 8
+        tree_script = 'import os, time\n' \
+                      'for level in range({}):\n' \
+                      '    for _ in range({}):\n' \
+                      '        if os.fork() == 0:\n' \
+                      '            time.sleep(600)\n' \
+                      '            os._exit(0)\n' \
+                      '    if os.fork() != 0:\n' \
+                      '        break\n' \
+                      'time.sleep(600)\n'.format(tree_depth, tree_width)
+        process = subprocess.Popen(['python3', '-c', tree_script])
+        num_processes = 1 + tree_depth * (tree_width + 1)
+
+        def live_process_ids():
+            return [p for p in cs.find_process_tree(process.pid, cs.read_parent_process_ids()) if is_process_live(p)]
+
+        try:
+            # forking the tree is slow on a loaded machine
+            process_ids = tu.wait_for(live_process_ids, lambda data: len(data) == num_processes,
+                                      default_value=[], max_delay_ms=30000)
+            self.assertEqual(num_processes, len(process_ids))
+            descendant_ids = [p.pid for p in psutil.Process(process.pid).children(recursive=True)]
+            self.assertEqual(sorted([process.pid] + descendant_ids), sorted(process_ids))
+
+            self.assertTrue(cs._send_signal_to_process_tree(process.pid, signal.SIGKILL))
+
+            process.wait(timeout=5)
+            # every process in the tree received the SIGKILL
+            remaining_process_ids = tu.wait_for(lambda: [p for p in process_ids if is_process_live(p)],
+                                                lambda data: len(data) == 0, default_value=[], max_delay_ms=10000)
+            self.assertEqual([], remaining_process_ids)
+        finally:
+            if process.poll() is None:
+                cs.send_signal(process.pid, signal.SIGKILL)
+                process.wait()
@@ -0,0 +1,103 @@
+import os
+import signal
+import unittest
+
+import cook.cgroup as ccg
+import cook.subprocess as cs
+import cook.telemetry as ct
+import tests.utils as tu
+
+# allocates 64 MB, burns about a third of a cpu second and then sleeps
+BURN_COMMAND = 'python3 -c "import time\n' \
+               'data = bytearray(64 * 1024 * 1024)\n' \
+               'sum(range(2 * 10 ** 7))\n' \
+               'time.sleep({})"'
+
+
+class TelemetryTest(unittest.TestCase):
+    def launch_and_wait(self, command, num_processes):
+        process = cs.launch_process(command, dict(os.environ))
+        process_ids = tu.wait_for(lambda: cs.find_process_tree(process.pid, cs.read_parent_process_ids()),
+                                  lambda data: len(data) >= num_processes, default_value=[], max_delay_ms=10000)
+        self.assertEqual(num_processes, len(process_ids))
+        return process
+
+    def test_read_process_usage(self):
+        cpu_secs, rss_bytes, read_bytes, write_bytes = ct.read_process_usage(os.getpid())
+        self.assertGreater(cpu_secs, 0)
+        self.assertGreater(rss_bytes, 0)
+        self.assertGreaterEqual(read_bytes, 0)
+        self.assertGreaterEqual(write_bytes, 0)
+        self.assertIsNone(ct.read_process_usage(2 ** 22 + 1))
+
+    def test_sample_process_tree(self):
+        process = self.launch_and_wait('{} & {}'.format(BURN_COMMAND.format(5), BURN_COMMAND.format(5)), 3)
+        try:
+            sampler = ct.ResourceSampler(process.pid)
+            usage = tu.wait_for(sampler.sample, lambda data: data['peak-rss-bytes'] > 2 * 64 * 1024 * 1024,
+                                default_value=sampler.summary(), max_delay_ms=10000)
+            self.assertEqual(3, usage['num-processes'])
+            self.assertEqual(3, usage['peak-num-processes'])
+            self.assertGreater(usage['cpu-secs'], 0)
+            self.assertEqual(usage['peak-rss-bytes'], usage['rss-bytes'])
+
+            # the usage of exited processes is kept
+            process.wait(timeout=10)
+            final_usage = sampler.sample()
+            self.assertEqual(0, final_usage['num-processes'])
+            self.assertEqual(3, final_usage['peak-num-processes'])
+            self.assertEqual(0, final_usage['rss-bytes'])
+            self.assertGreaterEqual(final_usage['cpu-secs'], usage['cpu-secs'])
+            self.assertEqual(usage['peak-rss-bytes'], final_usage['peak-rss-bytes'])
+        finally:
+            cs.send_signal(process.pid, signal.SIGKILL)
+            process.wait()
+
+    def test_sample_overhead(self):
+        num_processes = 100
+        process = self.launch_and_wait('for i in $(seq {}); do sleep 60 & done; wait'.format(num_processes - 1),
+                                       num_processes)
+        try:
+            sampler = ct.ResourceSampler(process.pid)
+            for _ in range(10):
+                self.assertEqual(num_processes, sampler.sample()['num-processes'])
+            sample_cpu_secs = sampler.sample_cpu_secs / sampler.num_samples
+            # the bound stated in cook.telemetry
+            self.assertLess(sample_cpu_secs / ct.MIN_INTERVAL_SECS, 0.005,
+                            'sampling {} processes took {} cpu secs'.format(num_processes, sample_cpu_secs))
+        finally:
+            cs.send_signal(process.pid, signal.SIGKILL)
+            process.wait()
+
+    def test_sample_max_processes(self):
+        process = self.launch_and_wait('for i in $(seq 9); do sleep 60 & done; wait', 10)
+        try:
+            sampler = ct.ResourceSampler(process.pid, max_processes=4)
+            sampler.sample()
+            self.assertEqual(10, sampler.num_processes)
+            self.assertEqual(4, len(sampler.process_usage))
+
+            # the processes that are no longer sampled are running, their usage is not counted as exited
+            sampler = ct.ResourceSampler(process.pid, max_processes=10)
+            sampler.sample()
+            sampler.max_processes = 4
+            sampler.sample()
+            self.assertEqual(10, len(sampler.process_usage))
+            self.assertEqual([0.0, 0, 0], sampler.exited_usage)
+        finally:
+            cs.send_signal(process.pid, signal.SIGKILL)
+            process.wait()
+
+    def test_sample_cgroup(self):
+        cgroup = ccg.TaskCgroup.create(tu.get_random_task_id())
+        if cgroup is None:
+            self.skipTest('requires a delegated cgroup v2')
+        try:
+            # the processes exit between samples, the cgroup still accounts for their cpu
+            process = cs.launch_process(BURN_COMMAND.format(0), dict(os.environ), cgroup=cgroup)
+            process.wait(timeout=10)
+            usage = ct.ResourceSampler(process.pid, cgroup).sample()
+            self.assertEqual(0, usage['num-processes'])
+            self.assertGreater(usage['cpu-secs'], 0.2)
+        finally:
+            cgroup.remove(timeout_secs=5)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+#
+#  Copyright (c) 2020 Two Sigma Open Source, LLC
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+#  IN THE SOFTWARE.
+#
+"""Load test comparing the gunicorn and asyncio modes of the sidecar file server.
+
+For every mode, a sidecar is started on a scratch sandbox and is loaded with:
+- slow readers, that download a large file and consume the response slowly (e.g. a `cs cat` piped to a slow consumer),
+- tail readers, that poll /files/read with keep-alive connections like `cs tail -f`,
+- a readiness prober, that probes /readiness-probe on a new connection like the kubelet.
+The latency percentiles of the tail reads and of the readiness probes are reported per mode.
+
+Usage:
+    python benchmarks/file_server_load_test.py [--slow-readers N] [--tail-readers N] [--duration SECS]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+SIDECAR_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed by the server')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in [b'\r\n', b'\n', b'']:
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding') == 'chunked':
+        chunks = []
+        while True:
+            chunk_length = int((await reader.readline()).split(b';')[0], 16)
+            chunk = await reader.readexactly(chunk_length + 2)
+            chunks.append(chunk[:-2])
+            if chunk_length == 0:
+                break
+        body = b''.join(chunks)
+    else:
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return int(status_line.split()[1]), body
+
+
+def request_bytes(target, keep_alive):
+    connection = 'keep-alive' if keep_alive else 'close'
+    return f'GET {target} HTTP/1.1\r\nHost: localhost\r\nConnection: {connection}\r\n\r\n'.encode()
+
+
+async def slow_reader(port, path, deadline, stats):
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(request_bytes(f'/files/download?path={path}', False))
+        # 16 KB every 100 ms, the server is left with a full socket buffer for the whole test
+        while time.monotonic() < deadline:
+            if not await reader.read(16 * 1024):
+                break
+            stats['slow-bytes'] += 16 * 1024
+            await asyncio.sleep(0.1)
+        writer.close()
+    except (ConnectionError, OSError):
+        stats['slow-errors'] += 1
+
+
+async def tail_reader(port, path, deadline, stats):
+    offset = 0
+    reader, writer = None, None
+    while time.monotonic() < deadline:
+        start = time.monotonic()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(request_bytes(f'/files/read?path={path}&offset={offset}&length=4096', True))
+            status, body = await asyncio.wait_for(read_response(reader), deadline - start + 5)
+            stats['tail-latencies'].append(time.monotonic() - start)
+            offset += len(json.loads(body)['data']) if status == 200 else 0
+        except (ConnectionError, OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            stats['tail-errors'] += 1
+            reader, writer = None, None
+        await asyncio.sleep(0.5)
+    if writer is not None:
+        writer.close()
+
+
+async def readiness_prober(port, deadline, stats):
+    while time.monotonic() < deadline:
+        start = time.monotonic()
+        try:
+            async def probe():
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.write(request_bytes('/readiness-probe', False))
+                status, _ = await read_response(reader)
+                writer.close()
+                return status
+
+            # the default kubelet probe timeout
+            if await asyncio.wait_for(probe(), 1) == 200:
+                stats['probe-latencies'].append(time.monotonic() - start)
+            else:
+                stats['probe-failures'] += 1
+        except (ConnectionError, OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            stats['probe-failures'] += 1
+        await asyncio.sleep(max(0.0, 0.2 - (time.monotonic() - start)))
+
+
+async def run_load(port, sandbox, options):
+    stats = {'probe-failures': 0, 'probe-latencies': [], 'slow-bytes': 0, 'slow-errors': 0,
+             'tail-errors': 0, 'tail-latencies': []}
+    deadline = time.monotonic() + options.duration
+    readers = [slow_reader(port, os.path.join(sandbox, 'large'), deadline, stats)
+               for _ in range(options.slow_readers)]
+    readers += [tail_reader(port, os.path.join(sandbox, 'stdout'), deadline, stats)
+                for _ in range(options.tail_readers)]
+    await asyncio.gather(readiness_prober(port, deadline, stats), *readers)
+    return stats
+
+
+def wait_until_ready(port, timeout_secs=30):
+    deadline = time.monotonic() + timeout_secs
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1) as s:
+                s.sendall(request_bytes('/readiness-probe', False))
+                if s.recv(64).startswith(b'HTTP/1.1 200'):
+                    return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise TimeoutError(f'file server on port {port} did not become ready')
+
+
+def run_mode(mode, sandbox, options):
+    port = free_port()
+    command = [sys.executable, '-m', 'cook.sidecar', '--no-progress-reporter', '--file-server-mode', mode,
+               '--file-server-port', str(port), '--file-server-workers', str(options.workers),
+               '--file-server-threads', str(options.threads)]
+    env = dict(os.environ, COOK_WORKDIR=sandbox, PYTHONPATH=SIDECAR_DIRECTORY)
+    with open(os.path.join(sandbox, f'{mode}.log'), 'w') as log:
+        process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            wait_until_ready(port)
+            return asyncio.run(run_load(port, sandbox, options))
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cook sidecar file server load test')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load per mode')
+    parser.add_argument('--large-file-mb', type=int, default=256, help='size of the file downloaded by slow readers')
+    parser.add_argument('--modes', nargs='+', default=['gunicorn', 'asyncio'], choices=['asyncio', 'gunicorn'])
+    parser.add_argument('--slow-readers', type=int, default=8, help='number of slow downloading clients')
+    parser.add_argument('--tail-readers', type=int, default=200, help='number of tail -f like clients')
+    parser.add_argument('--threads', type=int, default=2, help='--file-server-threads of the sidecar')
+    parser.add_argument('--workers', type=int, default=2, help='--file-server-workers of the sidecar')
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as sandbox:
+        with open(os.path.join(sandbox, 'large'), 'wb') as f:
+            f.truncate(options.large_file_mb * 1024 * 1024)
+        with open(os.path.join(sandbox, 'stdout'), 'w') as f:
+            f.write(''.join(f'line {i} of the task output\n' for i in range(100000)))
+
+        print(f'{options.slow_readers} slow readers, {options.tail_readers} tail readers, {options.duration}s per mode')
+        print(f'{"mode":<10}{"probe p50":>11}{"probe p99":>11}{"probe fail":>12}'
+              f'{"tail reads":>12}{"tail p50":>10}{"tail p99":>10}{"tail err":>10}{"slow MB":>9}')
+        for mode in options.modes:
+            stats = run_mode(mode, sandbox, options)
+            probes, tails = stats['probe-latencies'], stats['tail-latencies']
+            print(f'{mode:<10}'
+                  f'{percentile(probes, 0.5) * 1000:>9.1f}ms{percentile(probes, 0.99) * 1000:>9.1f}ms'
+                  f'{stats["probe-failures"]:>12}{len(tails):>12}'
+                  f'{percentile(tails, 0.5) * 1000:>8.1f}ms{percentile(tails, 0.99) * 1000:>8.1f}ms'
+                  f'{stats["tail-errors"]:>10}{stats["slow-bytes"] / 1024 / 1024:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -26,7 +26,7 @@ import logging
 import sys
 import threading
 
-from cook.sidecar import exit_sentinel, file_server, progress, util
+from cook.sidecar import async_file_server, exit_sentinel, file_server, progress, util
 from cook.sidecar.version import VERSION
 
 
@@ -35,8 +35,9 @@ def main(args=None):
 
     parser = argparse.ArgumentParser(description='Cook Sidecar')
     parser.add_argument('--exit-sentinel-file-path', metavar='PATH', help='file path which signals this process to exit when it appears')
+    parser.add_argument('--file-server-mode', choices=['asyncio', 'gunicorn'], default='gunicorn', help='file server implementation, asyncio serves all connections from a single event loop')
     parser.add_argument('--file-server-port', type=int, metavar='PORT', help='file server port number')
-    parser.add_argument('--file-server-threads', type=int, default=2, metavar='THREADS', help='file server threads-per-worker count')
+    parser.add_argument('--file-server-threads', type=int, default=2, metavar='THREADS', help='file server threads-per-worker count (asyncio mode: file system thread pool size)')
     parser.add_argument('--file-server-workers', type=int, default=2, metavar='WORKERS', help='file server worker process count')
     parser.add_argument('--no-file-server', action='store_true', help='disable sandbox file server')
     parser.add_argument('--no-progress-reporter', action='store_true', help='disable progress reporter')
@@ -57,8 +58,11 @@ def main(args=None):
     if options.exit_sentinel_file_path:
         exit_sentinel.watch_for_file(options.exit_sentinel_file_path, all_started_event)
 
-    # Start Flask file server (blocking)
-    if not options.no_file_server:
+    # Start file server (blocking)
+    if not options.no_file_server and options.file_server_mode == 'asyncio':
+        file_server_args = [options.file_server_port, options.file_server_threads]
+        exit_code = async_file_server.start_file_server(all_started_event, file_server_args)
+    elif not options.no_file_server:
         file_server_args = [options.file_server_port, options.file_server_workers, options.file_server_threads]
         exit_code = file_server.start_file_server(all_started_event, file_server_args)
     # Wait for progress reporter threads (blocking)
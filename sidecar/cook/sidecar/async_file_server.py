@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+#
+#  Copyright (c) 2020 Two Sigma Open Source, LLC
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+#  IN THE SOFTWARE.
+#
+"""Asyncio implementation of the Mesos file access REST API to serve Cook job logs, see cook.sidecar.files.
+A single event loop serves every connection, so that slow readers, e.g. `cs tail -f` clients, never hold a worker
+that other requests, including the readiness probe, are waiting for. Downloads are sent with os.sendfile."""
+
+import asyncio
+import email.utils
+import logging
+import os
+import signal
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+
+from cook.sidecar import files, util
+from cook.sidecar.version import VERSION
+
+# Seconds an idle keep-alive connection is kept open
+KEEP_ALIVE_TIMEOUT_SECS = 60
+# Upper bound on the size of the request line and of every header line
+MAX_LINE_LENGTH = 64 * 1024
+MAX_HEADERS = 100
+# Backlog of the listening socket, sized for hundreds of clients connecting at once
+LISTEN_BACKLOG = 1024
+
+JSON_CONTENT_TYPE = 'application/json'
+TEXT_CONTENT_TYPE = 'text/html; charset=utf-8'
+
+
+def start_file_server(started_event, args):
+    try:
+        logging.info(f'Starting cook.sidecar {VERSION} asyncio file server')
+        port, threads = (args + [None] * 2)[0:2]
+        if port is None:
+            logging.error('Must provide file server port')
+            sys.exit(1)
+        cook_workdir = os.environ.get('COOK_WORKDIR')
+        if not cook_workdir:
+            logging.error('COOK_WORKDIR environment variable must be set')
+            sys.exit(1)
+        server = AsyncFileServer(cook_workdir, port, 2 if threads is None else threads)
+        asyncio.run(server.run(started_event))
+        return 0
+
+    except Exception as e:
+        logging.exception(f'exception when running asyncio file server with {args}')
+        return 1
+
+
+def prepare_read(sandbox_directory, args, request_headers):
+    '''Returns the headers and chunks of a /files/read response, a response of a single chunk is read at once
+    so that small reads, e.g. of tail readers, are served with a single trip to the thread pool.'''
+    chunks = files.read_file(sandbox_directory, args, request_headers)
+    headers = files.read_headers(chunks)
+    if isinstance(chunks, files.ReadResponse) and chunks.length <= files.READ_CHUNK_SIZE:
+        return headers, [b''.join(chunks)]
+    return headers, chunks
+
+
+class HttpRequest(object):
+    def __init__(self, method, path, args, headers, version):
+        self.method = method
+        self.path = path
+        self.args = args
+        self.headers = headers
+        self.version = version
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            self.keep_alive = connection != 'close'
+        else:
+            self.keep_alive = connection == 'keep-alive'
+
+
+class AsyncFileServer(object):
+    '''
+    HTTP/1.1 server for the files endpoints, with keep-alive connections.
+    The file system calls of the read and browse endpoints run on a small thread pool.
+    '''
+
+    def __init__(self, sandbox_directory, port, threads):
+        self.sandbox_directory = sandbox_directory
+        self.port = port
+        self.threads = threads
+        self.connections = set()
+        self.followers = set()
+        self.stopped = None
+        self.routes = {'/files/browse': self.browse,
+                       '/files/browse.json': self.browse,
+                       '/files/download': self.download,
+                       '/files/download.json': self.download,
+                       '/files/follow': self.follow,
+                       '/files/read': self.read,
+                       '/files/read.json': self.read,
+                       '/readiness-probe': self.readiness_probe}
+
+    async def run(self, started_event):
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.threads))
+        self.stopped = asyncio.Event()
+        self.install_signal_handlers(loop)
+        server = await asyncio.start_server(self.handle_connection, '0.0.0.0', self.port,
+                                            limit=MAX_LINE_LENGTH, backlog=LISTEN_BACKLOG)
+        logging.info(f'Sidecar file server is ready')
+        started_event.set()
+        await self.stopped.wait()
+        server.close()
+        # let the followers end their streams cleanly before the remaining connections are closed
+        for _ in range(100):
+            if not self.followers:
+                break
+            await asyncio.sleep(0.01)
+        for writer in list(self.connections):
+            writer.close()
+        await server.wait_closed()
+        logging.info(f'Sidecar file server stopped')
+
+    def install_signal_handlers(self, loop):
+        # The event loop takes over the termination signals, the existing handlers
+        # (e.g. the progress reporter's) are preserved and invoked before the server stops.
+        for sig in [signal.SIGINT, signal.SIGTERM]:
+            user_handler = signal.getsignal(sig)
+            if not callable(user_handler) or user_handler is signal.default_int_handler:
+                user_handler = None
+            loop.add_signal_handler(sig, self.handle_termination, sig, user_handler)
+
+    def handle_termination(self, sig, user_handler):
+        if user_handler is not None:
+            logging.info(f'Entering user handler for signal {sig}')
+            user_handler(sig, None)
+            logging.info(f'Exiting user handler for signal {sig}')
+        logging.info(f'Stopping sidecar file server on signal {sig}')
+        self.stopped.set()
+
+    async def handle_connection(self, reader, writer):
+        self.connections.add(writer)
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader), KEEP_ALIVE_TIMEOUT_SECS)
+                except files.FilesError as e:
+                    request = HttpRequest('GET', None, {}, {'connection': 'close'}, 'HTTP/1.1')
+                    await self.send_response(writer, request, e.status, e.message.encode())
+                    break
+                if request is None:
+                    break
+                keep_alive = await self.handle_request(request, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        except Exception:
+            logging.exception('Error while serving a file server connection')
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    async def read_request(self, reader):
+        '''Reads the next request of the connection, returns None once the client has closed it.'''
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return None
+            request_parts = request_line.decode('latin-1').split()
+            if len(request_parts) != 3:
+                raise files.FilesError('Malformed request line.\n', 400)
+            method, target, version = request_parts
+            headers = {}
+            while True:
+                header_line = await reader.readline()
+                if header_line in [b'\r\n', b'\n']:
+                    break
+                if not header_line:
+                    raise asyncio.IncompleteReadError(b'', None)
+                name, separator, value = header_line.decode('latin-1').partition(':')
+                if not separator or len(headers) >= MAX_HEADERS:
+                    raise files.FilesError('Malformed request headers.\n', 400)
+                headers[name.strip().lower()] = value.strip()
+            if 'transfer-encoding' in headers:
+                raise files.FilesError('Request bodies are not supported.\n', 400)
+            content_length = int(headers.get('content-length', 0))
+        except ValueError:
+            # raised when a line exceeds the stream limit or the content length is not a number
+            raise files.FilesError('Malformed request.\n', 400)
+        if content_length > MAX_LINE_LENGTH:
+            raise files.FilesError('Request bodies are not supported.\n', 400)
+        await reader.readexactly(content_length)
+        url = urlsplit(target)
+        args = {}
+        for name, value in parse_qsl(url.query, keep_blank_values=True):
+            args.setdefault(name, value)
+        return HttpRequest(method, url.path, args, headers, version)
+
+    async def handle_request(self, request, writer):
+        '''Serves the request, returns True when the connection can serve further requests.'''
+        try:
+            handler = self.routes.get(request.path)
+            if handler is None:
+                raise files.FilesError('', 404)
+            if request.method not in ['GET', 'HEAD']:
+                raise files.FilesError('', 405)
+            return await handler(request, writer)
+        except files.FilesError as e:
+            await self.send_response(writer, request, e.status, e.message.encode(), headers=e.headers)
+            return request.keep_alive
+
+    @staticmethod
+    def write_head(writer, request, status, content_type, content_length, headers=None):
+        '''Writes the status line and headers, a body without content_length is sent with the chunked encoding.'''
+        lines = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}',
+                 f'Server: cook-sidecar/{VERSION}',
+                 f'Date: {email.utils.formatdate(usegmt=True)}',
+                 f'Connection: {"keep-alive" if request.keep_alive else "close"}',
+                 f'Content-Type: {content_type}']
+        if content_length is not None:
+            lines.append(f'Content-Length: {content_length}')
+        elif request.version == 'HTTP/1.1' and status != 304:
+            lines.append('Transfer-Encoding: chunked')
+        lines.extend(f'{name}: {value}' for name, value in (headers or {}).items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+    async def send_response(self, writer, request, status, body, content_type=TEXT_CONTENT_TYPE, headers=None):
+        self.write_head(writer, request, status, content_type, len(body), headers)
+        if request.method != 'HEAD':
+            writer.write(body)
+        await writer.drain()
+
+    async def send_json(self, writer, request, data):
+        await self.send_response(writer, request, 200, files.json_bytes(data), JSON_CONTENT_TYPE)
+        return request.keep_alive
+
+    def start_chunks(self, writer, request, content_type, headers=None):
+        '''Writes the head of a body of unknown length, returns True when it is sent with the chunked encoding.'''
+        chunked = request.version == 'HTTP/1.1'
+        if not chunked:
+            # HTTP/1.0 clients do not support the chunked encoding, the end of the body is the end of the connection
+            request.keep_alive = False
+        self.write_head(writer, request, 200, content_type, None, headers)
+        return chunked
+
+    @staticmethod
+    def write_chunk(writer, chunk, chunked):
+        if chunked:
+            writer.write(f'{len(chunk):x}\r\n'.encode())
+            writer.write(chunk)
+            writer.write(b'\r\n')
+        else:
+            writer.write(chunk)
+
+    async def send_chunks(self, writer, request, chunks, content_type, headers=None):
+        '''Streams the chunks, that are produced (and compressed) on the thread pool, and waits for every chunk to be sent.'''
+        chunked = self.start_chunks(writer, request, content_type, headers)
+        loop = asyncio.get_running_loop()
+        chunk_iterator = iter(chunks)
+        try:
+            while request.method != 'HEAD':
+                chunk = await loop.run_in_executor(None, next, chunk_iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    self.write_chunk(writer, chunk, chunked)
+                    await writer.drain()
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        if chunked and request.method != 'HEAD':
+            writer.write(b'0\r\n\r\n')
+        await writer.drain()
+        return request.keep_alive
+
+    async def download(self, request, writer):
+        download = files.download(self.sandbox_directory, request.args, request.headers)
+        if download.status == 200 and download.encoding is not None:
+            return await self.send_chunks(writer, request, download, download.content_type, download.headers)
+        try:
+            self.write_head(writer, request, download.status, download.content_type, download.content_length,
+                            download.headers)
+            await writer.drain()
+            if request.method == 'HEAD':
+                return request.keep_alive
+            loop = asyncio.get_running_loop()
+            for prefix, start, length in download.segments:
+                writer.write(prefix)
+                await writer.drain()
+                # The event loop sends the file with os.sendfile, without copying it through the process
+                num_bytes_sent = await loop.sendfile(writer.transport, download.file_obj, start, length)
+                if num_bytes_sent < length:
+                    logging.info(f'{download.path} was truncated while it was downloaded')
+                    return False
+            writer.write(download.trailer)
+            await writer.drain()
+        finally:
+            download.close()
+        return request.keep_alive
+
+    # This endpoint is not part of the Mesos API, see cook.sidecar.file_server.follow.
+    async def follow(self, request, writer):
+        loop = asyncio.get_running_loop()
+        follower = await loop.run_in_executor(None, files.follow_file, self.sandbox_directory, request.args)
+        self.followers.add(follower)
+        try:
+            chunked = self.start_chunks(writer, request, files.FOLLOW_CONTENT_TYPE)
+            await writer.drain()
+            if request.method == 'HEAD':
+                return request.keep_alive
+            last_record_time = loop.time()
+            while not self.stopped.is_set():
+                for record in follower.read_records():
+                    self.write_chunk(writer, record, chunked)
+                    await writer.drain()
+                    last_record_time = loop.time()
+                if loop.time() - last_record_time >= files.follow_keepalive_secs:
+                    self.write_chunk(writer, follower.keepalive_record(), chunked)
+                    await writer.drain()
+                    last_record_time = loop.time()
+                await self.wait_for_change(follower, last_record_time + files.follow_keepalive_secs - loop.time())
+            if chunked:
+                writer.write(b'0\r\n\r\n')
+            await writer.drain()
+            return False
+        finally:
+            self.followers.discard(follower)
+            follower.close()
+
+    async def wait_for_change(self, follower, timeout):
+        '''Waits until the followed file may have changed, the server is stopping, or timeout seconds have elapsed.'''
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        if follower.fileno() is None:
+            timeout = min(timeout, files.FOLLOW_POLL_INTERVAL_SECS)
+        else:
+            loop.add_reader(follower.fileno(), changed.set)
+        waiters = [asyncio.ensure_future(changed.wait()), asyncio.ensure_future(self.stopped.wait())]
+        try:
+            await asyncio.wait(waiters, timeout=max(0, timeout), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+            if follower.fileno() is not None:
+                loop.remove_reader(follower.fileno())
+                follower.discard_events()
+
+    async def read(self, request, writer):
+        headers, chunks = await asyncio.get_running_loop().run_in_executor(
+            None, prepare_read, self.sandbox_directory, request.args, request.headers)
+        if isinstance(chunks, list):
+            await self.send_response(writer, request, 200, b''.join(chunks), JSON_CONTENT_TYPE, headers)
+            return request.keep_alive
+        return await self.send_chunks(writer, request, chunks, JSON_CONTENT_TYPE, headers)
+
+    async def browse(self, request, writer):
+        data = await asyncio.get_running_loop().run_in_executor(
+            None, files.browse_directory, self.sandbox_directory, request.args)
+        return await self.send_json(writer, request, data)
+
+    # This endpoint is not part of the Mesos API, see cook.sidecar.file_server.readiness_probe.
+    async def readiness_probe(self, request, writer):
+        await self.send_response(writer, request, 200, b'')
+        return request.keep_alive
+
+
+def main():
+    util.init_logging()
+    if len(sys.argv) == 2 and sys.argv[1] == "--version":
+        print(VERSION)
+    else:
+        start_file_server(threading.Event(), [int(arg) for arg in sys.argv[1:]])
+
+
+if __name__ == '__main__':
+    main()
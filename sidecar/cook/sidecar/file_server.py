@@ -26,20 +26,16 @@ import logging
 import os
 import signal
 import sys
-from operator import itemgetter
-from pathlib import Path
-from stat import *
 
 import gunicorn.app.base
 import gunicorn.arbiter
-from flask import Flask, jsonify, request, send_file
+from flask import Flask, Response, jsonify, request, send_file
 
-from cook.sidecar import util
+from cook.sidecar import files, util
 from cook.sidecar.version import VERSION
 
 app = Flask(__name__)
 sandbox_directory = None
-max_read_length = int(os.environ.get('COOK_FILE_SERVER_MAX_READ_LENGTH', '25000000'))
 
 
 def start_file_server(started_event, args):
@@ -133,97 +129,50 @@ class FileServerApplication(gunicorn.app.base.BaseApplication):
             logging.exception('Error while running cook.sidecar file server')
 
 
-def path_is_valid(path):
-    if not os.path.exists(path):
-        return False
-    normalized_path = os.path.normpath(path)
-    return normalized_path.startswith(sandbox_directory)
+@app.errorhandler(files.FilesError)
+def files_error(e):
+    return e.message, e.status, e.headers
 
 
 @app.route('/files/download')
 @app.route('/files/download.json')
 def download():
-    path = request.args.get('path')
-    if path is None:
-        return "Expecting 'path=value' in query.\n", 400
-    if not path_is_valid(path):
-        return "", 404
-    if os.path.isdir(path):
-        return "Cannot download a directory.\n", 400
-    return send_file(path, as_attachment=True)
+    download = files.download(sandbox_directory, request.args, request.headers)
+    if download.status == 200 and download.encoding is None:
+        # send_file lets the wsgi server send the file with sendfile
+        response = send_file(download.file_obj, as_attachment=True,
+                             attachment_filename=os.path.basename(download.path), add_etags=False)
+    elif download.status == 304:
+        download.close()
+        response = Response(status=304)
+    else:
+        response = Response(download, status=download.status, content_type=download.content_type)
+    response.headers.update(download.headers)
+    if download.content_length is not None:
+        response.headers['Content-Length'] = download.content_length
+    return response
 
 
 @app.route('/files/read')
 @app.route('/files/read.json')
 def read():
-    path = request.args.get('path')
-    offset_param = request.args.get('offset', -1)
-    length_param = request.args.get('length', -1)
-    if path is None:
-        return "Expecting 'path=value' in query.\n", 400
-    try:
-        offset = int(offset_param)
-    except ValueError as _:
-        return f"Failed to parse offset: Failed to convert '{offset_param}' to number.\n", 400
-    if offset < -1:
-        return f"Negative offset provided: {offset_param}.\n", 400
-    try:
-        length = int(length_param)
-    except ValueError as _:
-        return f"Failed to parse length: Failed to convert '{length_param}' to number.\n", 400
-    if length < -1:
-        return f"Negative length provided: {length_param}.\n", 400
-    if not path_is_valid(path):
-        return "", 404
-    if os.path.isdir(path):
-        return "Cannot read a directory.\n", 400
-    if offset == -1:
-        return jsonify({
-            "data": "",
-            "offset": os.path.getsize(path),
-        })
-    f = open(path)
-    f.seek(offset)
-    length = max_read_length if length == -1 else length
-    if length > max_read_length:
-        return f"Requested length for file read, {length} is greater than max allowed length, {max_read_length}", 400
-    data = f.read(length)
-    f.close()
-    return jsonify({
-        "data": data,
-        "offset": offset,
-    })
-
-
-def make_permission_string(permission_bits):
-    return ''.join(["rwxrwxrwx"[i] if (permission_bits & (1 << (8 - i)) != 0) else "-" for i in range(0, 9)])
+    chunks = files.read_file(sandbox_directory, request.args, request.headers)
+    response = Response(chunks, mimetype='application/json')
+    response.headers.update(files.read_headers(chunks))
+    return response
+
+
+# This endpoint is not part of the Mesos API, it is only served in the asyncio mode.
+# A follower would hold a gunicorn thread for as long as it follows, starving the other requests.
+@app.route('/files/follow')
+def follow():
+    raise files.FilesError('Following files requires --file-server-mode asyncio', 501)
 
 
 @app.route('/files/browse')
 @app.route('/files/browse.json')
 def browse():
-    path = request.args.get('path')
-    if path is None:
-        return "Expecting 'path=value' in query.\n", 400
-    if not path_is_valid(path):
-        return "", 404
-    if not os.path.isdir(path):
-        return jsonify([])
-    retval = [
-        {
-            "gid": path_obj.group(),
-            "mode": ('d' if S_ISDIR(st.st_mode) else '-') + make_permission_string(S_IMODE(st.st_mode) % 512),
-            "mtime": int(st.st_mtime),
-            "nlink": st.st_nlink,
-            "path": path,
-            "size": st.st_size,
-            "uid": path_obj.owner(),
-        }
-        for st, path_obj, path in [(os.stat(path), Path(path), path)
-                                   for path in [os.path.join(path, f)
-                                                for f in os.listdir(path)]]
-    ]
-    return jsonify(sorted(retval, key=itemgetter("path")))
+    return jsonify(files.browse_directory(sandbox_directory, request.args))
 
 
 # This endpoint is not part of the Mesos API. It is used by the kubernetes readiness probe on the sidecar container.
@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+#
+#  Copyright (c) 2020 Two Sigma Open Source, LLC
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+#  IN THE SOFTWARE.
+#
+"""Implementation of the Mesos file access REST API shared by the gunicorn and asyncio file servers.
+The handlers take the query arguments as a mapping and raise FilesError to reject a request."""
+
+import email.utils
+import json
+import logging
+import mimetypes
+import os
+import re
+import secrets
+import select
+import time
+import unicodedata
+import zlib
+from operator import itemgetter
+from pathlib import Path
+from stat import *
+from urllib.parse import quote
+
+from cook.sidecar import inotify
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+max_read_length = int(os.environ.get('COOK_FILE_SERVER_MAX_READ_LENGTH', '25000000'))
+# Seconds without new data after which /files/follow sends a keepalive record
+follow_keepalive_secs = float(os.environ.get('COOK_FILE_SERVER_FOLLOW_KEEPALIVE_SECS', '15'))
+# Size of the file reads of /files/read, bounds the memory used by a request independently of the requested length
+READ_CHUNK_SIZE = 64 * 1024
+
+# Cache-Control max age of downloads, the default of flask's send_file
+DOWNLOAD_MAX_AGE_SECS = 43200
+# Upper bound on the number of ranges of a download, requests for more ranges are served the whole file
+MAX_RANGES = 32
+# Interval between two size checks of a followed file that cannot be watched with inotify
+FOLLOW_POLL_INTERVAL_SECS = 0.25
+# Upper bound on the time a blocking follower waits before checking whether the server is stopping
+FOLLOW_STOP_CHECK_SECS = 1
+
+FOLLOW_CONTENT_TYPE = 'application/x-ndjson'
+
+# Responses smaller than this many bytes are not worth compressing
+COMPRESSION_MIN_BYTES = 1024
+# Fast compression levels, job logs still compress well and the cost per request stays low
+GZIP_LEVEL = 3
+ZSTD_LEVEL = 3
+# Files that are already compressed are sent as they are
+COMPRESSED_EXTENSIONS = ('.7z', '.bz2', '.gz', '.tgz', '.xz', '.zip', '.zst')
+
+# Control characters, and the bytes that are not part of a valid UTF-8 sequence once decoded with surrogateescape
+JSON_ESCAPE_PATTERN = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\udc80-\udcff]')
+RANGE_SPEC_PATTERN = re.compile(r'\s*(\d*)-(\d*)\s*')
+TOKEN_PATTERN = re.compile(r"[\w!#$%&'*+.^`|~-]+", re.ASCII)
+
+
+class FilesError(Exception):
+    """Rejects a files request with a Mesos compatible message and http status."""
+
+    def __init__(self, message, status, headers=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.headers = headers
+
+
+def path_is_valid(sandbox_directory, path):
+    if not os.path.exists(path):
+        return False
+    normalized_path = os.path.normpath(path)
+    return normalized_path.startswith(sandbox_directory)
+
+
+def requested_path(args):
+    path = args.get('path')
+    if path is None:
+        raise FilesError("Expecting 'path=value' in query.\n", 400)
+    return path
+
+
+def requested_number(args, name):
+    """Returns the offset or length argument, -1 when it is absent."""
+    param = args.get(name, -1)
+    try:
+        value = int(param)
+    except ValueError as _:
+        raise FilesError(f"Failed to parse {name}: Failed to convert '{param}' to number.\n", 400)
+    if value < -1:
+        raise FilesError(f"Negative {name} provided: {param}.\n", 400)
+    return value
+
+
+def ensure_path_is_valid(sandbox_directory, path):
+    if not path_is_valid(sandbox_directory, path):
+        raise FilesError("", 404)
+
+
+def download_path(sandbox_directory, args):
+    """Returns the path of the file to download."""
+    path = requested_path(args)
+    ensure_path_is_valid(sandbox_directory, path)
+    if os.path.isdir(path):
+        raise FilesError("Cannot download a directory.\n", 400)
+    return path
+
+
+def content_type(path):
+    mime_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    return f'{mime_type}; charset=utf-8' if mime_type.startswith('text/') else mime_type
+
+
+def content_disposition(path):
+    filename = os.path.basename(path)
+    try:
+        filename.encode('ascii')
+        extended_filename = None
+    except UnicodeEncodeError:
+        extended_filename = quote(filename, safe='')
+        filename = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+    if not TOKEN_PATTERN.fullmatch(filename):
+        filename = '"' + filename.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    if extended_filename is None:
+        return f'attachment; filename={filename}'
+    return f"attachment; filename={filename}; filename*=UTF-8''{extended_filename}"
+
+
+def file_etag(stat_result, encoding=None):
+    """Returns the strong entity tag of a file version, built from its inode, size and modification time.
+    Every content coding of the file has its own entity tag."""
+    suffix = '' if encoding is None else f'-{encoding}'
+    return f'"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}{suffix}"'
+
+
+def available_encodings():
+    """Returns the supported content codings, in order of preference."""
+    return ['zstd', 'gzip'] if zstandard is not None else ['gzip']
+
+
+def response_encoding(request_headers, path, size):
+    """Returns the content coding, chosen from the Accept-Encoding header, to compress a response of size bytes
+    of path with, None when it is sent as it is."""
+    accept_encoding = request_headers.get('accept-encoding')
+    if accept_encoding is None or size < COMPRESSION_MIN_BYTES or path.lower().endswith(COMPRESSED_EXTENSIONS):
+        return None
+    qualities = {}
+    for accepted in accept_encoding.split(','):
+        coding, _, params = accepted.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    best_encoding, best_quality = None, 0.0
+    for encoding in available_encodings():
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best_encoding, best_quality = encoding, quality
+    return best_encoding
+
+
+def compress_chunks(chunks, encoding):
+    """Yields the chunks compressed with the content coding, the compressor only buffers what it has not emitted."""
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for chunk in chunks:
+            compressed_chunk = compressor.compress(chunk)
+            if compressed_chunk:
+                yield compressed_chunk
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def etag_matches(header, etag):
+    """Returns True if the If-None-Match header matches etag, with the weak comparison of RFC 7232."""
+    if header.strip() == '*':
+        return True
+    tags = [tag.strip() for tag in header.split(',')]
+    return any((tag[2:] if tag.startswith('W/') else tag) == etag for tag in tags)
+
+
+def range_is_current(if_range, etag, stat_result):
+    """Returns True if the If-Range validator matches the current version of the file, the range is sent only then.
+    Entity tags are compared strongly, a date only matches a modification time older than a second."""
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    last_modified = email.utils.formatdate(stat_result.st_mtime, usegmt=True)
+    return if_range == last_modified and time.time() - stat_result.st_mtime >= 1
+
+
+def parse_ranges(range_header, size):
+    """Returns the satisfiable [start, end) byte ranges of the Range header, None when it is ignored.
+    Raises a 416 FilesError when none of the ranges can be satisfied."""
+    unit, _, range_set = range_header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    range_specs = range_set.split(',')
+    if len(range_specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for range_spec in range_specs:
+        match = RANGE_SPEC_PATTERN.fullmatch(range_spec)
+        if match is None or match.group(1) == match.group(2) == '':
+            return None
+        first, last = match.group(1), match.group(2)
+        if first == '':
+            suffix_length = int(last)
+            if suffix_length > 0 and size > 0:
+                ranges.append((max(0, size - suffix_length), size))
+        else:
+            start = int(first)
+            if last != '' and int(last) < start:
+                return None
+            if start < size:
+                ranges.append((start, size if last == '' else min(size, int(last) + 1)))
+    if not ranges:
+        raise FilesError("", 416, {'Content-Range': f'bytes */{size}'})
+    return ranges
+
+
+class Download(object):
+    '''
+    The response to a /files/download request, evaluated from its If-None-Match, If-Range and Range headers.
+    The body is a sequence of segments followed by a trailer, every segment is a prefix followed by a range of the file:
+    the whole file (200), a single range (206), or the parts of a multipart/byteranges body (206).
+    A 304 response has no segments. Only whole files are compressed, ranges are always ranges of the file itself.
+    '''
+
+    def __init__(self, path, file_obj, stat_result, request_headers):
+        self.path = path
+        self.file_obj = file_obj
+        size = stat_result.st_size
+        range_header = request_headers.get('range')
+        if_range = request_headers.get('if-range')
+        range_applies = range_header is not None and (
+                if_range is None or range_is_current(if_range, file_etag(stat_result), stat_result))
+        self.encoding = None if range_applies else response_encoding(request_headers, path, size)
+        etag = file_etag(stat_result, self.encoding)
+        self.headers = {
+            'Content-Disposition': content_disposition(path),
+            'Accept-Ranges': 'bytes',
+            'Cache-Control': f'public, max-age={DOWNLOAD_MAX_AGE_SECS}',
+            'ETag': etag,
+            'Last-Modified': email.utils.formatdate(stat_result.st_mtime, usegmt=True),
+            'Vary': 'Accept-Encoding',
+        }
+        self.content_type = content_type(path)
+        self.trailer = b''
+        if_none_match = request_headers.get('if-none-match')
+        if if_none_match is not None and etag_matches(if_none_match, etag):
+            self.status = 304
+            self.segments = []
+            self.content_length = None
+            return
+        ranges = parse_ranges(range_header, size) if range_applies else None
+        if ranges is None:
+            self.status = 200
+            self.segments = [(b'', 0, size)]
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.status = 206
+            self.segments = [(b'', start, end - start)]
+            self.headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+        else:
+            boundary = secrets.token_hex(16)
+            self.status = 206
+            self.segments = [(f'\r\n--{boundary}\r\n'
+                              f'Content-Type: {self.content_type}\r\n'
+                              f'Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n'.encode(), start, end - start)
+                             for start, end in ranges]
+            self.trailer = f'\r\n--{boundary}--\r\n'.encode()
+            self.content_type = f'multipart/byteranges; boundary={boundary}'
+        self.content_length = sum(len(prefix) + length for prefix, _, length in self.segments) + len(self.trailer)
+        if self.encoding is not None:
+            self.headers['Content-Encoding'] = self.encoding
+            self.content_length = None
+
+    def __iter__(self):
+        return iter(self.body()) if self.encoding is None else compress_chunks(self.body(), self.encoding)
+
+    def body(self):
+        """Yields the body, the file ranges are read with os.pread in chunks of READ_CHUNK_SIZE bytes."""
+        try:
+            for prefix, start, length in self.segments:
+                yield prefix
+                position, end_position = start, start + length
+                while position < end_position:
+                    chunk = os.pread(self.file_obj.fileno(), min(READ_CHUNK_SIZE, end_position - position), position)
+                    if not chunk:
+                        return
+                    position += len(chunk)
+                    yield chunk
+            yield self.trailer
+        finally:
+            self.close()
+
+    def close(self):
+        self.file_obj.close()
+
+
+def download(sandbox_directory, args, request_headers):
+    """Returns the Download responding to the request, request_headers is a mapping with lower case keys."""
+    path = download_path(sandbox_directory, args)
+    file_obj = open(path, 'rb')
+    try:
+        return Download(path, file_obj, os.fstat(file_obj.fileno()), request_headers)
+    except Exception:
+        file_obj.close()
+        raise
+
+
+def read_file(sandbox_directory, args, request_headers):
+    """Returns the chunks of the {"data", "offset"} JSON response of the requested read, see ReadResponse.
+    request_headers is a mapping with lower case keys."""
+    path = requested_path(args)
+    offset = requested_number(args, 'offset')
+    length = requested_number(args, 'length')
+    ensure_path_is_valid(sandbox_directory, path)
+    if os.path.isdir(path):
+        raise FilesError("Cannot read a directory.\n", 400)
+    if offset == -1:
+        return [json_bytes({
+            "data": "",
+            "offset": os.path.getsize(path),
+        })]
+    length = max_read_length if length == -1 else length
+    if length > max_read_length:
+        raise FilesError(f"Requested length for file read, {length} is greater than max allowed length, {max_read_length}", 400)
+    fd = os.open(path, os.O_RDONLY)
+    num_bytes = max(0, min(length, os.fstat(fd).st_size - offset))
+    return ReadResponse(fd, offset, length, response_encoding(request_headers, path, num_bytes))
+
+
+def read_headers(chunks):
+    """Returns the headers describing the content coding of the read_file response chunks."""
+    encoding = getattr(chunks, 'encoding', None)
+    headers = {'Vary': 'Accept-Encoding'}
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    return headers
+
+
+def json_bytes(data):
+    """Serializes data like flask's jsonify."""
+    return (json.dumps(data, separators=(',', ':'), sort_keys=True) + '\n').encode()
+
+
+def escape_json_character(match):
+    code_point = ord(match.group())
+    # a surrogate escapes the byte code_point - 0xdc00, it is sent as the code point of the same value, like latin-1
+    return '\\u%04x' % (code_point - 0xdc00 if code_point >= 0xdc80 else code_point)
+
+
+def escape_json_bytes(data):
+    """Escapes data as the content of a JSON string that is valid UTF-8.
+    The valid UTF-8 sequences are kept as they are, the other bytes, e.g. those of a multi-byte character cut by the
+    offset or the length of a read, are escaped one by one as \\u00XX."""
+    text = data.decode('utf-8', 'surrogateescape')
+    text = text.replace('\\', '\\\\').replace('"', '\\"')
+    text = text.replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t')
+    return JSON_ESCAPE_PATTERN.sub(escape_json_character, text).encode()
+
+
+def incomplete_utf8_length(data):
+    """Returns the number of bytes at the end of data that start a multi-byte UTF-8 character without completing it."""
+    for length in range(1, min(len(data), 3) + 1):
+        byte = data[-length]
+        if byte < 0x80 or byte >= 0xf8:
+            return 0
+        if byte >= 0xc0:
+            expected_length = 2 if byte < 0xe0 else 3 if byte < 0xf0 else 4
+            return length if length < expected_length else 0
+    return 0
+
+
+class ReadResponse(object):
+    '''
+    The {"data", "offset"} JSON response of /files/read, iterated over as chunks.
+    Like the Mesos agent, offset and length count bytes. The data holds the valid UTF-8 sequences of the file as they
+    are, the bytes of a character cut by the offset or the length of the read are escaped, see escape_json_bytes.
+    The file is read with os.pread in chunks of READ_CHUNK_SIZE bytes, that are escaped and released one by one,
+    so the memory used does not depend on the requested length, a character cut by a chunk is completed by the next.
+    The chunks are compressed when encoding is set.
+    '''
+
+    def __init__(self, fd, offset, length, encoding=None):
+        self.fd = fd
+        self.offset = offset
+        self.length = length
+        self.encoding = encoding
+
+    def __iter__(self):
+        return iter(self.envelope()) if self.encoding is None else compress_chunks(self.envelope(), self.encoding)
+
+    def envelope(self):
+        try:
+            yield b'{"data":"'
+            position = self.offset
+            end_position = self.offset + self.length
+            incomplete = b''
+            while position < end_position:
+                chunk = os.pread(self.fd, min(READ_CHUNK_SIZE, end_position - position), position)
+                if not chunk:
+                    break
+                position += len(chunk)
+                chunk = incomplete + chunk
+                incomplete_length = incomplete_utf8_length(chunk) if position < end_position else 0
+                incomplete = chunk[len(chunk) - incomplete_length:] if incomplete_length else b''
+                yield escape_json_bytes(chunk[:len(chunk) - incomplete_length])
+            yield escape_json_bytes(incomplete) + f'","offset":{self.offset}}}\n'.encode()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class FileFollower(object):
+    '''
+    Follows a file as it grows, from a byte offset, for the /files/follow endpoint.
+    The file is streamed as newline delimited {"data", "offset"} records, the records of /files/read,
+    every record holds at most READ_CHUNK_SIZE bytes, and a record without data reports the current offset.
+    Growth is detected with inotify, or by polling the file size when inotify is unavailable.
+    A truncated file is followed again from its start.
+    '''
+
+    def __init__(self, path, fd, offset):
+        self.path = path
+        self.fd = fd
+        self.offset = offset
+        self.inotify = None
+        if inotify.is_supported():
+            try:
+                self.inotify = inotify.Inotify()
+                self.inotify.add_watch(path, inotify.IN_MODIFY)
+            except OSError:
+                logging.exception(f'Unable to watch {path} using inotify, falling back to polling')
+                self.close_inotify()
+
+    def fileno(self):
+        """Returns the inotify file descriptor, that becomes readable when the file changes, None when polling."""
+        return None if self.inotify is None else self.inotify.fileno()
+
+    def read_records(self):
+        """Yields the records of the bytes appended to the file since the last read."""
+        if os.fstat(self.fd).st_size < self.offset:
+            logging.info(f'{self.path} was truncated, following it from the start')
+            self.offset = 0
+        while True:
+            chunk = os.pread(self.fd, READ_CHUNK_SIZE, self.offset)
+            if not chunk:
+                return
+            if len(chunk) == READ_CHUNK_SIZE:
+                # more bytes follow, a character cut by the chunk is sent whole in the next record
+                chunk = chunk[:len(chunk) - incomplete_utf8_length(chunk)] or chunk
+            yield b'{"data":"' + escape_json_bytes(chunk) + f'","offset":{self.offset}}}\n'.encode()
+            self.offset += len(chunk)
+
+    def keepalive_record(self):
+        return json_bytes({"data": "", "offset": self.offset})
+
+    def discard_events(self):
+        if self.inotify is not None:
+            while self.inotify.read_events():
+                pass
+
+    def wait(self, timeout):
+        """Blocks until the file may have changed or timeout seconds have elapsed."""
+        if self.inotify is None:
+            time.sleep(min(timeout, FOLLOW_POLL_INTERVAL_SECS))
+        else:
+            select.select([self.inotify.fileno()], [], [], timeout)
+            self.discard_events()
+
+    def records(self, stopped):
+        """Yields the records of the file as it grows, blocking while it does not, until stopped() returns True.
+        A keepalive record is sent after follow_keepalive_secs without data."""
+        try:
+            last_record_time = time.monotonic()
+            while not stopped():
+                for record in self.read_records():
+                    last_record_time = time.monotonic()
+                    yield record
+                if time.monotonic() - last_record_time >= follow_keepalive_secs:
+                    last_record_time = time.monotonic()
+                    yield self.keepalive_record()
+                self.wait(FOLLOW_STOP_CHECK_SECS)
+        finally:
+            self.close()
+
+    def close_inotify(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+    def close(self):
+        self.close_inotify()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def follow_file(sandbox_directory, args):
+    """Returns the FileFollower of the requested file, from its end when no offset is requested."""
+    path = requested_path(args)
+    offset = requested_number(args, 'offset')
+    ensure_path_is_valid(sandbox_directory, path)
+    if os.path.isdir(path):
+        raise FilesError("Cannot follow a directory.\n", 400)
+    fd = os.open(path, os.O_RDONLY)
+    return FileFollower(path, fd, os.fstat(fd).st_size if offset == -1 else offset)
+
+
+def make_permission_string(permission_bits):
+    return ''.join(["rwxrwxrwx"[i] if (permission_bits & (1 << (8 - i)) != 0) else "-" for i in range(0, 9)])
+
+
+def browse_directory(sandbox_directory, args):
+    """Returns the list of entries of the requested directory, sorted by path."""
+    path = requested_path(args)
+    ensure_path_is_valid(sandbox_directory, path)
+    if not os.path.isdir(path):
+        return []
+    retval = [
+        {
+            "gid": path_obj.group(),
+            "mode": ('d' if S_ISDIR(st.st_mode) else '-') + make_permission_string(S_IMODE(st.st_mode) % 512),
+            "mtime": int(st.st_mtime),
+            "nlink": st.st_nlink,
+            "path": path,
+            "size": st.st_size,
+            "uid": path_obj.owner(),
+        }
+        for st, path_obj, path in [(os.stat(path), Path(path), path)
+                                   for path in [os.path.join(path, f)
+                                                for f in os.listdir(path)]]
+    ]
+    return sorted(retval, key=itemgetter("path"))
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+#
+#  Copyright (c) 2020 Two Sigma Open Source, LLC
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+#  IN THE SOFTWARE.
+#
+"""Minimal ctypes binding to the Linux inotify API, used to follow growing sandbox files."""
+
+import errno
+import logging
+import os
+import struct
+import sys
+
+IN_MODIFY = 0x00000002
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+_event_header = struct.Struct('iIII')
+_libc = None
+
+
+def _load_libc():
+    """Loads the C library exposing the inotify functions, returns None when inotify is unavailable."""
+    global _libc
+    if _libc is None:
+        if not sys.platform.startswith('linux'):
+            _libc = False
+        else:
+            try:
+                import ctypes
+                import ctypes.util
+                libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+                libc.inotify_init1.argtypes = [ctypes.c_int]
+                libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+                _libc = libc
+            except (AttributeError, OSError):
+                logging.exception('Unable to load inotify functions from libc')
+                _libc = False
+    return _libc or None
+
+
+def is_supported():
+    """Returns true if the inotify API is available on the current platform."""
+    return _load_libc() is not None
+
+
+def _raise_os_error(message):
+    import ctypes
+    error_number = ctypes.get_errno()
+    raise OSError(error_number, f'{message}: {os.strerror(error_number)}')
+
+
+class Inotify(object):
+    """Wraps a non-blocking inotify file descriptor."""
+
+    def __init__(self):
+        libc = _load_libc()
+        if libc is None:
+            raise OSError(errno.ENOSYS, f'inotify is not supported on {sys.platform}')
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            _raise_os_error('inotify_init1 failed')
+
+    def fileno(self):
+        """Returns the inotify file descriptor, it becomes readable when events are available."""
+        return self.fd
+
+    def add_watch(self, path, mask):
+        """Adds a watch for the events in mask on path and returns the watch descriptor."""
+        watch_descriptor = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if watch_descriptor < 0:
+            _raise_os_error(f'inotify_add_watch failed for {path}')
+        return watch_descriptor
+
+    def read_events(self):
+        """Reads the pending events without blocking, at most a single buffer of events is read.
+
+        Returns
+        -------
+        a list of (watch_descriptor, mask, name) tuples, name is the empty string for events on the watched path.
+        """
+        events = []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return events
+        offset = 0
+        while offset + _event_header.size <= len(data):
+            watch_descriptor, mask, _, name_length = _event_header.unpack_from(data, offset)
+            offset += _event_header.size
+            name = data[offset:offset + name_length].rstrip(b'\0')
+            offset += name_length
+            events.append((watch_descriptor, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        """Closes the inotify file descriptor, all watches are removed."""
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
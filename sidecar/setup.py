@@ -13,6 +13,11 @@ requirements = [
 test_requirements = [
 ]
 
+extras = {
+    # zstd content encoding of the file server responses
+    'zstd': ['zstandard'],
+}
+
 setup(
     name='cook_sidecar',
     version=version.VERSION,
@@ -21,5 +26,6 @@ setup(
     packages=['cook.sidecar'],
     entry_points={'console_scripts': ['cook-sidecar = cook.sidecar.__main__:main']},
     install_requires=requirements,
+    extras_require=extras,
     tests_require=test_requirements
 )
@@ -0,0 +1,39 @@
+import json
+import os
+import tempfile
+import unittest
+
+from cook.sidecar import files
+
+
+def read_json(path, offset, length):
+    fd = os.open(path, os.O_RDONLY)
+    body = b''.join(files.ReadResponse(fd, offset, length))
+    # the body is valid UTF-8 JSON, whatever bytes the offset and the length cut
+    return json.loads(body.decode('utf-8'))
+
+
+class FilesTest(unittest.TestCase):
+    def test_escape_json_bytes(self):
+        data = b'tab\t "quoted" back\\slash \x01 caf\xc3\xa9 \xe2\x82\xac\n'
+        self.assertEqual(data.decode(), json.loads(b'"' + files.escape_json_bytes(data) + b'"'))
+        # the bytes that are not part of a valid UTF-8 sequence are escaped one by one
+        self.assertEqual(b'\\u00e2\\u0082 \\u00ff', files.escape_json_bytes(b'\xe2\x82 \xff'))
+
+    def test_read_across_split_multi_byte_characters(self):
+        # euro signs are 3 bytes long, they are cut by the chunks and by the offset and length of the reads
+        content = b'x' + '€'.encode() * (files.READ_CHUNK_SIZE // 3 + 10)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(content)
+            f.flush()
+
+            response = read_json(f.name, 0, len(content))
+            self.assertEqual({'data': content.decode(), 'offset': 0}, response)
+
+            response = read_json(f.name, 2, files.READ_CHUNK_SIZE + 3)
+            data = content[2:files.READ_CHUNK_SIZE + 5]
+            # the bytes of the characters cut by the read are sent as one code point per byte
+            self.assertEqual({'data': '\x82\xac' + data[2:-2].decode() + '\xe2\x82', 'offset': 2}, response)
+
+if __name__ == '__main__':
+    unittest.main()